@@ -0,0 +1,110 @@
+"""Configuración del registro (logging) de la aplicación
+
+Cada módulo usa logging.getLogger(__name__). Los volcados de payloads se
+pasan envueltos en Pretty(...) como argumento del mensaje, de modo que la
+serialización solo ocurre si el nivel DEBUG está activo para ese módulo.
+"""
+import re
+import sys
+import logging
+from logging.handlers import RotatingFileHandler
+from config import LOG_DIR, LOG_LEVEL, LOG_LEVELS, LOG_MAX_MB, LOG_BACKUPS
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+# Claves cuyo valor nunca se escribe en el registro
+SECRET_KEYS = {
+    "api_token", "token", "authorization", "password", "mail_password", "db_password",
+    "certificate", "certificate_password", "pin", "software_pin", "ds_software_pin",
+}
+MASK = "***"
+
+# Secretos dentro de texto ya formateado (encabezados, JSON serializado)
+SECRET_PATTERNS = [
+    (re.compile(r"(Bearer\s+)[A-Za-z0-9._\-]+"), r"\1" + MASK),
+    (re.compile(r'("(?:%s)"\s*:\s*)"[^"]*"' % "|".join(sorted(SECRET_KEYS)), re.IGNORECASE), r'\1"' + MASK + '"'),
+]
+
+_configured = False
+
+
+def redact(obj):
+    """Copia del objeto con los valores secretos enmascarados"""
+    if isinstance(obj, dict):
+        return {key: MASK if str(key).lower() in SECRET_KEYS and value else redact(value)
+                for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [redact(value) for value in obj]
+    return obj
+
+
+class Pretty:
+    """JSON indentado y sin secretos, calculado solo si el mensaje se emite"""
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        import json_codec
+        return json_codec.pretty(redact(self.obj))
+
+
+class RedactingFilter(logging.Filter):
+    """Enmascara tokens y contraseñas en el mensaje ya formateado"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        for pattern, replacement in SECRET_PATTERNS:
+            message = pattern.sub(replacement, message)
+        record.msg, record.args = message, None
+        return True
+
+
+def parse_levels(spec: str) -> dict:
+    """"modulo=NIVEL,otro=NIVEL" → {"modulo": "NIVEL", ...}"""
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level: str = None, levels: str = None):
+    """Configurar consola y archivo rotativo en LOG_DIR (idempotente)"""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+
+    root = logging.getLogger()
+    root.setLevel(level or LOG_LEVEL)
+    formatter = logging.Formatter(LOG_FORMAT)
+    redacting = RedactingFilter()
+
+    try:
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        file_handler = RotatingFileHandler(LOG_DIR / "app.log", maxBytes=int(LOG_MAX_MB * 1024 * 1024),
+                                           backupCount=LOG_BACKUPS, encoding="utf-8")
+        file_handler.setFormatter(formatter)
+        file_handler.addFilter(redacting)
+        root.addHandler(file_handler)
+    except OSError as e:
+        if sys.stderr:
+            sys.stderr.write(f"No se pudo abrir el archivo de registro en {LOG_DIR}: {e}\n")
+
+    # Los ejecutables sin consola (PyInstaller --noconsole) no tienen stderr
+    if sys.stderr:
+        console = logging.StreamHandler()
+        console.setFormatter(formatter)
+        console.addFilter(redacting)
+        root.addHandler(console)
+
+    # Librerías muy verbosas en DEBUG (salvo que se configuren explícitamente)
+    module_levels = parse_levels(levels if levels is not None else LOG_LEVELS)
+    for name in ("urllib3", "flet", "flet_core", "flet_runtime", "asyncio"):
+        module_levels.setdefault(name, "WARNING")
+    for name, module_level in module_levels.items():
+        logging.getLogger(name).setLevel(module_level)
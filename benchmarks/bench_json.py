@@ -0,0 +1,115 @@
+"""Benchmark del codificador JSON (orjson frente a la librería estándar)
+
+Mide serializar/deserializar payloads de factura de distinto tamaño y una
+respuesta de ApiDian con el sobre SOAP y un adjunto en base64.
+
+Uso:
+    python benchmarks/bench_json.py [--repeat 200]
+"""
+import os
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_payload import make_parsed
+from services.payload_compiler import compile_lines
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def make_invoice_payload(num_lines: int) -> dict:
+    """Payload de factura como el que se envía a ApiDian"""
+    compiled = compile_lines(make_parsed(num_lines))
+    return {
+        "number": 990000001,
+        "type_document_id": 1,
+        "date": "2024-05-02",
+        "time": "08:15:00",
+        "resolution_number": "18760000001",
+        "prefix": "SETP",
+        "sendmail": True,
+        "customer": {
+            "identification_number": "900123456",
+            "dv": "8",
+            "name": "CLIENTE DE PRUEBA S.A.S.",
+            "phone": "3001234567",
+            "address": "CALLE 1 # 2-3",
+            "email": "cliente@example.com",
+            "merchant_registration": "0000000-00",
+            "type_document_identification_id": 6,
+            "type_organization_id": 1,
+            "type_liability_id": 117,
+            "municipality_id": 149,
+            "type_regime_id": 1,
+        },
+        "payment_form": {"payment_form_id": 1, "payment_method_id": 10, "payment_due_date": "2024-05-02",
+                         "duration_measure": "0"},
+        "legal_monetary_totals": compiled["legal_monetary_totals"],
+        "tax_totals": compiled["tax_totals"],
+        "invoice_lines": compiled["lines"],
+    }
+
+
+def make_api_response(attachment_kb: int = 150) -> dict:
+    """Respuesta de ApiDian con sobre SOAP y adjunto en base64"""
+    rnd = random.Random(1)
+    blob = base64.b64encode(bytes(rnd.getrandbits(8) for _ in range(attachment_kb * 1024))).decode("ascii")
+    return {
+        "success": True,
+        "message": "Factura #SETP990000001 generada con éxito",
+        "ResponseDian": {"Envelope": {"Body": {"SendBillSyncResponse": {"SendBillSyncResult": {
+            "IsValid": "true",
+            "StatusCode": "00",
+            "StatusDescription": "Procesado Correctamente.",
+            "ErrorMessage": {"string": ["Regla: FAJ43b, Notificación: Nombre informado No corresponde"]},
+            "XmlBase64Bytes": blob,
+            "XmlDocumentKey": "8bb918b19ba22a694f1da11c643b5e9de39adf60311cf179179e9b33381030bcd4c3c3f156c506ed5908f9276f5bd9b4",
+            "XmlFileName": "fv09005089080002400000001",
+        }}}}},
+        "urlinvoicexml": "FES-SETP990000001.xml",
+        "urlinvoicepdf": "FES-SETP990000001.pdf",
+        "cufe": "8bb918b19ba22a694f1da11c643b5e9de39adf60311cf179179e9b33381030bcd4c3c3f156c506ed5908f9276f5bd9b4",
+    }
+
+
+def bench(name: str, func, repeat: int) -> float:
+    func()  # Calentamiento
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    per_call = (time.perf_counter() - start) / repeat
+    print(f"  {name:<22} {per_call * 1000:8.3f} ms")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    cases = [(f"factura {n} líneas", make_invoice_payload(n)) for n in (10, 100, 500)]
+    cases.append(("respuesta ApiDian", make_api_response()))
+
+    for name, obj in cases:
+        text = json.dumps(obj)
+        print(f"{name} ({len(text) / 1024:,.0f} KB)")
+        std_dump = bench("json.dumps", lambda: json.dumps(obj), args.repeat)
+        std_load = bench("json.loads", lambda: json.loads(text), args.repeat)
+        if orjson is None:
+            print("  orjson no está instalado")
+            continue
+        fast_dump = bench("orjson.dumps", lambda: orjson.dumps(obj), args.repeat)
+        fast_load = bench("orjson.loads", lambda: orjson.loads(text), args.repeat)
+        print(f"  aceleración: dumps x{std_dump / fast_dump:.1f}, loads x{std_load / fast_load:.1f}")
+
+
+if __name__ == "__main__":
+    main()
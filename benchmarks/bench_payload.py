@@ -0,0 +1,68 @@
+"""Benchmark del compilador de payloads (facturas y documentos soporte de 500 líneas)
+
+Uso:
+    python benchmarks/bench_payload.py [--lines 500] [--repeat 200]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.payload_compiler import compile_lines, compile_support_lines
+
+
+def make_parsed(num_lines: int, seed: int = 1) -> dict:
+    """Datos parseados sintéticos con mezcla de IVA 0/5/19% e INC 8%"""
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(num_lines):
+        percent = rnd.choice([0, 5, 19, 8])
+        quantity = rnd.choice([1, 2, 3, 12])
+        unit_price = round(rnd.uniform(500, 250000), 2)
+        total = round(quantity * unit_price, 2)
+        lines.append({
+            "code": f"P{i:05d}",
+            "description": f"Producto de prueba {i}",
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "total": total,
+            "tax_id": 4 if percent == 8 else 1,
+            "tax_percent": percent,
+            "tax_amount": round(total * percent / 100, 2),
+        })
+    subtotal = sum(line["total"] for line in lines)
+    total_tax = sum(line["tax_amount"] for line in lines)
+    return {"lines": lines, "subtotal": subtotal, "total_tax": total_tax, "total": subtotal + total_tax}
+
+
+def bench(name: str, func, repeat: int, num_lines: int) -> float:
+    func()  # Calentamiento
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = time.perf_counter() - start
+    per_payload = elapsed / repeat
+    print(f"{name:<28} {per_payload * 1000:8.2f} ms/payload  {repeat / elapsed:8.1f} payloads/s  "
+          f"{num_lines * repeat / elapsed:10.0f} líneas/s")
+    return per_payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    parsed = make_parsed(args.lines)
+    today = time.strftime("%Y-%m-%d")
+    print(f"Líneas por documento: {args.lines}, repeticiones: {args.repeat}")
+    bench("factura / NC / ND", lambda: compile_lines(parsed), args.repeat, args.lines)
+    bench("documento soporte", lambda: compile_support_lines(parsed["lines"], today), args.repeat, args.lines)
+    bench("nota de ajuste DS", lambda: compile_support_lines(parsed["lines"]), args.repeat, args.lines)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""Benchmark de extremo a extremo: XMLs -> importación -> envío -> base de datos
+
+Genera N XMLs sintéticos en una carpeta temporal, los importa con
+FolderWatcherService.scan(), envía los pendientes con ApiDianService contra
+el ApiDian simulado (benchmarks/mock_apidian.py) y guarda todo en la base
+configurada: SQLite temporal por defecto o MySQL/MariaDB con --database-url.
+Reporta documentos por segundo de cada fase, latencia por etapa
+(p50/p95/p99 de document_metrics), resultados de los envíos y pico de RSS.
+
+Uso:
+    python benchmarks/e2e.py --count 200 --lines 1-30 --send-latency 300
+    python benchmarks/e2e.py --count 500 --workers 4 --json resultado.json --baseline anterior.json
+    python benchmarks/e2e.py --database-url "mysql+pymysql://root:@localhost/siigo_bench?charset=utf8mb4"
+
+Con MySQL use una base de pruebas: la configuración se modifica durante la
+corrida (se restaura al final) y los documentos creados se eliminan salvo --keep.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORK_DIR = None  # Carpeta temporal de la corrida (se crea en main)
+
+
+def peak_rss_mb() -> float:
+    """Pico de memoria residente del proceso (MB)"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # macOS en bytes, Linux en KB
+    except ImportError:  # Windows
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(Counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / (1024 * 1024)
+
+
+def send(document_id: int) -> str:
+    """Enviar un documento como DocumentsView._send_document (sin interfaz)"""
+    from database import get_session, Document
+    from services import ApiDianService
+
+    session = get_session()
+    doc = session.query(Document).get(document_id)
+    doc.status = "processing"
+    session.commit()
+    session.refresh(doc)
+    session.expunge(doc)
+    session.close()
+
+    service = ApiDianService()
+    senders = {"invoice": service.send_invoice, "credit_note": service.send_credit_note,
+               "debit_note": service.send_debit_note}
+    sender = senders.get(doc.type)
+    if sender is None:
+        return "unsupported"
+    sender(doc)
+
+    session = get_session()
+    status = session.query(Document.status).filter(Document.id == document_id).scalar()
+    session.close()
+    return status or "error"
+
+
+def stage_latencies(since) -> list:
+    """p50/p95/p99 por operación y etapa de las métricas guardadas en la corrida"""
+    from database import get_session, DocumentMetric
+    from services.metrics import percentile
+
+    session = get_session()
+    groups = {}
+    for operation, stage, duration_ms in session.query(
+            DocumentMetric.operation, DocumentMetric.stage, DocumentMetric.duration_ms).filter(
+            DocumentMetric.created_at >= since):
+        groups.setdefault((operation, stage), []).append(duration_ms or 0)
+    session.close()
+
+    rows = []
+    for (operation, stage), values in sorted(groups.items()):
+        values.sort()
+        rows.append({"operation": operation, "stage": stage, "count": len(values),
+                     "p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99)})
+    return rows
+
+
+class BenchSettings:
+    """Ajustar Settings/resolución para la corrida y restaurarlos al terminar"""
+
+    FIELDS = ("api_url", "api_token", "company_nit", "company_dv", "software_pin", "test_set_id",
+              "type_environment_id", "watch_folder", "processed_folder")
+
+    def __init__(self, api_url: str, watch_folder: str, processed_folder: str):
+        self.values = {"api_url": api_url, "api_token": "bench", "company_nit": "900123456", "company_dv": "8",
+                       "software_pin": "12345", "test_set_id": None, "type_environment_id": 2,
+                       "watch_folder": watch_folder, "processed_folder": processed_folder}
+        self.saved = {}
+        self.resolution_id = None
+
+    def __enter__(self):
+        from database import get_session, Settings, Resolution
+        session = get_session()
+        settings = session.query(Settings).first()
+        for field in self.FIELDS:
+            self.saved[field] = getattr(settings, field)
+            setattr(settings, field, self.values[field])
+        if not session.query(Resolution).filter(Resolution.type_document_id == 1, Resolution.prefix == "SETP").first():
+            resolution = Resolution(type_document_id=1, type_document_name="Factura de Venta", prefix="SETP",
+                                    resolution="18760000001", technical_key="fc8eac422eba16e22ffd8c6f94b3f40a6e38162c",
+                                    from_number=990000000, to_number=995000000, is_active=True)
+            session.add(resolution)
+            session.flush()
+            self.resolution_id = resolution.id
+        session.commit()
+        session.close()
+        return self
+
+    def __exit__(self, *exc):
+        from database import get_session, Settings, Resolution
+        session = get_session()
+        settings = session.query(Settings).first()
+        for field, value in self.saved.items():
+            setattr(settings, field, value)
+        if self.resolution_id:
+            session.query(Resolution).filter(Resolution.id == self.resolution_id).delete()
+        session.commit()
+        session.close()
+
+
+def cleanup(filenames: list, since):
+    """Eliminar documentos, respuestas y métricas creados por la corrida"""
+    from database import get_session, Document, DocumentResponse, DocumentMetric
+    session = get_session()
+    ids = [doc_id for (doc_id,) in session.query(Document.id).filter(Document.xml_filename.in_(filenames))]
+    if ids:
+        session.query(DocumentResponse).filter(DocumentResponse.document_id.in_(ids)).delete(synchronize_session=False)
+        session.query(Document).filter(Document.id.in_(ids)).delete(synchronize_session=False)
+    session.query(DocumentMetric).filter(DocumentMetric.created_at >= since).delete(synchronize_session=False)
+    session.commit()
+    session.close()
+
+
+def database_engine():
+    from database import engine
+    return engine
+
+
+def run(args) -> dict:
+    from datetime import datetime
+    import database
+    from database import get_session, Document
+    from services import FolderWatcherService, ApiDianService
+    from benchmarks.mock_apidian import MockApiDian
+    from benchmarks.xml_corpus import write_corpus, parse_range, parse_mix, DOCUMENT_TYPES
+
+    database.init_db()
+    mock = MockApiDian(send_latency_ms=args.send_latency, other_latency_ms=args.other_latency,
+                       error_rate=args.error_rate, reject_rate=args.reject_rate, seed=args.seed).start()
+    watch_folder = os.path.join(WORK_DIR, "xml")
+    processed_folder = os.path.join(WORK_DIR, "procesados")
+    start_number = args.start_number or 990000000 + int(time.time()) % 4000000  # Evita choques con corridas previas
+
+    paths = write_corpus(watch_folder, args.count, parse_range(args.lines), type_mix=parse_mix(args.types, DOCUMENT_TYPES),
+                         seed=args.seed, start_number=start_number)
+    filenames = [os.path.basename(path) for path in paths]
+    since = datetime.now()
+    result = {"count": args.count, "workers": args.workers, "database": database.engine.dialect.name,
+              "python": platform.python_version(), "platform": f"{platform.system()} {platform.machine()}"}
+
+    try:
+        with BenchSettings(mock.base_url, watch_folder, processed_folder):
+            start = time.perf_counter()
+            scan = FolderWatcherService().scan()
+            ingest_s = time.perf_counter() - start
+
+            session = get_session()
+            pending = [doc_id for (doc_id,) in session.query(Document.id).filter(
+                Document.xml_filename.in_(filenames), Document.status == "pending").order_by(Document.id)]
+            session.close()
+
+            statuses = {}
+            lock = threading.Lock()
+
+            def send_one(doc_id):
+                status = send(doc_id)
+                with lock:
+                    statuses[status] = statuses.get(status, 0) + 1
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                list(pool.map(send_one, pending))
+            send_s = time.perf_counter() - start
+            ApiDianService.wait_for_artifacts(timeout=120)  # Descargas en segundo plano, fuera del tiempo de envío
+
+        result.update({
+            "ingest": {**scan, "seconds": round(ingest_s, 3), "docs_per_s": round(scan["processed"] / ingest_s, 2) if ingest_s else 0},
+            "send": {"documents": len(pending), "seconds": round(send_s, 3),
+                     "docs_per_s": round(len(pending) / send_s, 2) if send_s else 0, "statuses": statuses},
+            "total_docs_per_s": round(len(pending) / (ingest_s + send_s), 2) if pending else 0,
+            "stages": stage_latencies(since),
+            "mock": mock.stats(),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        })
+    finally:
+        mock.stop()
+        if not args.keep:
+            cleanup(filenames, since)
+    return result
+
+
+def report(result: dict, baseline: dict = None):
+    def change(key):
+        if not baseline:
+            return ""
+        old = baseline.get(key, {}).get("docs_per_s") if key != "total" else baseline.get("total_docs_per_s")
+        new = result[key]["docs_per_s"] if key != "total" else result["total_docs_per_s"]
+        return f"  ({new / old - 1:+.1%} vs línea base)" if old else ""
+
+    print(f"Documentos: {result['count']}  hilos de envío: {result['workers']}  base: {result['database']}")
+    ingest, sent = result["ingest"], result["send"]
+    print(f"Importación: {ingest['processed']} en {ingest['seconds']:.2f} s = {ingest['docs_per_s']:.1f} docs/s"
+          f" (errores {ingest['errors']}){change('ingest')}")
+    print(f"Envío:       {sent['documents']} en {sent['seconds']:.2f} s = {sent['docs_per_s']:.1f} docs/s"
+          f" {sent['statuses']}{change('send')}")
+    print(f"Total:       {result['total_docs_per_s']:.1f} docs/s{change('total')}")
+    print(f"Pico de RSS: {result['peak_rss_mb']:.0f} MB")
+    print(f"\n{'operación':<24} {'etapa':<12} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for row in result["stages"]:
+        print(f"{row['operation']:<24} {row['stage']:<12} {row['count']:>6} {row['p50']:9.1f} {row['p95']:9.1f} {row['p99']:9.1f}")
+    print(f"\nApiDian simulado: {result['mock']['requests']} peticiones, resultados {result['mock']['outcomes']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100, help="XMLs a generar")
+    parser.add_argument("--lines", default="1-30", help="líneas por documento: N o MIN-MAX")
+    parser.add_argument("--types", default="invoice", help="mezcla de tipos, p. ej. invoice=8,credit_note=1")
+    parser.add_argument("--workers", type=int, default=1, help="hilos de envío (1 = como la interfaz)")
+    parser.add_argument("--send-latency", type=float, default=300, help="mediana (ms) de los envíos simulados")
+    parser.add_argument("--other-latency", type=float, default=20, help="mediana (ms) de descargas y consultas")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reject-rate", type=float, default=0.0)
+    parser.add_argument("--database-url", default=None, help="por defecto SQLite temporal")
+    parser.add_argument("--start-number", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="no eliminar los documentos creados")
+    parser.add_argument("--json", default=None, help="guardar el resultado en este archivo")
+    parser.add_argument("--baseline", default=None, help="resultado JSON anterior para comparar")
+    args = parser.parse_args()
+
+    global WORK_DIR
+    WORK_DIR = tempfile.mkdtemp(prefix="e2e-")
+    # Antes de importar config: base y caché de artefactos fuera de data/
+    os.environ["DATABASE_URL"] = args.database_url or os.getenv("DATABASE_URL") or (
+        "sqlite:///" + os.path.join(WORK_DIR, "e2e.db"))
+    os.environ.setdefault("ARTIFACT_CACHE_DIR", os.path.join(WORK_DIR, "artifacts"))
+    os.environ.setdefault("METRICS_ENABLED", "1")
+
+    result = run(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if not args.keep:
+        database_engine().dispose()
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
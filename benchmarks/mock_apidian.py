@@ -0,0 +1,372 @@
+"""Servidor local que imita a ApiDian para pruebas de carga sin red
+
+Implementa los endpoints que usa ApiDianService (envío de factura, notas,
+documento soporte y nota de ajuste, descargas, GetAcquirer, rangos de
+numeración, configuración) con respuestas del mismo formato que ApiDian:
+sobre SOAP de la DIAN, CUFE/CUDE/CUDS calculados con services.cufe y
+nombres de PDF/AttachedDocument descargables.
+
+La latencia sigue una distribución log-normal (mediana y sigma por tipo de
+endpoint) y los envíos pueden fallar con error HTTP, rechazo de la DIAN o
+notificaciones según las tasas configuradas; un número ya aceptado se
+rechaza como "procesado anteriormente". GET /__stats devuelve el conteo de
+peticiones, bytes, latencia y resultados; POST /__reset lo reinicia.
+
+Uso:
+    python benchmarks/mock_apidian.py --port 8765 --send-latency 800 --reject-rate 0.05
+    # En Ajustes: URL API = http://127.0.0.1:8765/api/ubl2.1
+
+Desde código (benchmarks de extremo a extremo):
+    server = MockApiDian(send_latency_ms=0).start()
+    settings.api_url = server.base_url
+"""
+import os
+import sys
+import math
+import time
+import json
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.cufe import cufe_for_payload
+
+BASE_PATH = "/api/ubl2.1"
+
+# Endpoint de envío -> (nombre del documento, clave del código único en la respuesta)
+SEND_ENDPOINTS = {
+    "invoice": ("Factura", "cufe"),
+    "credit-note": ("Nota crédito", "cude"),
+    "debit-note": ("Nota débito", "cude"),
+    "support-document": ("Documento soporte", "cuds"),
+    "sd-credit-note": ("Nota de ajuste", "cuds"),
+}
+
+MINIMAL_PDF = (b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+               b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+               b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 226 400]>>endobj\n"
+               b"trailer<</Root 1 0 R>>\n%%EOF\n")
+
+
+class MockApiDian:
+    """Servidor HTTP de ApiDian simulado (en un hilo de fondo)"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, send_latency_ms: float = 800,
+                 other_latency_ms: float = 40, latency_sigma: float = 0.35, error_rate: float = 0.0,
+                 reject_rate: float = 0.0, notification_rate: float = 0.1, attachment_kb: int = 20,
+                 pdf_kb: int = 60, company_nit: str = "900123456", software_pin: str = "12345",
+                 ds_software_pin: str = "12345", technical_key: str = None, environment: int = 2,
+                 token: str = None, seed: int = None):
+        self.host = host
+        self.port = port
+        self.send_latency_ms = send_latency_ms
+        self.other_latency_ms = other_latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.reject_rate = reject_rate
+        self.notification_rate = notification_rate
+        self.attachment = base64.b64encode(os.urandom(attachment_kb * 1024)).decode("ascii")
+        self.pdf = MINIMAL_PDF + b"%" + b"0" * max(0, pdf_kb * 1024 - len(MINIMAL_PDF)) + b"\n"
+        self.settings = SimpleNamespace(company_nit=company_nit, software_pin=software_pin,
+                                        ds_software_pin=ds_software_pin, type_environment_id=environment)
+        self.technical_key = technical_key
+        self.token = token
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self.reset()
+
+    # ---------- Ciclo de vida ----------
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}{BASE_PATH}"
+
+    def start(self) -> "MockApiDian":
+        handler = type("Handler", (_Handler,), {"mock": self})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="mock-apidian", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    # ---------- Contabilidad de peticiones ----------
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}  # endpoint -> conteos
+            self.outcomes = {}  # accepted, notification, rejected, duplicate, http_error
+            self.accepted_numbers = set()
+            self.started_at = time.time()
+
+    def account(self, endpoint: str, status: int, bytes_in: int, bytes_out: int, elapsed_ms: float):
+        with self._lock:
+            entry = self.requests.setdefault(endpoint, {"count": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0,
+                                                        "latency_ms_total": 0.0, "latency_ms_max": 0.0})
+            entry["count"] += 1
+            entry["errors"] += status >= 400
+            entry["bytes_in"] += bytes_in
+            entry["bytes_out"] += bytes_out
+            entry["latency_ms_total"] += elapsed_ms
+            entry["latency_ms_max"] = max(entry["latency_ms_max"], elapsed_ms)
+
+    def stats(self) -> dict:
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            total = sum(entry["count"] for entry in self.requests.values())
+            return {
+                "elapsed_s": round(elapsed, 3),
+                "requests": total,
+                "requests_per_s": round(total / elapsed, 2) if elapsed else 0,
+                "endpoints": {name: {**entry, "latency_ms_avg": round(entry["latency_ms_total"] / entry["count"], 1)}
+                              for name, entry in sorted(self.requests.items())},
+                "outcomes": dict(self.outcomes),
+                "accepted_documents": len(self.accepted_numbers),
+            }
+
+    # ---------- Comportamiento ----------
+
+    def latency(self, send: bool) -> float:
+        median = self.send_latency_ms if send else self.other_latency_ms
+        if median <= 0:
+            return 0.0
+        with self._lock:
+            return median * math.exp(self._random.gauss(0, self.latency_sigma)) / 1000
+
+    def roll(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def send_document(self, endpoint: str, payload: dict, test_set: bool) -> tuple:
+        """(estado HTTP, cuerpo) de un envío"""
+        name, code_key = SEND_ENDPOINTS[endpoint]
+        missing = [field for field in ("number", "type_document_id") if payload.get(field) in (None, "")]
+        if missing:
+            return 422, {"message": "The given data was invalid.",
+                         "errors": {field: [f"El campo {field} es obligatorio."] for field in missing}}
+
+        roll = self.roll()
+        if roll < self.error_rate:
+            self._count("http_error")
+            if roll < self.error_rate / 2:
+                return 500, {"message": "Server Error"}
+            return 422, {"message": "The given data was invalid.",
+                         "errors": {"customer.email": ["El campo customer.email debe ser una dirección de correo válida."]}}
+
+        full_number = f"{payload.get('prefix') or ''}{payload['number']}"
+        key = (endpoint, full_number)
+        code = cufe_for_payload(payload, self.settings, self.technical_key) or hashlib.sha384(
+            f"{full_number}{payload.get('date')}{payload.get('time')}".encode()).hexdigest()
+
+        errors = []
+        # Verificar y registrar el número en un solo paso: dos envíos simultáneos del mismo número
+        # deben dar uno aceptado y un duplicado
+        with self._lock:
+            if key in self.accepted_numbers:
+                outcome = "duplicate"
+                errors = ["Regla: 90, Rechazo: Documento procesado anteriormente."]
+            elif roll < self.error_rate + self.reject_rate:
+                outcome = "rejected"
+                errors = ["Regla: FAD06, Rechazo: Valor del CUFE no está calculado correctamente.",
+                          "Regla: FAJ43b, Notificación: Nombre informado No corresponde al registrado en el RUT."]
+            elif roll < self.error_rate + self.reject_rate + self.notification_rate:
+                outcome = "notification"
+                errors = ["Regla: FAJ43b, Notificación: Nombre informado No corresponde al registrado en el RUT."]
+            else:
+                outcome = "accepted"
+            if outcome in ("accepted", "notification"):
+                self.accepted_numbers.add(key)
+        self._count(outcome)
+
+        valid = outcome in ("accepted", "notification")
+        body = {
+            "message": f"{name} #{full_number} generada con éxito",
+            "ResponseDian": {"Envelope": {"Body": self._dian_body(test_set, valid, errors, code, full_number)}},
+            "urlinvoicexml": f"FES-{full_number}.xml",
+            "urlinvoicepdf": f"FES-{full_number}.pdf",
+            "urlinvoiceattached": f"Attachment-{full_number}.xml",
+            code_key: code,
+            "QRStr": f"NumFac: {full_number}\nFecFac: {payload.get('date')}\nCUFE: {code}",
+        }
+        return 200, body
+
+    def _dian_body(self, test_set: bool, valid: bool, errors: list, code: str, full_number: str) -> dict:
+        if test_set:
+            return {"SendTestSetAsyncResponse": {"SendTestSetAsyncResult": {
+                "ErrorMessageList": {"XmlParamsResponseTrackId": {"Success": str(valid).lower(),
+                                                                  "ProcessedMessage": "; ".join(errors)}} if errors else None,
+                "ZipKey": hashlib.md5(code.encode()).hexdigest(),
+            }}}
+        return {"SendBillSyncResponse": {"SendBillSyncResult": {
+            "ErrorMessage": {"string": errors} if errors else {},
+            "IsValid": "true" if valid else "false",
+            "StatusCode": "00" if valid else "99",
+            "StatusDescription": "Procesado Correctamente." if valid else "Validación contiene errores en campos mandatorios.",
+            "StatusMessage": f"La Factura electrónica {full_number}, ha sido autorizada." if valid else "",
+            "XmlBase64Bytes": self.attachment,
+            "XmlDocumentKey": code,
+            "XmlFileName": f"fv0{self.settings.company_nit}000{full_number}",
+        }}}
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def download(self, filename: str) -> bytes:
+        if filename.lower().endswith(".pdf"):
+            return self.pdf
+        return ('<?xml version="1.0" encoding="UTF-8"?><AttachedDocument xmlns="urn:oasis:names:specification:ubl:'
+                f'schema:xsd:AttachedDocument-2"><cbc:ID>{filename}</cbc:ID><cac:Attachment>{self.attachment}'
+                '</cac:Attachment></AttachedDocument>').encode("utf-8")
+
+    def acquirer(self, document_number: str) -> dict:
+        return {"ResponseDian": {"GetAcquirerResponse": {"GetAcquirerResult": {
+            "Message": "Consulta exitosa",
+            "ReceiverEmail": f"facturacion{document_number}@example.com",
+            "ReceiverName": f"TERCERO DE PRUEBA {document_number}",
+            "StatusCode": "200",
+        }}}}
+
+    def numbering_range(self) -> dict:
+        today = datetime.now().strftime("%Y-%m-%d")
+        ranges = [{"ResolutionNumber": "18760000001", "ResolutionDate": "2019-01-19", "Prefix": "SETP",
+                   "FromNumber": "990000000", "ToNumber": "995000000", "ValidDateFrom": "2019-01-19",
+                   "ValidDateTo": "2030-01-19", "TechnicalKey": self.technical_key or "fc8eac422eba16e22ffd8c6f94b3f40a6e38162c"},
+                  {"ResolutionNumber": "18764000002", "ResolutionDate": today, "Prefix": "FE", "FromNumber": "1",
+                   "ToNumber": "5000", "ValidDateFrom": today, "ValidDateTo": "2030-12-31",
+                   "TechnicalKey": hashlib.sha1(b"FE").hexdigest()}]
+        return {"ResponseDian": {"Envelope": {"Body": {"GetNumberingRangeResponse": {"GetNumberingRangeResult": {
+            "OperationCode": "100", "OperationDescription": "Acción completada OK.",
+            "ResponseList": {"NumberRangeResponse": ranges}}}}}}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    mock: MockApiDian = None
+    protocol_version = "HTTP/1.1"  # Conexiones persistentes como ApiDian detrás de nginx
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def _dispatch(self, method: str):
+        start = time.perf_counter()
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        path = self.path.split("?")[0]
+
+        if path == "/__stats":
+            self._send(200, json.dumps(self.mock.stats(), indent=2).encode("utf-8"), "application/json")
+            return
+        if path == "/__reset" and method == "POST":
+            self.mock.reset()
+            self._send(200, b'{"success": true}', "application/json")
+            return
+
+        segments = path[len(BASE_PATH):].strip("/").split("/") if path.startswith(BASE_PATH) else [""]
+        endpoint = segments[0] or "root"
+        if self.mock.token and self.headers.get("Authorization") != f"Bearer {self.mock.token}":
+            status, body, content_type = 401, json.dumps({"message": "Unauthenticated."}).encode(), "application/json"
+        else:
+            time.sleep(self.mock.latency(endpoint in SEND_ENDPOINTS))
+            try:
+                payload = json.loads(raw) if raw else {}
+                status, body, content_type = self._route(method, endpoint, segments, payload)
+            except ValueError:
+                status, body, content_type = 400, b'{"message": "JSON mal formado"}', "application/json"
+
+        sent = self._send(status, body, content_type)
+        self.mock.account(endpoint, status, len(raw), sent, (time.perf_counter() - start) * 1000)
+
+    def _route(self, method: str, endpoint: str, segments: list, payload: dict) -> tuple:
+        def reply(status, obj):
+            return status, json.dumps(obj, ensure_ascii=False).encode("utf-8"), "application/json"
+
+        mock = self.mock
+        if method == "POST" and endpoint in SEND_ENDPOINTS:
+            return reply(*mock.send_document(endpoint, payload, test_set=len(segments) > 1))
+        if method == "GET" and endpoint == "download" and len(segments) >= 3:
+            filename = segments[-1]
+            return 200, mock.download(filename), "application/pdf" if filename.lower().endswith(".pdf") else "application/xml"
+        if method == "GET" and endpoint == "customer" and len(segments) >= 3:
+            return reply(200, mock.acquirer(segments[2]))
+        if method == "POST" and endpoint == "numbering-range":
+            return reply(200, mock.numbering_range())
+        if method == "GET" and endpoint == "plan":
+            return reply(200, {"plan": "Ilimitado", "documents_used": len(mock.accepted_numbers)})
+        if endpoint == "config" and method in ("POST", "PUT"):
+            target = segments[1] if len(segments) > 1 else ""
+            return reply(200, {"message": f"Configuración {target or 'empresa'} actualizada con éxito"})
+        return reply(404, {"message": f"Ruta {method} {self.path} no encontrada"})
+
+    def _send(self, status: int, body: bytes, content_type: str) -> int:
+        # Descargas con Range (reanudación en ApiDianService._download)
+        range_header = self.headers.get("Range")
+        if status == 200 and range_header and range_header.startswith("bytes=") and not content_type.endswith("json"):
+            start = int(range_header[6:].split("-")[0] or 0)
+            if start >= len(body):
+                status, body = 416, b""
+            else:
+                status, body = 206, body[start:]
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--send-latency", type=float, default=800, help="mediana (ms) de los envíos")
+    parser.add_argument("--other-latency", type=float, default=40, help="mediana (ms) del resto de endpoints")
+    parser.add_argument("--latency-sigma", type=float, default=0.35, help="dispersión log-normal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de envíos con error HTTP 422/500")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="fracción de envíos rechazados por la DIAN")
+    parser.add_argument("--notification-rate", type=float, default=0.1, help="fracción aceptada con notificaciones")
+    parser.add_argument("--attachment-kb", type=int, default=20, help="tamaño del XmlBase64Bytes de la respuesta")
+    parser.add_argument("--nit", default="900123456", help="NIT del emisor para calcular CUFE/CUDE/CUDS")
+    parser.add_argument("--software-pin", default="12345")
+    parser.add_argument("--ds-software-pin", default="12345")
+    parser.add_argument("--technical-key", default=None)
+    parser.add_argument("--token", default=None, help="exigir este token Bearer")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    mock = MockApiDian(args.host, args.port, args.send_latency, args.other_latency, args.latency_sigma,
+                       args.error_rate, args.reject_rate, args.notification_rate, args.attachment_kb,
+                       company_nit=args.nit, software_pin=args.software_pin, ds_software_pin=args.ds_software_pin,
+                       technical_key=args.technical_key, token=args.token, seed=args.seed).start()
+    print(f"ApiDian simulado en {mock.base_url} (estadísticas en http://{mock.host}:{mock.port}/__stats)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(mock.stats(), indent=2, ensure_ascii=False))
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Suite de micro-benchmarks con línea base y umbral de regresión
+
+Cubre el parser de XMLs de Siigo (pequeño/mediano/enorme), los constructores
+de payload de ApiDianService, el cálculo de impuestos, el dígito de
+verificación y el procesamiento de respuestas grabadas. Corre sin red ni
+MySQL: si no hay DATABASE_URL usa una base SQLite temporal.
+
+Cada caso se calibra para durar al menos --min-time por ronda y se reporta
+el mejor tiempo por llamada de --rounds rondas (el menos afectado por ruido).
+
+Uso:
+    python benchmarks/suite.py                  # comparar con benchmarks/baselines.json
+    python benchmarks/suite.py --save           # guardar los resultados como nueva línea base
+    python benchmarks/suite.py --threshold 0.15 --filter parse
+    python benchmarks/suite.py --cassette data/cassettes/apidian.json   # + respuestas grabadas de ApiDian
+Termina con código 1 si algún caso es más lento que la línea base más el umbral.
+"""
+import io
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+os.environ.setdefault("METRICS_ENABLED", "0")
+os.environ.setdefault("SQL_MONITOR", "0")
+
+from benchmarks.bench_json import make_api_response
+from benchmarks.xml_corpus import generate_document
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+def recorded_responses() -> dict:
+    """Respuestas de ApiDian representativas de cada rama de _process_response"""
+    accepted = make_api_response(attachment_kb=20)
+    result = accepted["ResponseDian"]["Envelope"]["Body"]["SendBillSyncResponse"]["SendBillSyncResult"]
+    rejected = json.loads(json.dumps(accepted))
+    rejected_result = rejected["ResponseDian"]["Envelope"]["Body"]["SendBillSyncResponse"]["SendBillSyncResult"]
+    rejected_result.update({"IsValid": "false", "StatusCode": "99", "ErrorMessage": {"string": [
+        "Regla: FAD06, Rechazo: Valor del CUFE no está calculado correctamente",
+        "Regla: FAJ43b, Notificación: Nombre informado No corresponde"]}})
+    test_set = {
+        "success": True,
+        "message": "Factura #SETP990000002 generada con éxito",
+        "ResponseDian": {"Envelope": {"Body": {"SendTestSetAsyncResponse": {"SendTestSetAsyncResult": {
+            "ErrorMessageList": None, "ZipKey": "8e9c1f1e-64b4-4b8a-9d1c-1f7a6b2c3d4e"}}}}},
+        "cufe": result["XmlDocumentKey"],
+    }
+    return {
+        "accepted": accepted,
+        "rejected": rejected,
+        "test_set": test_set,
+        "error": {"success": False, "message": "Error 422: The given data was invalid."},
+    }
+
+
+def measure(func, rounds: int, min_time: float) -> float:
+    """Mejor tiempo por llamada (segundos) de varias rondas calibradas"""
+    func()  # Calentamiento
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    best = elapsed / number
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def build_cases(cassette_path: str = None) -> dict:
+    """Casos del benchmark: nombre -> función sin argumentos"""
+    import database
+    from sqlalchemy import event
+    from database import get_session, Settings, Document, Resolution
+    from services import ApiDianService
+    from services.xml_parser import SiigoXmlParser
+    from services.payload_compiler import compile_lines, compile_support_lines
+
+    if database.engine.dialect.name == "sqlite":
+        # Base temporal: sin fsync por commit para medir CPU y no el disco
+        event.listen(database.engine, "connect", lambda conn, record: conn.execute("PRAGMA synchronous=OFF"))
+    database.init_db()
+    session = get_session()
+    settings = session.query(Settings).first()
+    settings.company_nit, settings.company_name, settings.software_pin = "900123456", "EMPRESA DE PRUEBA SAS", "12345"
+    settings.api_url = "http://127.0.0.1:9/api/ubl2.1"  # Nunca se contacta
+    if not session.query(Resolution).filter(Resolution.prefix == "SETP").first():
+        session.add(Resolution(type_document_id=1, prefix="SETP", resolution="18760000001",
+                               technical_key="fc8eac422eba16e22ffd8c6f94b3f40a6e38162c", from_number=990000000,
+                               to_number=995000000, is_active=True))
+        session.add(Resolution(type_document_id=11, prefix="DS", resolution="18760000002", from_number=1,
+                               to_number=5000, is_active=True))
+    session.commit()
+
+    xmls = {size: generate_document(990000001, num_lines=lines) for size, lines in
+            [("small", 5), ("medium", 50), ("huge", 1000)]}
+    parsed = SiigoXmlParser().parse(xmls["medium"])
+    parsed["customer"]["identification_number"] = "900765432"
+
+    invoice = Document(type="invoice", type_document_id=1, prefix="SETP", number="990000001",
+                       full_number="SETP990000001", status="pending", parsed_data=parsed)
+    session.add(invoice)
+    session.commit()
+    documents = {
+        "invoice": invoice,
+        "credit_note": Document(type="credit_note", prefix="NC", number="1", parsed_data=parsed,
+                                reference_document_id=invoice.id, reference_cufe="abc"),
+        "debit_note": Document(type="debit_note", prefix="ND", number="1", parsed_data=parsed,
+                               reference_document_id=invoice.id, reference_cufe="abc"),
+        "support_document": Document(type="support_document", prefix="DS", number="1", parsed_data=parsed),
+        "sd_adjustment_note": Document(type="sd_adjustment_note", prefix="NAS", number="1", parsed_data=parsed,
+                                       reference_document_id=invoice.id, reference_cufe="abc"),
+    }
+    invoice_id = invoice.id
+    session.refresh(invoice)
+    session.expunge(invoice)  # Lectura de atributos fuera de la sesión (ticket)
+    session.close()
+
+    service = ApiDianService()
+    service.cache_artifacts = lambda *args: None  # Sin descargas
+    target = Document(id=invoice_id, type="invoice")
+    request_data = service.build_payload(documents["invoice"])
+
+    cases = {}
+    parser = SiigoXmlParser()
+    for size, xml in xmls.items():
+        cases[f"parse_{size}"] = lambda xml=xml: parser.parse(xml)
+    builders = {
+        "invoice": service._build_invoice_payload,
+        "credit_note": service._build_credit_note_payload,
+        "debit_note": service._build_debit_note_payload,
+        "support_document": service._build_support_document_payload,
+        "sd_adjustment_note": service._build_sd_adjustment_note_payload,
+    }
+    for doc_type, builder in builders.items():
+        cases[f"build_{doc_type}_payload"] = lambda builder=builder, doc=documents[doc_type]: builder(doc)
+    cases["compile_lines_taxes"] = lambda: compile_lines(parsed)
+    cases["compile_support_lines"] = lambda: compile_support_lines(parsed["lines"], "2024-05-02")
+    cases["calculate_dv"] = lambda: [service._calculate_dv(nit) for nit in ("900123456", "1085286295", "80.123.456-1")]
+    for columns in (48, 32):  # Papel de 80mm y de 58mm
+        cases[f"render_escpos_{columns}"] = lambda columns=columns: render_checked_ticket(invoice, columns)
+    for name, response in recorded_responses().items():
+        cases[f"process_response_{name}"] = lambda response=response: service._process_response(target, response)
+    cases["process_response_accepted_with_request"] = lambda response=recorded_responses()["accepted"]: (
+        service._process_response(target, response, request_data))
+    if cassette_path:
+        # Envíos grabados (services.cassette): _post + _process_response sin red, en el orden grabado
+        from services import cassette
+        replay = cassette.transport(service.base_url, mode="replay", path=cassette_path)
+        paths = sorted({i["request"]["path"] for i in replay.cassette.interactions if i["request"]["method"] == "POST"})
+        for path in paths:
+            def replay_case(path=path, http=replay):
+                service._http = http
+                service._process_response(target, service._post(service.base_url + path, request_data))
+            cases["cassette_post_" + path.strip("/").replace("/", "_").replace("-", "_")] = replay_case
+        # Descargas grabadas por _download (streaming con iter_content), una por extensión
+        downloads = {}
+        for i in replay.cassette.interactions:
+            path = i["request"]["path"]
+            if i["request"]["method"] == "GET" and path.startswith("/download/"):
+                downloads.setdefault(path.rsplit(".", 1)[-1].lower(), path)
+        for extension, path in sorted(downloads.items()):
+            def download_case(path=path, http=replay):
+                service._http = http
+                result = service._download(service.base_url + path, io.BytesIO())
+                if not result.get("success") or not result.get("size"):
+                    raise RuntimeError(f"Descarga reproducida fallida {path}: {result.get('message')}")
+            cases[f"cassette_download_{extension}"] = download_case
+    return cases
+
+
+def render_checked_ticket(document, columns: int) -> bytes:
+    """Ticket ESC/POS verificando que ninguna línea supere el ancho del papel"""
+    from services.escpos import EscPosBuilder, _render_ticket
+    from services.ticket_printer import TicketPrinter
+
+    class CheckedBuilder(EscPosBuilder):
+        def text(self, value: str = "") -> "EscPosBuilder":
+            if len(value) > self.columns:
+                raise ValueError(f"Línea de {len(value)} caracteres en papel de {self.columns}: {value!r}")
+            return super().text(value)
+
+    builder = CheckedBuilder(columns)
+    _render_ticket(builder, document, TicketPrinter()._load_context([document]))
+    return builder.getvalue()
+
+
+def load_baselines() -> dict:
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH, encoding="utf-8") as f:
+        return json.load(f).get("cases", {})
+
+
+def save_baselines(results: dict):
+    data = {
+        "machine": f"{platform.system()} {platform.machine()} / {platform.processor() or 'cpu'}",
+        "python": platform.python_version(),
+        "saved_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "unit": "seconds per call (best of rounds)",
+        "cases": {name: float(f"{seconds:.9g}") for name, seconds in sorted(results.items())},
+    }
+    with open(BASELINES_PATH, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.1, help="segundos mínimos por ronda")
+    parser.add_argument("--threshold", type=float, default=0.25, help="regresión tolerada (0.25 = 25%%)")
+    parser.add_argument("--filter", default="", help="solo casos cuyo nombre contenga este texto")
+    parser.add_argument("--save", action="store_true", help="guardar los resultados como línea base")
+    parser.add_argument("--cassette", help="agregar casos con las respuestas de un cassette de ApiDian")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)  # Avisos de CUFE distinto en las respuestas grabadas
+    cases = {name: func for name, func in build_cases(args.cassette).items() if args.filter in name}
+    baselines = {} if args.save else load_baselines()
+
+    results, regressions = {}, []
+    print(f"{'caso':<40} {'µs/llamada':>12} {'línea base':>12} {'cambio':>8}")
+    for name, func in cases.items():
+        seconds = results[name] = measure(func, args.rounds, args.min_time)
+        baseline = baselines.get(name)
+        if baseline:
+            change = seconds / baseline - 1
+            flag = "  REGRESIÓN" if change > args.threshold else ""
+            if flag:
+                regressions.append(name)
+            print(f"{name:<40} {seconds * 1e6:12.1f} {baseline * 1e6:12.1f} {change:+8.1%}{flag}")
+        else:
+            print(f"{name:<40} {seconds * 1e6:12.1f} {'-':>12} {'':>8}")
+
+    if args.save:
+        if args.filter:
+            results = {**load_baselines(), **results}
+        save_baselines(results)
+        print(f"Línea base guardada en {BASELINES_PATH}")
+    elif regressions:
+        print(f"{len(regressions)} caso(s) más lentos que la línea base +{args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""Prueba de carga con varias terminales POS contra una misma base de datos
+
+Simula K terminales (un proceso cada una, con su propio pool de conexiones,
+como varios equipos en modo red) que durante --duration segundos mezclan:
+  - page:     consultas paginadas de DocumentsView._load_documents (conteo + página)
+  - ingest:   importación de un XML con FolderWatcherService
+  - allocate: asignación del siguiente número de la resolución de NC, igual que
+              las vistas (lectura de current_number + 1 y commit)
+  - send:     envío de un pendiente con ApiDianService al ApiDian simulado
+Reporta latencia p50/p95/p99 por operación, esperas de bloqueo y deadlocks
+(errores de la base y contadores de InnoDB en MySQL), números duplicados y
+envíos repetidos del mismo documento.
+
+Uso:
+    python benchmarks/terminals.py --database-url "mysql+pymysql://root:@servidor/siigo_bench?charset=utf8mb4" \\
+        --terminals 6 --duration 60
+    python benchmarks/terminals.py --terminals 4 --mix page=5,ingest=2,allocate=2,send=1 --allocation locked
+
+--allocation app reproduce la asignación actual de las vistas; locked usa
+SELECT ... FOR UPDATE para comparar. Sin --database-url se usa un SQLite
+temporal (sirve para probar el harness; la contención real se mide en MySQL).
+Use una base de pruebas: los documentos creados se eliminan al terminar.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+OPERATIONS = ("page", "ingest", "allocate", "send")
+NC_PREFIX = "NCT"  # Resolución de NC propia de la prueba
+
+
+def classify_error(exc: Exception) -> str:
+    """deadlock, lock_timeout (espera de bloqueo agotada / base bloqueada) o error"""
+    orig = getattr(exc, "orig", None)
+    code = orig.args[0] if orig is not None and getattr(orig, "args", None) else None
+    text = str(exc).lower()
+    if code == 1213 or "deadlock" in text:
+        return "deadlock"
+    if code == 1205 or "lock wait timeout" in text or "database is locked" in text:
+        return "lock_timeout"
+    return "error"
+
+
+# ---------- Operaciones de una terminal ----------
+
+def page_documents(session, rnd: random.Random, per_page: int = 20):
+    """Misma consulta que DocumentsView._load_documents con pestaña, página y búsqueda al azar"""
+    from database import Document
+
+    query = session.query(Document).filter(Document.type.notin_(["support_document", "sd_adjustment_note"]))
+    tab = rnd.choice(["all", "all", "invoice", "credit_note", "pending"])
+    if tab == "pending":
+        query = query.filter(Document.status == "pending")
+    elif tab != "all":
+        query = query.filter(Document.type == tab)
+    if rnd.random() < 0.3:
+        pattern = f"%{rnd.choice(['SETP', 'NCT', 'PEÑA', '900', 'MUÑOZ'])}%"
+        query = query.filter(Document.full_number.ilike(pattern) | Document.customer_name.ilike(pattern) |
+                             Document.customer_nit.ilike(pattern))
+    total = query.count()
+    pages = max(1, (total + per_page - 1) // per_page)
+    page = 1 if rnd.random() < 0.7 else rnd.randint(1, pages)
+    return query.order_by(Document.status != "pending", Document.id.desc()).offset((page - 1) * per_page).limit(per_page).all()
+
+
+def allocate_number(session, locked: bool, customer: dict):
+    """Crear una NC con el siguiente número de la resolución (como DocumentsView)"""
+    from datetime import datetime
+    from database import Document, Resolution
+
+    query = session.query(Resolution).filter(Resolution.type_document_id == 4, Resolution.prefix == NC_PREFIX,
+                                             Resolution.is_active == True)
+    if locked:
+        query = query.with_for_update()
+    res = query.first()
+    next_num = res.current_number + 1
+    res.current_number = next_num
+    doc = Document(type="credit_note", type_document_id=4, prefix=res.prefix, number=str(next_num),
+                   full_number=f"{res.prefix}{next_num}", issue_date=datetime.now(),
+                   customer_nit=customer["identification_number"], customer_name=customer["name"],
+                   subtotal=10000, total_tax=1900, total_discount=0, total=11900, status="pending",
+                   xml_content="", xml_filename=f"{res.prefix}{next_num}.xml",
+                   parsed_data={"customer": customer, "lines": [], "subtotal": 10000, "total_tax": 1900, "total": 11900})
+    session.add(doc)
+    session.commit()
+    return doc.id, doc.full_number
+
+
+def terminal(index: int, options: dict) -> dict:
+    """Bucle de una terminal (proceso hijo)"""
+    import logging
+    from database import get_session, Document
+    from services import FolderWatcherService, ApiDianService
+    from benchmarks.e2e import send
+    from benchmarks.xml_corpus import generate_document
+
+    logging.disable(logging.WARNING)
+    rnd = random.Random(options["seed"] * 1000 + index)
+    mix = options["mix"]
+    folder = os.path.join(options["work_dir"], f"terminal-{index}")
+    os.makedirs(os.path.join(folder, "procesados"), exist_ok=True)
+    watcher = FolderWatcherService()
+    watcher.watch_folder, watcher.processed_folder = folder, os.path.join(folder, "procesados")
+    customer = {"identification_number": "900765432", "dv": "1", "name": f"CLIENTE TERMINAL {index}"}
+
+    latencies = {op: [] for op in OPERATIONS}
+    errors = {}
+    allocated, created_ids, sent_ids = [], [], []
+    number = options["start_number"] + index * 100000
+
+    time.sleep(max(0.0, options["start_at"] - time.time()))  # Arranque simultáneo
+    deadline = time.time() + options["duration"]
+    while time.time() < deadline:
+        op = rnd.choices(list(mix), weights=list(mix.values()))[0]
+        session = get_session()
+        start = time.perf_counter()
+        try:
+            if op == "page":
+                page_documents(session, rnd)
+            elif op == "ingest":
+                number += 1
+                filename = f"SETP{number}.xml"
+                with open(os.path.join(folder, filename), "w", encoding="utf-8") as f:
+                    f.write(generate_document(number, num_lines=rnd.randint(1, 20), rnd=rnd))
+                watcher.scan()
+                doc_id = session.query(Document.id).filter(Document.xml_filename == filename).scalar()
+                if doc_id:
+                    created_ids.append(doc_id)
+            elif op == "allocate":
+                doc_id, full_number = allocate_number(session, options["locked"], customer)
+                created_ids.append(doc_id)
+                allocated.append(full_number)
+            elif op == "send":
+                # Como "Enviar pendientes": cualquier terminal puede tomar cualquier pendiente
+                candidates = [doc_id for (doc_id,) in session.query(Document.id).filter(
+                    Document.status == "pending", Document.type == "invoice").order_by(Document.id).limit(10)]
+                session.close()
+                if candidates:
+                    doc_id = rnd.choice(candidates)
+                    send(doc_id)
+                    sent_ids.append(doc_id)
+            latencies[op].append((time.perf_counter() - start) * 1000)
+        except Exception as e:
+            kind = classify_error(e)
+            errors[f"{op}:{kind}"] = errors.get(f"{op}:{kind}", 0) + 1
+            if kind == "error" and errors[f"{op}:{kind}"] <= 3:
+                errors.setdefault("examples", []).append(f"{op}: {str(e)[:200]}")
+            session.rollback()
+        finally:
+            session.close()
+        if options["think_ms"]:
+            time.sleep(rnd.uniform(0, 2 * options["think_ms"]) / 1000)
+
+    ApiDianService.wait_for_artifacts(timeout=60)
+    return {"terminal": index, "latencies": latencies, "errors": errors, "allocated": allocated,
+            "created_ids": created_ids, "sent_ids": sent_ids}
+
+
+# ---------- Coordinación ----------
+
+def innodb_counters(engine) -> dict:
+    """Contadores de bloqueo de InnoDB (vacío si la base no es MySQL/MariaDB)"""
+    if engine.dialect.name != "mysql":
+        return {}
+    from sqlalchemy import text
+    counters = {}
+    with engine.connect() as conn:
+        for name, value in conn.execute(text("SHOW GLOBAL STATUS LIKE 'Innodb_row_lock%'")):
+            counters[name] = float(value)
+        try:
+            row = conn.execute(text("SELECT `COUNT` FROM information_schema.INNODB_METRICS WHERE NAME = 'lock_deadlocks'")).first()
+            if row is not None:
+                counters["lock_deadlocks"] = float(row[0])
+        except Exception:
+            pass
+    return counters
+
+
+def prepare():
+    """Resolución de NC de la prueba (número actual guardado para restaurarlo)"""
+    from database import get_session, Resolution
+    session = get_session()
+    res = session.query(Resolution).filter(Resolution.type_document_id == 4, Resolution.prefix == NC_PREFIX).first()
+    created = res is None
+    if created:
+        res = Resolution(type_document_id=4, type_document_name="Nota Crédito", prefix=NC_PREFIX, resolution="0",
+                         from_number=1, to_number=99999999, current_number=0, is_active=True)
+        session.add(res)
+        session.commit()
+    state = {"id": res.id, "created": created, "current_number": res.current_number}
+    session.close()
+    return state
+
+
+def restore(resolution: dict, created_ids: list):
+    from database import get_session, Resolution, Document, DocumentResponse
+    session = get_session()
+    for start in range(0, len(created_ids), 500):
+        ids = created_ids[start:start + 500]
+        session.query(DocumentResponse).filter(DocumentResponse.document_id.in_(ids)).delete(synchronize_session=False)
+        session.query(Document).filter(Document.id.in_(ids)).delete(synchronize_session=False)
+    if resolution["created"]:
+        session.query(Resolution).filter(Resolution.id == resolution["id"]).delete()
+    else:
+        session.query(Resolution).filter(Resolution.id == resolution["id"]).update(
+            {"current_number": resolution["current_number"]})
+    session.commit()
+    session.close()
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    from services.metrics import percentile
+
+    operations = {}
+    for op in OPERATIONS:
+        values = sorted(v for r in results for v in r["latencies"][op])
+        operations[op] = {"count": len(values), "per_s": round(len(values) / elapsed, 2),
+                          "p50": percentile(values, 50), "p95": percentile(values, 95),
+                          "p99": percentile(values, 99), "max": values[-1] if values else 0}
+
+    errors = Counter()
+    examples = []
+    for r in results:
+        examples += r["errors"].pop("examples", [])
+        errors.update(r["errors"])
+
+    allocated = Counter(number for r in results for number in r["allocated"])
+    sent = Counter(doc_id for r in results for doc_id in r["sent_ids"])
+    return {
+        "operations": operations,
+        "errors": dict(errors),
+        "error_examples": examples[:10],
+        "deadlocks": sum(v for k, v in errors.items() if k.endswith(":deadlock")),
+        "lock_timeouts": sum(v for k, v in errors.items() if k.endswith(":lock_timeout")),
+        "allocated_numbers": sum(allocated.values()),
+        "duplicate_numbers": {number: count for number, count in allocated.items() if count > 1},
+        "documents_sent_more_than_once": sum(1 for count in sent.values() if count > 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--terminals", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30, help="segundos de carga")
+    parser.add_argument("--mix", default="page=5,ingest=2,allocate=2,send=1", help=f"pesos de {', '.join(OPERATIONS)}")
+    parser.add_argument("--allocation", choices=["app", "locked"], default="app")
+    parser.add_argument("--think-ms", type=float, default=50, help="pausa media entre operaciones de una terminal")
+    parser.add_argument("--send-latency", type=float, default=300, help="mediana (ms) de los envíos simulados")
+    parser.add_argument("--database-url", default=None, help="por defecto SQLite temporal")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default=None, help="guardar el resultado en este archivo")
+    args = parser.parse_args()
+
+    mix = {}
+    for item in args.mix.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in OPERATIONS:
+            sys.exit(f"Operación desconocida: {name}")
+        mix[name] = float(weight or 1)
+
+    work_dir = tempfile.mkdtemp(prefix="terminals-")
+    os.environ["DATABASE_URL"] = args.database_url or os.getenv("DATABASE_URL") or (
+        "sqlite:///" + os.path.join(work_dir, "terminals.db"))
+    os.environ["ARTIFACT_CACHE_DIR"] = os.path.join(work_dir, "artifacts")
+    os.environ["METRICS_ENABLED"] = "0"
+    os.environ["SQL_MONITOR"] = "0"
+
+    import database
+    from benchmarks.e2e import BenchSettings
+    from benchmarks.mock_apidian import MockApiDian
+
+    database.init_db()
+    mock = MockApiDian(send_latency_ms=args.send_latency, other_latency_ms=20, seed=args.seed).start()
+    resolution = prepare()
+    options = {"mix": mix, "locked": args.allocation == "locked", "duration": args.duration,
+               "think_ms": args.think_ms, "seed": args.seed, "work_dir": work_dir,
+               "start_number": 990000000 + int(time.time()) % 400000 * 10}
+
+    results = []
+    before = innodb_counters(database.engine)
+    try:
+        with BenchSettings(mock.base_url, work_dir, os.path.join(work_dir, "procesados")):
+            options["start_at"] = time.time() + 3  # Tiempo para que arranquen los procesos
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=args.terminals, mp_context=context) as pool:
+                futures = [pool.submit(terminal, i, options) for i in range(args.terminals)]
+                results = [future.result() for future in futures]
+        after = innodb_counters(database.engine)
+
+        summary = summarize(results, args.duration)
+        summary.update({
+            "terminals": args.terminals, "duration_s": args.duration, "allocation": args.allocation,
+            "database": database.engine.dialect.name,
+            "innodb": {name: after[name] - before.get(name, 0) for name in after
+                       if name in ("Innodb_row_lock_waits", "Innodb_row_lock_time", "lock_deadlocks")},
+            "mock_duplicate_sends": mock.stats()["outcomes"].get("duplicate", 0),
+        })
+    finally:
+        mock.stop()
+        restore(resolution, [doc_id for r in results for doc_id in r["created_ids"]])
+        database.engine.dispose()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{summary['terminals']} terminales, {summary['duration_s']:.0f} s, base {summary['database']}, "
+          f"asignación {summary['allocation']}")
+    print(f"\n{'operación':<10} {'n':>7} {'op/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'máx ms':>9}")
+    for op, row in summary["operations"].items():
+        print(f"{op:<10} {row['count']:>7} {row['per_s']:>8.1f} {row['p50']:9.1f} {row['p95']:9.1f} "
+              f"{row['p99']:9.1f} {row['max']:9.1f}")
+    print(f"\nDeadlocks: {summary['deadlocks']}  esperas de bloqueo agotadas: {summary['lock_timeouts']}")
+    if summary["innodb"]:
+        print(f"InnoDB: {summary['innodb']}")
+    if summary["errors"]:
+        print(f"Errores: {summary['errors']}")
+        for example in summary["error_examples"]:
+            print(f"  {example}")
+    print(f"Números asignados: {summary['allocated_numbers']}, duplicados: {len(summary['duplicate_numbers'])}"
+          + (f" {dict(list(summary['duplicate_numbers'].items())[:10])}" if summary["duplicate_numbers"] else ""))
+    print(f"Documentos enviados más de una vez: {summary['documents_sent_more_than_once']} "
+          f"(rechazados por duplicado en ApiDian: {summary['mock_duplicate_sends']})")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
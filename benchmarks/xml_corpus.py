@@ -0,0 +1,204 @@
+"""Generador de XMLs sintéticos con el formato de Siigo
+
+Produce documentos que SiigoXmlParser lee igual que los reales: CompanyData,
+Customer, Billing/Global (0008 número, 0073 prefijo, 0022/0029 fechas, 0067
+total, 0071-0075 resolución, 0497 tipo), Billing/Detail (0031-0041 línea,
+0036/0527 IVA, 1139/0516 INC) y Billing/Payments (0045 forma de pago, 0051
+vencimiento, 1186 plazo). Se puede variar la cantidad, las líneas por
+documento, la mezcla de impuestos, la codificación y el tipo de documento.
+
+Uso:
+    python benchmarks/xml_corpus.py carpeta --count 500 --lines 1-40
+    python benchmarks/xml_corpus.py carpeta --types invoice=8,credit_note=1,debit_note=1 \\
+        --taxes iva19=6,iva5=1,excluded=2,inc8=1 --encodings utf-8,latin-1,cp1252
+"""
+import os
+import sys
+import random
+import argparse
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+from xml.sax.saxutils import escape
+
+# Impuesto -> (tipo, porcentaje)
+TAXES = {
+    "iva19": ("iva", 19),
+    "iva5": ("iva", 5),
+    "excluded": ("iva", 0),
+    "inc8": ("inc", 8),
+}
+DEFAULT_TAX_MIX = {"iva19": 6, "iva5": 1, "excluded": 2, "inc8": 1}
+
+# Tipo -> (texto del campo 0497, prefijo)
+DOCUMENT_TYPES = {
+    "invoice": ("FACTURA ELECTRONICA DE VENTA", "SETP"),
+    "credit_note": ("NOTA CREDITO ELECTRONICA", "NC"),
+    "debit_note": ("NOTA DEBITO ELECTRONICA", "ND"),
+}
+DEFAULT_TYPE_MIX = {"invoice": 1}
+
+ENCODINGS = ("utf-8", "latin-1", "cp1252")
+
+# Forma de pago de Siigo (0045, 0046, días de plazo)
+PAYMENTS = [("0080", "CONTADO CLIENTES", 0), ("0001", "CREDITO CLIENTES NACIONALES", 30),
+            ("0010", "TARJETA VISA", 0), ("0012", "TARJETA MASTERCARD", 0)]
+
+PRODUCTS = ["CAFÉ MOLIDO 500G", "AZÚCAR REFINADA", "ACEITE DE OLIVA", "PIÑA GOLDEN", "PAÑALES ETAPA 3",
+            "JABÓN LÍQUIDO", "SERVICIO TÉCNICO", "CAMISETA ALGODÓN", "LÁPIZ HB x12", "CUADERNO 100 HOJAS"]
+FIRST_NAMES = ["JOSÉ", "MARÍA", "ANDRÉS", "NÚÑEZ", "SOFÍA", "IÑAKI", "VALENTINA", "JULIÁN"]
+LAST_NAMES = ["PEÑA", "MUÑOZ", "GÓMEZ", "RODRÍGUEZ", "CASTAÑO", "ÁLVAREZ", "LÓPEZ", "ORDÓÑEZ"]
+
+
+def check_digit(nit: str) -> str:
+    """Dígito de verificación DIAN (mismo algoritmo que ApiDianService._calculate_dv)"""
+    weights = [3, 7, 13, 17, 19, 23, 29, 37, 41, 43, 47, 53, 59, 67, 71]
+    total = sum(int(digit) * weight for digit, weight in zip(reversed(nit), weights))
+    remainder = total % 11
+    return str(remainder if remainder in (0, 1) else 11 - remainder)
+
+
+def parse_mix(text: str, choices) -> Dict[str, float]:
+    """'iva19=6,inc8=1' o 'iva19,inc8' -> pesos por opción"""
+    mix = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in choices:
+            raise ValueError(f"Opción desconocida: {name} (válidas: {', '.join(choices)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_range(text: str) -> Tuple[int, int]:
+    """'10' o '1-40' -> (mínimo, máximo)"""
+    low, _, high = str(text).partition("-")
+    return int(low), int(high or low)
+
+
+def _pick(rnd: random.Random, mix: Dict[str, float]) -> str:
+    return rnd.choices(list(mix), weights=list(mix.values()))[0]
+
+
+def _customer(rnd: random.Random) -> str:
+    kind = rnd.random()
+    if kind < 0.5:  # Empresa con NIT
+        nit = str(rnd.randint(800000000, 901999999))
+        return (f"<Customer><Code>{nit}</Code><CheckDigit>{check_digit(nit)}</CheckDigit>"
+                f"<IsSocialReason>TRUE</IsSocialReason><FirstName>{rnd.choice(LAST_NAMES)} &amp; CÍA S.A.S.</FirstName>"
+                f"<LastName></LastName><Address>CALLE {rnd.randint(1, 120)} # {rnd.randint(1, 99)}-{rnd.randint(1, 99)}</Address>"
+                f"<Phone>60{rnd.randint(10000000, 99999999)}</Phone><EMail>facturacion{nit}@example.com</EMail></Customer>")
+    if kind < 0.85:  # Persona natural con cédula
+        return (f"<Customer><Code>{rnd.randint(10000000, 1199999999)}</Code><CheckDigit></CheckDigit>"
+                f"<IsSocialReason>FALSE</IsSocialReason><FirstName>{rnd.choice(FIRST_NAMES)}</FirstName>"
+                f"<LastName>{rnd.choice(LAST_NAMES)} {rnd.choice(LAST_NAMES)}</LastName>"
+                f"<Address>CARRERA {rnd.randint(1, 80)} # {rnd.randint(1, 99)}-{rnd.randint(1, 99)}</Address>"
+                f"<Phone>3{rnd.randint(100000000, 299999999)}</Phone><EMail>cliente{rnd.randint(1, 99999)}@example.com</EMail></Customer>")
+    return ("<Customer><Code>222222222222</Code><CheckDigit></CheckDigit><IsSocialReason>FALSE</IsSocialReason>"
+            "<FirstName>CONSUMIDOR</FirstName><LastName>FINAL</LastName><Address></Address><Phone></Phone><EMail></EMail></Customer>")
+
+
+def generate_document(number: int, doc_type: str = "invoice", num_lines: int = 10, tax_mix: Dict[str, float] = None,
+                      rnd: random.Random = None, issue_date: date = None, discount_rate: float = 0.0,
+                      encoding: str = "utf-8") -> str:
+    """Texto XML de un documento (la declaración indica la codificación con que se guardará)"""
+    rnd = rnd or random.Random(number)
+    tax_mix = tax_mix or DEFAULT_TAX_MIX
+    issue_date = issue_date or date(2024, 5, 2)
+    type_text, prefix = DOCUMENT_TYPES[doc_type]
+
+    rows = []
+    subtotal = total_tax = 0.0
+    for i in range(num_lines):
+        kind, percent = TAXES[_pick(rnd, tax_mix)]
+        quantity = rnd.choice([1, 1, 1, 2, 3, 6, 12])
+        unit_price = round(rnd.uniform(500, 250000), 2)
+        total = round(quantity * unit_price, 2)
+        tax = round(total * percent / 100, 2)
+        subtotal += total
+        total_tax += tax
+        if kind == "inc":
+            taxes = f'<D K="0036">0</D><D K="0527">0</D><D K="0516">{tax:.2f}</D><D K="1139">{percent}</D>'
+        else:
+            taxes = f'<D K="0036">{percent}</D><D K="0527">{tax:.2f}</D>'
+        product = rnd.choice(PRODUCTS)
+        rows.append(f'<R><D K="0031">{rnd.randint(1, 9999):04d}{i:04d}</D><D K="0033">{escape(product)}</D>'
+                    f'<D K="0034">{escape(product)} REF {i}</D><D K="0035">UN</D><D K="0037">{i + 1}</D>'
+                    f'<D K="0038">{quantity}</D><D K="0039">{unit_price:.2f}</D><D K="0040">0</D>'
+                    f'<D K="0041">{total:.2f}</D>{taxes}</R>')
+
+    payable = subtotal + total_tax
+    if discount_rate and rnd.random() < discount_rate:
+        payable -= round(subtotal * rnd.choice([0.02, 0.05, 0.1]), 2)
+
+    code, name, days = rnd.choice(PAYMENTS)
+    due_date = issue_date + timedelta(days=days)
+    return (
+        f'<?xml version="1.0" encoding="{encoding}"?>\n<SiigoDocument>'
+        '<CompanyData><Nit>900123456</Nit><Name>EMPRESA DE PRUEBA S.A.S.</Name><Address>CALLE 18 # 25-40</Address>'
+        '<Phone>6027214455</Phone><EMail>facturacion@example.com</EMail><City>52001</City><RegimeType>2</RegimeType></CompanyData>'
+        f'{_customer(rnd)}<Billing><Global>'
+        f'<D K="0008">{number}</D><D K="0009">{prefix}</D><D K="0073">{prefix}</D>'
+        f'<D K="0022">{issue_date:%Y%m%d}</D><D K="0029">{due_date:%Y%m%d}</D>'
+        f'<D K="0060">0</D><D K="0067">{payable:.2f}</D><D K="0071">18760000001</D><D K="0072">20190119</D>'
+        f'<D K="0074">990000000</D><D K="0075">995000000</D><D K="0497">{type_text}</D>'
+        f'</Global><Detail>{"".join(rows)}</Detail>'
+        f'<Payments><R><D K="0045">{code}</D><D K="0046">{name}</D><D K="0051">{due_date:%Y%m%d}</D>'
+        f'<D K="1186">{days}</D></R></Payments></Billing></SiigoDocument>\n'
+    )
+
+
+def write_corpus(directory: str, count: int = 100, lines: Tuple[int, int] = (1, 30), tax_mix: Dict[str, float] = None,
+                 type_mix: Dict[str, float] = None, encodings: List[str] = ("utf-8",), seed: int = 1,
+                 start_number: int = 990000001, discount_rate: float = 0.1) -> List[str]:
+    """Escribir count XMLs en directory; devuelve las rutas creadas"""
+    rnd = random.Random(seed)
+    type_mix = type_mix or DEFAULT_TYPE_MIX
+    os.makedirs(directory, exist_ok=True)
+    numbers = {doc_type: start_number for doc_type in DOCUMENT_TYPES}
+    start = date(2024, 5, 2)
+
+    paths = []
+    for i in range(count):
+        doc_type = _pick(rnd, type_mix)
+        number = numbers[doc_type]
+        numbers[doc_type] += 1
+        encoding = rnd.choice(list(encodings))
+        xml = generate_document(number, doc_type, rnd.randint(*lines), tax_mix, rnd,
+                                issue_date=start + timedelta(days=i % 28), discount_rate=discount_rate,
+                                encoding=encoding)
+        path = os.path.join(directory, f"{DOCUMENT_TYPES[doc_type][1]}{number}.xml")
+        with open(path, "wb") as f:
+            f.write(xml.encode(encoding))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--lines", default="1-30", help="líneas por documento: N o MIN-MAX")
+    parser.add_argument("--taxes", default="iva19=6,iva5=1,excluded=2,inc8=1",
+                        help=f"mezcla de impuestos ({', '.join(TAXES)})")
+    parser.add_argument("--types", default="invoice", help=f"mezcla de tipos ({', '.join(DOCUMENT_TYPES)})")
+    parser.add_argument("--encodings", default="utf-8", help=f"codificaciones a alternar ({', '.join(ENCODINGS)})")
+    parser.add_argument("--discount-rate", type=float, default=0.1, help="fracción de documentos con descuento")
+    parser.add_argument("--start-number", type=int, default=990000001)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        encodings = [e.strip() for e in args.encodings.split(",") if e.strip()]
+        for encoding in encodings:
+            if encoding not in ENCODINGS:
+                raise ValueError(f"Codificación no soportada: {encoding}")
+        paths = write_corpus(args.directory, args.count, parse_range(args.lines), parse_mix(args.taxes, TAXES),
+                             parse_mix(args.types, DOCUMENT_TYPES), encodings, args.seed, args.start_number,
+                             args.discount_rate)
+    except ValueError as e:
+        sys.exit(str(e))
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f"{len(paths)} XMLs ({size / 1024:,.0f} KB) en {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
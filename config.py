@@ -1,5 +1,6 @@
 """Configuración de la aplicación"""
 import os
+import socket
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -17,7 +18,12 @@ DB_NAME = os.getenv("DB_NAME", "siigo_python")
 DB_USER = os.getenv("DB_USER", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 
-DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}?charset=utf8mb4"
+# DATABASE_URL completa reemplaza a las anteriores (p. ej. sqlite:///bench.db para benchmarks sin MySQL)
+DATABASE_URL = os.getenv("DATABASE_URL") or (
+    f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}?charset=utf8mb4")
+
+# Identificador de esta terminal en la base compartida (reservas del outbox de correos)
+TERMINAL_ID = os.getenv("TERMINAL_ID") or socket.gethostname()
 
 # Carpetas de monitoreo
 WATCH_FOLDER = os.getenv("WATCH_FOLDER", r"D:\SIIWI01\DOCELECTRONICOS")
@@ -26,6 +32,45 @@ PROCESSED_FOLDER = os.getenv("PROCESSED_FOLDER", r"D:\SIIWI01\DOCELECTRONICOS\pr
 # API DIAN
 APIDIAN_URL = os.getenv("APIDIAN_URL", "https://apidian.clipers.pro/api/ubl2.1")
 
+# Caché de consultas de terceros (GetAcquirer), en horas
+ACQUIRER_CACHE_TTL_HOURS = float(os.getenv("ACQUIRER_CACHE_TTL_HOURS", "168"))
+ACQUIRER_CACHE_NEGATIVE_TTL_HOURS = float(os.getenv("ACQUIRER_CACHE_NEGATIVE_TTL_HOURS", "24"))
+
+# Caché local de artefactos (PDF / AttachedDocument)
+ARTIFACT_CACHE_DIR = Path(os.getenv("ARTIFACT_CACHE_DIR", str(DATA_DIR / "artifacts")))
+ARTIFACT_CACHE_MAX_MB = float(os.getenv("ARTIFACT_CACHE_MAX_MB", "500"))
+
+# Registro (logging): nivel general, niveles por módulo ("services.api_dian=DEBUG,services.folder_watcher=WARNING")
+LOG_DIR = Path(os.getenv("LOG_DIR", str(DATA_DIR / "logs")))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_MAX_MB = float(os.getenv("LOG_MAX_MB", "10"))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+
+# Métricas de latencia por etapa (tabla document_metrics)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") not in ("0", "false", "no")
+METRICS_RETENTION_DAYS = int(os.getenv("METRICS_RETENTION_DAYS", "30"))
+
+# Exportador de métricas Prometheus (GET /metrics); 0 = deshabilitado
+METRICS_EXPORTER_HOST = os.getenv("METRICS_EXPORTER_HOST", "127.0.0.1")
+METRICS_EXPORTER_PORT = int(os.getenv("METRICS_EXPORTER_PORT", "0"))
+
+# Perfilado opcional: off, cpu (cProfile), memory (tracemalloc) o all
+PROFILE = os.getenv("PROFILE", "off").lower()
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(DATA_DIR / "profiles")))
+
+# Monitoreo de SQL: consultas lentas (ms) y máximo de consultas por acción antes de advertir N+1
+SQL_MONITOR = os.getenv("SQL_MONITOR", "1") not in ("0", "false", "no")
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "200"))
+SQL_QUERIES_PER_ACTION = int(os.getenv("SQL_QUERIES_PER_ACTION", "50"))
+
+# Cassettes de ApiDian: off (red real), record (graba) o replay (sin red)
+APIDIAN_CASSETTE_MODE = os.getenv("APIDIAN_CASSETTE_MODE", "off")
+APIDIAN_CASSETTE = Path(os.getenv("APIDIAN_CASSETTE", str(DATA_DIR / "cassettes" / "apidian.json")))
+
+# Codificador JSON: auto (orjson si está instalado), orjson o json (librería estándar)
+JSON_CODEC = os.getenv("JSON_CODEC", "auto").lower()
+
 # Tema oscuro (colores similares a Filament)
 THEME = {
     "bg_primary": "#0f172a",
@@ -1,11 +1,17 @@
 """Modelos de base de datos con SQLAlchemy"""
+import logging
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, JSON
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, JSON, LargeBinary, UniqueConstraint
+from sqlalchemy.dialects.mysql import LONGBLOB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from config import DATABASE_URL
+import json_codec
 
-engine = create_engine(DATABASE_URL, echo=False)
+logger = logging.getLogger(__name__)
+
+engine = create_engine(DATABASE_URL, echo=False,
+                       json_serializer=json_codec.dumps, json_deserializer=json_codec.loads)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
@@ -112,6 +118,11 @@ class Settings(Base):
     mail_username = Column(String(100))
     mail_password = Column(String(100))
     mail_encryption = Column(String(10), default="tls")
+    mail_rate_per_minute = Column(Integer, default=20)  # Límite de envío del outbox
+    # Impresora de tickets
+    ticket_printer_mode = Column(String(20), default="pdf")  # pdf, escpos
+    ticket_printer_target = Column(String(200))  # host:puerto, dispositivo o impresora compartida
+    ticket_printer_columns = Column(Integer, default=48)  # Caracteres por línea (80mm: 48, 58mm: 32)
     # Carpetas
     watch_folder = Column(String(500))
     processed_folder = Column(String(500))
@@ -168,6 +179,7 @@ class Document(Base):
     # Estado
     status = Column(String(20), default="pending")  # pending, processing, sent, error, rejected
     cufe = Column(String(200))
+    local_cufe = Column(String(200))  # CUFE/CUDE/CUDS calculado localmente al enviar
     error_message = Column(Text)
     is_nullified = Column(Boolean, default=False)  # Marcado como anulado por NC
     
@@ -179,6 +191,7 @@ class Document(Base):
     parsed_data = Column(JSON)
     api_request = Column(JSON)
     api_response = Column(JSON)
+    payload = Column(JSON)  # Payload listo para enviar, precalculado al importar (sin fecha/hora)
     
     # Referencia (para NC/ND)
     reference_document_id = Column(Integer, ForeignKey("documents.id"))
@@ -251,6 +264,71 @@ class Customer(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
+class EmailOutbox(Base):
+    """Cola de correos pendientes por enviar"""
+    __tablename__ = "email_outbox"
+    
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
+    recipient = Column(String(100))
+    status = Column(String(20), default="pending", index=True)  # pending, sending, sent, error
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    next_attempt_at = Column(DateTime, default=datetime.now)
+    claimed_by = Column(String(100))  # Terminal que reservó el mensaje (status sending)
+    claimed_at = Column(DateTime)
+    
+    sent_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    document = relationship("Document")
+
+
+class DocumentResponse(Base):
+    """Respuesta completa de ApiDian (sobre SOAP y adjuntos base64), comprimida con zlib
+
+    Document.api_response solo guarda los campos que usa la aplicación; esta
+    tabla se consulta únicamente cuando se pide ver la respuesta completa.
+    """
+    __tablename__ = "document_responses"
+    
+    document_id = Column(Integer, ForeignKey("documents.id"), primary_key=True)
+    content = Column(LargeBinary().with_variant(LONGBLOB(), "mysql"))
+    size = Column(Integer)  # Tamaño sin comprimir en bytes
+    created_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class DocumentMetric(Base):
+    """Duración de cada etapa del envío/importación de un documento"""
+    __tablename__ = "document_metrics"
+    
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, index=True)  # None para operaciones sin documento (escaneo)
+    operation = Column(String(30), index=True)  # send_invoice, send_credit_note, import, scan...
+    stage = Column(String(30))  # payload, validation, http, process, db, total...
+    duration_ms = Column(Float)
+    created_at = Column(DateTime, default=datetime.now, index=True)
+
+
+class AcquirerCache(Base):
+    """Caché de consultas de terceros en la DIAN (GetAcquirer)"""
+    __tablename__ = "acquirer_cache"
+    __table_args__ = (
+        # Un solo registro por tercero: la precarga en segundo plano y varias terminales escriben a la vez
+        UniqueConstraint("type_document_identification_id", "identification_number", name="uq_acquirer_cache_party"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    type_document_identification_id = Column(Integer, index=True)
+    identification_number = Column(String(20), index=True)
+    found = Column(Boolean, default=True)  # False = caché negativo ("no encontrado")
+    name = Column(String(200))
+    email = Column(String(100))
+    data = Column(JSON)
+    fetched_at = Column(DateTime, default=datetime.now)
+
+
 class Product(Base):
     """Productos/Servicios"""
     __tablename__ = "products"
@@ -378,6 +456,75 @@ def _run_migrations():
                 conn.commit()
             except:
                 pass
+        
+        # Límite de envío del outbox de correos
+        try:
+            conn.execute(text("SELECT mail_rate_per_minute FROM settings LIMIT 1"))
+        except:
+            try:
+                conn.execute(text("ALTER TABLE settings ADD COLUMN mail_rate_per_minute INT DEFAULT 20"))
+                conn.commit()
+            except:
+                pass
+        
+        # Payload precalculado al importar
+        try:
+            conn.execute(text("SELECT payload FROM documents LIMIT 1"))
+        except:
+            try:
+                conn.execute(text("ALTER TABLE documents ADD COLUMN payload JSON"))
+                conn.commit()
+            except:
+                pass
+        
+        # CUFE calculado localmente
+        try:
+            conn.execute(text("SELECT local_cufe FROM documents LIMIT 1"))
+        except:
+            try:
+                conn.execute(text("ALTER TABLE documents ADD COLUMN local_cufe VARCHAR(200)"))
+                conn.commit()
+            except:
+                pass
+        
+        # Impresora de tickets ESC/POS
+        try:
+            conn.execute(text("SELECT ticket_printer_mode FROM settings LIMIT 1"))
+        except:
+            try:
+                conn.execute(text("ALTER TABLE settings ADD COLUMN ticket_printer_mode VARCHAR(20) DEFAULT 'pdf'"))
+                conn.execute(text("ALTER TABLE settings ADD COLUMN ticket_printer_target VARCHAR(200)"))
+                conn.execute(text("ALTER TABLE settings ADD COLUMN ticket_printer_columns INT DEFAULT 48"))
+                conn.commit()
+            except:
+                pass
+        
+        # Reserva de mensajes del outbox por terminal
+        try:
+            conn.execute(text("SELECT claimed_by FROM email_outbox LIMIT 1"))
+        except:
+            try:
+                conn.execute(text("ALTER TABLE email_outbox ADD COLUMN claimed_by VARCHAR(100)"))
+                conn.execute(text("ALTER TABLE email_outbox ADD COLUMN claimed_at DATETIME"))
+                conn.commit()
+            except:
+                pass
+        
+        # Índice único de la caché de terceros (quitando duplicados previos, se conserva el más reciente)
+        from sqlalchemy import inspect
+        try:
+            inspector = inspect(conn)
+            existing = {ix["name"] for ix in inspector.get_indexes("acquirer_cache")}
+            existing |= {uc["name"] for uc in inspector.get_unique_constraints("acquirer_cache")}
+            if "uq_acquirer_cache_party" not in existing:
+                conn.execute(text(
+                    "DELETE FROM acquirer_cache WHERE id NOT IN (SELECT id FROM (SELECT MAX(id) AS id FROM acquirer_cache "
+                    "GROUP BY type_document_identification_id, identification_number) AS keep)"))
+                conn.execute(text("CREATE UNIQUE INDEX uq_acquirer_cache_party ON acquirer_cache "
+                                  "(type_document_identification_id, identification_number)"))
+                conn.commit()
+        except:
+            pass
 
 
 def _populate_catalogs(session):
@@ -475,7 +622,7 @@ def _import_geo_catalogs(session):
             if len(row) >= 3:
                 session.add(Department(id=int(row[0]), name=row[2], code=row[3] if len(row) > 3 else str(row[0])))
         session.commit()
-        print(f"Importados {session.query(Department).count()} departamentos desde CSV")
+        logger.info("Importados %d departamentos desde CSV", session.query(Department).count())
     
     # Importar municipios
     muni_data = read_csv('municipalities.csv')
@@ -487,7 +634,7 @@ def _import_geo_catalogs(session):
                     code=row[3], codefacturador=row[4] if len(row) > 4 else None
                 ))
         session.commit()
-        print(f"Importados {session.query(Municipality).count()} municipios desde CSV")
+        logger.info("Importados %d municipios desde CSV", session.query(Municipality).count())
 
 
 def get_session():
@@ -0,0 +1,59 @@
+"""Codificador JSON intercambiable: orjson cuando está disponible, json de la librería estándar si no
+
+Se usa en las peticiones a ApiDian, en las columnas JSON de SQLAlchemy
+(json_serializer/json_deserializer del engine) y en los volcados legibles.
+"""
+import json
+import logging
+from config import JSON_CODEC
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None and JSON_CODEC in ("auto", "orjson") else "json"
+
+if JSON_CODEC == "orjson" and orjson is None:
+    logging.getLogger(__name__).warning("orjson no está instalado, se usa la librería estándar")
+
+if BACKEND == "orjson":
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+    _PRETTY_OPTIONS = _OPTIONS | orjson.OPT_INDENT_2
+
+
+def _default(value):
+    """Tipos que JSON no soporta (Decimal, fechas con stdlib, etc.) se guardan como texto"""
+    return str(value)
+
+
+def dumps_bytes(obj) -> bytes:
+    """Serializar a bytes UTF-8 (cuerpo de peticiones HTTP)"""
+    if BACKEND == "orjson":
+        try:
+            return orjson.dumps(obj, default=_default, option=_OPTIONS)
+        except TypeError:
+            pass  # Enteros de más de 64 bits u otros casos que orjson no cubre
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj) -> str:
+    """Serializar a texto (columnas JSON)"""
+    return dumps_bytes(obj).decode("utf-8")
+
+
+def loads(data):
+    """Deserializar desde str o bytes"""
+    if BACKEND == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def pretty(obj) -> str:
+    """Texto indentado para logs y diálogos de detalle"""
+    if BACKEND == "orjson":
+        try:
+            return orjson.dumps(obj, default=_default, option=_PRETTY_OPTIONS).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, indent=2, default=_default, ensure_ascii=False)
@@ -3,11 +3,19 @@ FacturaPro - Aplicación de Facturación Electrónica
 Versión de escritorio con Python + Flet
 """
 import flet as ft
+from app_logging import setup_logging
 from database import init_db
+from services import EmailOutboxService
+from services.response_store import start_compaction as start_response_compaction
+from services.metrics import purge_old as purge_old_metrics
+from services.exporter import start_exporter
+from services.profiling import profiled
+from services.sql_monitor import install as install_sql_monitor
 from views import DocumentsView, SettingsView, ResolutionsView, CustomersView, ProductsView, PurchasesView
 from views import COLORS, get_theme, toggle_theme, is_dark_mode, APP_NAME
 
 
+@profiled("startup")
 def main(page: ft.Page):
     """Función principal de la aplicación"""
     
@@ -22,9 +30,27 @@ def main(page: ft.Page):
     page.window.min_width = 1000
     page.window.min_height = 600
     
+    # Registro en consola y en data/logs/app.log
+    setup_logging()
+    
+    # Registro de consultas SQL lentas y consultas por acción
+    install_sql_monitor()
+    
     # Inicializar base de datos
     init_db()
     
+    # Reanudar correos pendientes de sesiones anteriores
+    EmailOutboxService.resume_pending()
+    
+    # Resumir respuestas de ApiDian guardadas completas por versiones anteriores
+    start_response_compaction()
+    
+    # Descartar métricas de latencia fuera del periodo de retención
+    purge_old_metrics()
+    
+    # Exportador Prometheus (solo si METRICS_EXPORTER_PORT está configurado)
+    start_exporter()
+    
     # Vistas
     documents_view = DocumentsView(page)
     settings_view = SettingsView(page)
@@ -1,3 +1,4 @@
 from .xml_parser import SiigoXmlParser
 from .api_dian import ApiDianService
 from .folder_watcher import FolderWatcherService
+from .email_outbox import EmailOutboxService
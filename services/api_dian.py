@@ -1,13 +1,29 @@
 """Servicio de comunicación con ApiDian"""
+import queue
+import logging
+import threading
 import requests
 from datetime import datetime
+import json_codec
+from app_logging import Pretty
 from typing import Optional
 from database import get_session, Settings, Document, Resolution
+from services.payload_compiler import compile_lines, compile_support_lines
+from services.metrics import timed, recorded, span
+from services.profiling import profiled
+from services import exporter, cassette
+
+logger = logging.getLogger(__name__)
 
 
 class ApiDianService:
     """Cliente para la API de facturación electrónica"""
     
+    # Descargas de artefactos tras los envíos: un solo hilo en segundo plano
+    _artifact_queue = queue.Queue()
+    _artifact_worker = None
+    _artifact_lock = threading.Lock()
+    
     def __init__(self):
         session = get_session()
         self.settings = session.query(Settings).first()
@@ -15,6 +31,7 @@ class ApiDianService:
         
         self.base_url = self.settings.api_url.rstrip('/') if self.settings else ""
         self.headers = self._get_headers()
+        self._http = cassette.transport(self.base_url)
     
     def _get_headers(self) -> dict:
         """Obtener headers para las peticiones"""
@@ -26,13 +43,14 @@ class ApiDianService:
             headers["Authorization"] = f"Bearer {self.settings.api_token}"
         return headers
     
+    @exporter.observed_request("POST")
     def _post(self, url: str, data: dict) -> dict:
         """Realizar petición POST"""
         try:
-            response = requests.post(url, json=data, headers=self.headers, timeout=60)
+            response = self._http.post(url, data=json_codec.dumps_bytes(data), headers=self.headers, timeout=60)
             
             try:
-                result = response.json() if response.text else {}
+                result = json_codec.loads(response.content) if response.content else {}
             except:
                 result = {"raw_response": response.text}
             
@@ -57,12 +75,13 @@ class ApiDianService:
         except Exception as e:
             return {"success": False, "message": str(e)}
     
+    @exporter.observed_request("PUT")
     def _put(self, url: str, data: dict) -> dict:
         """Realizar petición PUT"""
         try:
-            response = requests.put(url, json=data, headers=self.headers, timeout=60)
+            response = self._http.put(url, data=json_codec.dumps_bytes(data), headers=self.headers, timeout=60)
             try:
-                result = response.json() if response.text else {}
+                result = json_codec.loads(response.content) if response.content else {}
             except:
                 result = {"raw_response": response.text}
             result["success"] = response.status_code in [200, 201]
@@ -72,20 +91,107 @@ class ApiDianService:
         except Exception as e:
             return {"success": False, "message": str(e)}
     
+    @exporter.observed_request("GET")
     def _get(self, url: str) -> dict:
         """Realizar petición GET"""
         try:
-            response = requests.get(url, headers=self.headers, timeout=60)
+            response = self._http.get(url, headers=self.headers, timeout=60)
             return {"success": response.ok, "content": response.content, "status": response.status_code}
         except Exception as e:
             return {"success": False, "message": str(e)}
     
+    @exporter.observed_request("GET")
+    def _download(self, url: str, sink, expected_sha256: str = None, max_attempts: int = 3,
+                  chunk_size: int = 64 * 1024) -> dict:
+        """Descargar en streaming (iter_content) hacia un archivo o un objeto tipo archivo
+        
+        Si `sink` es una ruta, se escribe en `<ruta>.part` y, ante un corte de conexión,
+        se reanuda con una petición Range desde los bytes ya recibidos. Devuelve el
+        SHA-256 y el tamaño calculados durante la descarga, sin cargar el archivo en memoria.
+        """
+        import os
+        import hashlib
+        
+        is_path = isinstance(sink, (str, os.PathLike))
+        part_path = f"{sink}.part" if is_path else None
+        last_error = "Error desconocido"
+        
+        for attempt in range(max_attempts):
+            digest = hashlib.sha256()
+            offset = os.path.getsize(part_path) if is_path and os.path.exists(part_path) else 0
+            headers = dict(self.headers)
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+            
+            try:
+                with self._http.get(url, headers=headers, stream=True, timeout=60) as response:
+                    if offset and response.status_code == 416:
+                        # El parcial no coincide con el servidor: empezar de nuevo
+                        os.remove(part_path)
+                        continue
+                    if not response.ok:
+                        return {"success": False, "status": response.status_code,
+                                "message": f"Error HTTP {response.status_code}"}
+                    
+                    if offset and response.status_code == 206:
+                        # Incluir en el hash los bytes ya descargados
+                        with open(part_path, "rb") as f:
+                            for chunk in iter(lambda: f.read(chunk_size), b""):
+                                digest.update(chunk)
+                        mode = "ab"
+                    else:
+                        # El servidor ignoró el Range: descargar completo
+                        offset = 0
+                        mode = "wb"
+                    
+                    expected_size = response.headers.get("Content-Length")
+                    expected_size = offset + int(expected_size) if expected_size else None
+                    
+                    out = open(part_path, mode) if is_path else sink
+                    size = offset
+                    try:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            if chunk:
+                                out.write(chunk)
+                                digest.update(chunk)
+                                size += len(chunk)
+                    finally:
+                        if is_path:
+                            out.close()
+                    
+                    if expected_size is not None and size != expected_size:
+                        last_error = f"Descarga incompleta ({size} de {expected_size} bytes)"
+                        if not is_path:
+                            break
+                        continue
+                    
+                    sha256 = digest.hexdigest()
+                    if expected_sha256 and sha256 != expected_sha256:
+                        if is_path:
+                            os.remove(part_path)
+                        return {"success": False, "message": "Checksum inválido en la descarga"}
+                    
+                    if is_path:
+                        os.replace(part_path, sink)
+                    return {"success": True, "path": str(sink) if is_path else None,
+                            "sha256": sha256, "size": size, "status": response.status_code}
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                # Reintentar; con ruta de destino se reanuda desde el parcial
+                last_error = str(e)
+                if not is_path:
+                    break
+            except Exception as e:
+                return {"success": False, "message": str(e)}
+        
+        return {"success": False, "message": last_error}
+    
+    @exporter.observed_request("GET")
     def _get_json(self, url: str) -> dict:
         """Realizar petición GET y devolver JSON"""
         try:
-            response = requests.get(url, headers=self.headers, timeout=60)
+            response = self._http.get(url, headers=self.headers, timeout=60)
             try:
-                result = response.json() if response.text else {}
+                result = json_codec.loads(response.content) if response.content else {}
             except:
                 result = {"raw_response": response.text}
             result["success"] = response.status_code in [200, 201]
@@ -93,31 +199,161 @@ class ApiDianService:
         except Exception as e:
             return {"success": False, "message": str(e)}
     
-    def get_acquirer(self, document_type_id: int, document_number: str) -> dict:
+    # Mapa ID -> código de tipo de documento (catálogo estático, se carga una vez)
+    _type_document_codes = None
+    
+    def _get_type_document_code(self, document_type_id: int) -> str:
+        """Convertir ID de tipo de documento al CÓDIGO que espera la DIAN"""
+        if ApiDianService._type_document_codes is None:
+            from database import TypeDocumentIdentification
+            session = get_session()
+            ApiDianService._type_document_codes = {
+                t.id: t.code for t in session.query(TypeDocumentIdentification).all()
+            }
+            session.close()
+        
+        # Si no se encuentra, usar el ID como código (fallback)
+        return ApiDianService._type_document_codes.get(document_type_id) or str(document_type_id)
+    
+    def get_acquirer(self, document_type_id: int, document_number: str, use_cache: bool = True) -> dict:
         """Consultar tercero en la DIAN por tipo y número de documento
         
         IMPORTANTE: La DIAN espera el CÓDIGO del tipo de documento (ej: 13 para CC),
         no el ID de la tabla (ej: 3 para CC). Este método convierte automáticamente.
+        
+        Se consulta primero la caché local (acquirer_cache); solo si no hay una
+        entrada vigente se llama a GetAcquirer y se guarda el resultado.
         """
-        # Convertir ID de tipo de documento al CÓDIGO que espera la DIAN
+        document_number = str(document_number).strip()
+        
+        if use_cache:
+            cached = self._get_cached_acquirer(document_type_id, document_number)
+            if cached is not None:
+                return cached
+        
+        result = self._fetch_acquirer(document_type_id, document_number)
+        
+        # Solo se cachea un resultado definitivo: encontrado, o consulta exitosa sin tercero.
+        # Los errores de red/HTTP no se cachean para reintentar en la próxima consulta.
+        if result.get("success") or result.get("not_found"):
+            self._store_acquirer(document_type_id, document_number, result)
+        
+        return result
+    
+    def _get_cached_acquirer(self, document_type_id: int, document_number: str) -> Optional[dict]:
+        """Obtener tercero desde la caché si la entrada sigue vigente"""
+        from datetime import timedelta
+        from config import ACQUIRER_CACHE_TTL_HOURS, ACQUIRER_CACHE_NEGATIVE_TTL_HOURS
+        from database import AcquirerCache
+        
         session = get_session()
-        from database import TypeDocumentIdentification
-        type_doc = session.query(TypeDocumentIdentification).get(document_type_id)
+        entry = session.query(AcquirerCache).filter(
+            AcquirerCache.type_document_identification_id == document_type_id,
+            AcquirerCache.identification_number == document_number,
+        ).first()
         session.close()
         
-        if type_doc and type_doc.code:
-            document_type_code = type_doc.code
-        else:
-            # Si no se encuentra, usar el ID como código (fallback)
-            document_type_code = str(document_type_id)
+        if not entry or not entry.fetched_at:
+            return None
+        
+        ttl_hours = ACQUIRER_CACHE_TTL_HOURS if entry.found else ACQUIRER_CACHE_NEGATIVE_TTL_HOURS
+        if datetime.now() - entry.fetched_at > timedelta(hours=ttl_hours):
+            return None
+        
+        if not entry.found:
+            return {
+                "success": False,
+                "not_found": True,
+                "cached": True,
+                "message": "No se encontró información del tercero",
+            }
+        
+        return {
+            "success": True,
+            "cached": True,
+            "name": entry.name or "",
+            "email": entry.email or "",
+            "data": entry.data or {},
+        }
+    
+    def _store_acquirer(self, document_type_id: int, document_number: str, result: dict):
+        """Guardar (o actualizar) el resultado de GetAcquirer en la caché
+        
+        Si otra terminal o hilo insertó el mismo tercero al mismo tiempo, el índice
+        único rechaza el segundo registro y se actualiza el existente.
+        """
+        from sqlalchemy.exc import IntegrityError
+        from database import AcquirerCache
+        
+        found = bool(result.get("success"))
+        for attempt in range(2):
+            session = get_session()
+            entry = session.query(AcquirerCache).filter(
+                AcquirerCache.type_document_identification_id == document_type_id,
+                AcquirerCache.identification_number == document_number,
+            ).first()
+            if not entry:
+                entry = AcquirerCache(
+                    type_document_identification_id=document_type_id,
+                    identification_number=document_number,
+                )
+                session.add(entry)
+            
+            entry.found = found
+            entry.name = (result.get("name") or "")[:200] if found else None
+            entry.email = (result.get("email") or "")[:100] if found else None
+            entry.data = result.get("data") if found else None
+            entry.fetched_at = datetime.now()
+            try:
+                session.commit()
+                return
+            except IntegrityError:
+                session.rollback()
+                if attempt:
+                    raise
+            finally:
+                session.close()
+    
+    def prefetch_acquirers(self, identifications: list) -> dict:
+        """Precargar en la caché los terceros indicados como [(type_id, número), ...]
+        
+        Omite los que ya tienen una entrada vigente. Pensado para ejecutarse
+        en segundo plano después de ingerir XMLs.
+        """
+        results = {"fetched": 0, "cached": 0, "errors": 0}
+        seen = set()
+        
+        for document_type_id, document_number in identifications:
+            document_number = str(document_number or "").strip()
+            key = (document_type_id, document_number)
+            if not document_number or key in seen:
+                continue
+            seen.add(key)
+            
+            if self._get_cached_acquirer(document_type_id, document_number) is not None:
+                results["cached"] += 1
+                continue
+            
+            try:
+                result = self.get_acquirer(document_type_id, document_number, use_cache=False)
+                if result.get("success") or result.get("not_found"):
+                    results["fetched"] += 1
+                else:
+                    results["errors"] += 1
+            except Exception as e:
+                logger.warning("GetAcquirer: error precargando %s: %s", document_number, e)
+                results["errors"] += 1
+        
+        return results
+    
+    def _fetch_acquirer(self, document_type_id: int, document_number: str) -> dict:
+        """Consultar GetAcquirer en ApiDian (sin caché)"""
+        document_type_code = self._get_type_document_code(document_type_id)
         
         url = f"{self.base_url}/customer/{document_type_code}/{document_number}"
         result = self._get_json(url)
         
-        # Debug: imprimir respuesta completa
-        import json
-        print(f"[GetAcquirer] URL: {url}")
-        print(f"[GetAcquirer] Response: {json.dumps(result, indent=2, default=str)}")
+        logger.debug("GetAcquirer %s respuesta: %s", url, Pretty(result))
         
         if result.get("success"):
             # La estructura es: ResponseDian (que ya es Body) -> GetAcquirerResponse -> GetAcquirerResult
@@ -127,8 +363,6 @@ class ApiDianService:
             acquirer_response = response_dian.get("GetAcquirerResponse", {})
             acquirer_result = acquirer_response.get("GetAcquirerResult", {})
             
-            print(f"[GetAcquirer] acquirer_result: {json.dumps(acquirer_result, indent=2, default=str)}")
-            
             if acquirer_result:
                 # Campos de la respuesta DIAN:
                 # - ReceiverName: nombre del tercero
@@ -154,7 +388,7 @@ class ApiDianService:
                 # Obtener email - la DIAN usa ReceiverEmail
                 email = acquirer_result.get("ReceiverEmail", "") or acquirer_result.get("Email", "") or acquirer_result.get("ElectronicMail", "")
                 
-                print(f"[GetAcquirer] Extracted - name: {name}, email: {email}")
+                logger.debug("GetAcquirer %s: nombre=%s, correo=%s", document_number, name, email)
                 
                 return {
                     "success": True,
@@ -165,9 +399,10 @@ class ApiDianService:
             else:
                 # Si no hay acquirer_result, puede que la estructura sea diferente
                 # Intentar buscar en otros lugares
-                print(f"[GetAcquirer] No acquirer_result found, checking alternative structures")
+                logger.debug("GetAcquirer %s: respuesta sin GetAcquirerResult", document_number)
                 return {
                     "success": False,
+                    "not_found": True,
                     "message": result.get("message", "No se encontró información del tercero"),
                     "raw": response_dian,
                 }
@@ -210,6 +445,7 @@ class ApiDianService:
         }
         return self._put(url, data)
     
+    @timed("configure")
     def configure_software_ds(self) -> dict:
         """Configurar software de Documento Soporte en ApiDian"""
         ds_software_id = getattr(self.settings, 'ds_software_id', None)
@@ -242,52 +478,53 @@ class ApiDianService:
         }
         return self._put(url, data)
     
+    @profiled("send_invoice")
+    @recorded("send_invoice")
     def send_invoice(self, document: Document) -> dict:
         """Enviar factura a la DIAN"""
         endpoint = self._get_invoice_endpoint()
-        data = self._build_invoice_payload(document)
-        
-        # Guardar request
-        session = get_session()
-        document.api_request = data
-        session.merge(document)
-        session.commit()
-        session.close()
-        
-        result = self._post(endpoint, data)
-        self._process_response(document, result)
+        data = self._ready_payload(document)
+        blocked = self._validate_before_send(document, data)
+        if blocked:
+            return blocked
+        self._record_local_cufe(document, data)
+        with span("http"):  # Incluye la validación de la DIAN (envío síncrono)
+            result = self._post(endpoint, data)
+        self._process_response(document, result, data)
         return result
     
+    @profiled("send_credit_note")
+    @recorded("send_credit_note")
     def send_credit_note(self, document: Document) -> dict:
         """Enviar nota crédito a la DIAN"""
         endpoint = self._get_credit_note_endpoint()
-        data = self._build_credit_note_payload(document)
-        
-        session = get_session()
-        document.api_request = data
-        session.merge(document)
-        session.commit()
-        session.close()
-        
-        result = self._post(endpoint, data)
-        self._process_response(document, result)
+        data = self._ready_payload(document)
+        blocked = self._validate_before_send(document, data)
+        if blocked:
+            return blocked
+        self._record_local_cufe(document, data)
+        with span("http"):  # Incluye la validación de la DIAN (envío síncrono)
+            result = self._post(endpoint, data)
+        self._process_response(document, result, data)
         return result
     
+    @profiled("send_debit_note")
+    @recorded("send_debit_note")
     def send_debit_note(self, document: Document) -> dict:
         """Enviar nota débito a la DIAN"""
         endpoint = self._get_debit_note_endpoint()
-        data = self._build_debit_note_payload(document)
-        
-        session = get_session()
-        document.api_request = data
-        session.merge(document)
-        session.commit()
-        session.close()
-        
-        result = self._post(endpoint, data)
-        self._process_response(document, result)
+        data = self._ready_payload(document)
+        blocked = self._validate_before_send(document, data)
+        if blocked:
+            return blocked
+        self._record_local_cufe(document, data)
+        with span("http"):  # Incluye la validación de la DIAN (envío síncrono)
+            result = self._post(endpoint, data)
+        self._process_response(document, result, data)
         return result
     
+    @profiled("send_support_document")
+    @recorded("send_support_document")
     def send_support_document(self, document: Document) -> dict:
         """Enviar documento soporte a la DIAN"""
         # Verificar configuración de DS
@@ -309,64 +546,179 @@ class ApiDianService:
                     "message": "Configure el TestSetId de Documento Soporte en Configuración > API DIAN > Documento Soporte Electrónico"
                 }
         
+        # Validar localmente antes de cualquier llamada a la API
+        data = self._ready_payload(document)
+        blocked = self._validate_before_send(document, data)
+        if blocked:
+            return blocked
+        self._record_local_cufe(document, data)
+        
         # Configurar software de DS antes de enviar
         config_result = self.configure_software_ds()
-        # Log del resultado de configuración
-        print(f"[DS] Config software result: {config_result}")
+        logger.debug("DS: configuración de software: %s", Pretty(config_result))
         
         endpoint = self._get_support_document_endpoint()
-        data = self._build_support_document_payload(document)
-        
-        # Log del payload para debug
-        import json
-        print(f"[DS] Endpoint: {endpoint}")
-        print(f"[DS] Payload: {json.dumps(data, indent=2, default=str)}")
-        
-        session = get_session()
-        document.api_request = data
-        session.merge(document)
-        session.commit()
-        session.close()
+        logger.debug("DS %s payload: %s", endpoint, Pretty(data))
         
-        result = self._post(endpoint, data)
+        with span("http"):  # Incluye la validación de la DIAN (envío síncrono)
+            result = self._post(endpoint, data)
+        logger.debug("DS %s respuesta: %s", document.full_number, Pretty(result))
         
-        # Log del resultado
-        print(f"[DS] Result: {json.dumps(result, indent=2, default=str)}")
-        
-        self._process_response(document, result)
+        self._process_response(document, result, data)
         return result
     
+    @profiled("send_sd_adjustment_note")
+    @recorded("send_sd_adjustment_note")
     def send_sd_adjustment_note(self, document: Document) -> dict:
         """Enviar nota de ajuste a documento soporte a la DIAN"""
+        # Validar localmente antes de cualquier llamada a la API
+        data = self._ready_payload(document)
+        blocked = self._validate_before_send(document, data)
+        if blocked:
+            return blocked
+        self._record_local_cufe(document, data)
+        
         # Configurar software de DS antes de enviar (igual que en send_support_document)
         ds_software_id = getattr(self.settings, 'ds_software_id', None)
         ds_software_pin = getattr(self.settings, 'ds_software_pin', None)
         
         if ds_software_id and ds_software_pin:
             config_result = self.configure_software_ds()
-            print(f"[NA-DS] Config software result: {config_result}")
+            logger.debug("NA-DS: configuración de software: %s", Pretty(config_result))
         
         endpoint = self._get_sd_adjustment_note_endpoint()
-        data = self._build_sd_adjustment_note_payload(document)
+        logger.debug("NA-DS %s payload: %s", endpoint, Pretty(data))
         
-        # Log del payload para debug
-        import json
-        print(f"[NA-DS] Endpoint: {endpoint}")
-        print(f"[NA-DS] Payload: {json.dumps(data, indent=2, default=str)}")
+        with span("http"):  # Incluye la validación de la DIAN (envío síncrono)
+            result = self._post(endpoint, data)
+        logger.debug("NA-DS %s respuesta: %s", document.full_number, Pretty(result))
         
-        session = get_session()
-        document.api_request = data
-        session.merge(document)
-        session.commit()
-        session.close()
+        self._process_response(document, result, data)
+        return result
+    
+    @timed("build")
+    def build_payload(self, document: Document) -> dict:
+        """Construir el payload según el tipo de documento"""
+        builders = {
+            "invoice": self._build_invoice_payload,
+            "credit_note": self._build_credit_note_payload,
+            "debit_note": self._build_debit_note_payload,
+            "support_document": self._build_support_document_payload,
+            "sd_adjustment_note": self._build_sd_adjustment_note_payload,
+        }
+        builder = builders.get(document.type)
+        if not builder:
+            raise ValueError(f"Tipo de documento no soportado: {document.type}")
+        return builder(document)
+    
+    def prepare_payload(self, document: Document) -> dict:
+        """Precalcular el payload al importar para que el envío solo selle, envíe y registre
         
-        result = self._post(endpoint, data)
+        La validación aquí es solo un aviso: el documento queda pendiente con los
+        hallazgos en error_message (la resolución o la configuración pueden
+        completarse después). El bloqueo real ocurre en _validate_before_send.
+        """
+        try:
+            document.payload = self.build_payload(document)
+        except Exception as e:
+            document.payload = None
+            document.error_message = f"Aviso: no se pudo preparar el envío ({e}); se reintentará al enviar"
+            return {"success": False, "message": document.error_message}
+        
+        validation = self.validate_payload(document, document.payload)
+        if not validation["valid"]:
+            document.error_message = "Aviso de validación: " + "; ".join(validation["errors"][:3])
+            return {"success": False, "message": document.error_message, "validation": validation}
+        return {"success": True, "validation": validation}
+    
+    @timed("validation")
+    def validate_payload(self, document: Document, payload: dict) -> dict:
+        """Validar localmente las reglas DIAN más comunes sobre el payload"""
+        from services.validator import PayloadValidator
+        return PayloadValidator(self).validate(document, payload)
+    
+    def _validate_before_send(self, document: Document, data: dict) -> Optional[dict]:
+        """Bloquear el envío si el documento sería rechazado (sin consumir un viaje a la DIAN)"""
+        validation = self.validate_payload(document, data)
+        for warning in validation["warnings"]:
+            logger.warning("Validación %s: %s", document.full_number, warning)
+        if validation["valid"]:
+            return None
+        
+        result = {
+            "success": False,
+            "message": "Validación local: " + "; ".join(validation["errors"][:3]),
+            "validation": validation,
+        }
+        self._process_response(document, result, data)
+        return result
+    
+    @timed("cufe")
+    def compute_local_cufe(self, payload: dict) -> Optional[str]:
+        """CUFE/CUDE/CUDS que debe asignar la DIAN al payload sellado (None si faltan datos)"""
+        from services.cufe import cufe_for_payload
         
-        # Log del resultado
-        print(f"[NA-DS] Result: {json.dumps(result, indent=2, default=str)}")
+        technical_key = None
+        if payload and payload.get("type_document_id") == 1:
+            session = get_session()
+            resolution = session.query(Resolution).filter(
+                Resolution.type_document_id == 1,
+                Resolution.prefix == payload.get("prefix"),
+            ).order_by(Resolution.is_active.desc()).first()
+            technical_key = resolution.technical_key if resolution else None
+            session.close()
         
-        self._process_response(document, result)
-        return result
+        try:
+            return cufe_for_payload(payload, self.settings, technical_key)
+        except (TypeError, ValueError):
+            return None
+    
+    def _record_local_cufe(self, document: Document, payload: dict):
+        """Guardar el CUFE local antes del envío: ticket y QR sin esperar a la DIAN"""
+        local_cufe = self.compute_local_cufe(payload)
+        session = get_session()
+        doc = session.query(Document).get(document.id)
+        if doc:
+            doc.local_cufe = local_cufe
+            session.commit()
+        session.close()
+        document.local_cufe = local_cufe
+    
+    @timed("payload")
+    def _ready_payload(self, document: Document) -> dict:
+        """Payload listo para enviar: el precalculado sellado con fecha/hora, o construido ahora"""
+        if document.payload and self._payload_is_current(document):
+            return self._stamp_payload(document.payload)
+        return self.build_payload(document)
+    
+    def _payload_is_current(self, document: Document) -> bool:
+        """El payload precalculado sigue vigente si la configuración y las resoluciones no cambiaron después de importar"""
+        from sqlalchemy import func
+        if not document.created_at:
+            return False
+        session = get_session()
+        resolutions_at = session.query(func.max(Resolution.updated_at)).scalar()
+        session.close()
+        changes = [at for at in (getattr(self.settings, "updated_at", None), resolutions_at) if at]
+        return not changes or max(changes) <= document.created_at
+    
+    def _stamp_payload(self, payload: dict) -> dict:
+        """Actualizar los campos de fecha/hora del payload precalculado (conserva el orden de claves)"""
+        now = datetime.now()
+        today = now.strftime("%Y-%m-%d")
+        data = dict(payload)
+        data["date"] = today
+        data["time"] = now.strftime("%H:%M:%S")
+        
+        # Contado: vence el mismo día del envío
+        payment = data.get("payment_form")
+        if payment and payment.get("payment_form_id", 1) != 2:
+            data["payment_form"] = {**payment, "payment_due_date": today}
+        
+        # Documento soporte: periodo de la transmisión
+        if data.get("type_document_id") == 11:
+            data["invoice_lines"] = [{**line, "start_date": today} for line in data.get("invoice_lines", [])]
+        return data
     
     def _get_invoice_endpoint(self) -> str:
         if self.settings.type_environment_id == 2 and self.settings.test_set_id:
@@ -401,6 +753,7 @@ class ApiDianService:
         """Construir payload para factura"""
         parsed = document.parsed_data or {}
         now = datetime.now()
+        compiled = compile_lines(parsed)
         
         return {
             "number": int(document.number),
@@ -411,9 +764,9 @@ class ApiDianService:
             "sendmail": True,
             "customer": self._build_customer(parsed.get("customer", {})),
             "payment_form": self._build_payment(parsed.get("payment", {})),
-            "legal_monetary_totals": self._build_totals(parsed),
-            "tax_totals": self._build_taxes(parsed),
-            "invoice_lines": self._build_lines(parsed.get("lines", [])),
+            "legal_monetary_totals": compiled["legal_monetary_totals"],
+            "tax_totals": compiled["tax_totals"],
+            "invoice_lines": compiled["lines"],
         }
     
     def _build_credit_note_payload(self, document: Document) -> dict:
@@ -421,6 +774,8 @@ class ApiDianService:
         parsed = document.parsed_data or {}
         now = datetime.now()
         
+        compiled = compile_lines(parsed)
+        
         # Obtener factura de referencia
         session = get_session()
         ref_doc = session.query(Document).get(document.reference_document_id) if document.reference_document_id else None
@@ -442,15 +797,16 @@ class ApiDianService:
             "discrepancyresponsecode": int(parsed.get("discrepancy_code", 2)),
             "discrepancyresponsedescription": parsed.get("discrepancy_description", "Anulación"),
             "customer": self._build_customer(parsed.get("customer", {})),
-            "legal_monetary_totals": self._build_totals(parsed),
-            "tax_totals": self._build_taxes(parsed),
-            "credit_note_lines": self._build_lines(parsed.get("lines", [])),
+            "legal_monetary_totals": compiled["legal_monetary_totals"],
+            "tax_totals": compiled["tax_totals"],
+            "credit_note_lines": compiled["lines"],
         }
     
     def _build_debit_note_payload(self, document: Document) -> dict:
         """Construir payload para nota débito"""
         parsed = document.parsed_data or {}
         now = datetime.now()
+        compiled = compile_lines(parsed)
         
         session = get_session()
         ref_doc = session.query(Document).get(document.reference_document_id) if document.reference_document_id else None
@@ -472,9 +828,9 @@ class ApiDianService:
             "discrepancyresponsecode": int(parsed.get("discrepancy_code", 3)),
             "discrepancyresponsedescription": parsed.get("discrepancy_description", "Ajuste"),
             "customer": self._build_customer(parsed.get("customer", {})),
-            "requested_monetary_totals": self._build_totals(parsed),
-            "tax_totals": self._build_taxes(parsed),
-            "debit_note_lines": self._build_lines(parsed.get("lines", [])),
+            "requested_monetary_totals": compiled["legal_monetary_totals"],
+            "tax_totals": compiled["tax_totals"],
+            "debit_note_lines": compiled["lines"],
         }
     
     def _build_support_document_payload(self, document: Document) -> dict:
@@ -495,30 +851,11 @@ class ApiDianService:
         resolution_number = resolution.resolution if resolution else ""
         session.close()
         
-        # Calcular totales - IGUAL QUE EN EL POS
+        # Calcular líneas y totales - IGUAL QUE EN EL POS
         # El unit_price del formulario se asume que INCLUYE IVA (como en una compra real)
-        line_extension_amount = 0
-        total_tax_amount = 0
-        
-        for line in lines:
-            tax_rate = float(line.get("tax_percent", 0))
-            quantity = float(line.get("quantity", 1))
-            unit_cost = float(line.get("unit_price", 0))
-            
-            # Precio unitario sin IVA (el precio ingresado incluye IVA)
-            if tax_rate > 0:
-                unit_price_without_tax = unit_cost / (1 + (tax_rate / 100))
-            else:
-                unit_price_without_tax = unit_cost
-            
-            # Subtotal = cantidad × precio sin IVA
-            subtotal = quantity * unit_price_without_tax
-            tax_amount = subtotal * (tax_rate / 100)
-            
-            line_extension_amount += subtotal
-            total_tax_amount += tax_amount
-        
-        tax_inclusive_amount = line_extension_amount + total_tax_amount
+        compiled = compile_support_lines(lines, now.strftime("%Y-%m-%d"))
+        line_extension_amount = compiled["line_extension_amount"]
+        tax_inclusive_amount = compiled["tax_inclusive_amount"]
         
         return {
             "number": int(document.number),
@@ -543,18 +880,18 @@ class ApiDianService:
                 "charge_indicator": False,
                 "allowance_charge_reason": "DESCUENTO GENERAL",
                 "amount": "0.00",
-                "base_amount": f"{line_extension_amount:.2f}",
+                "base_amount": line_extension_amount,
             }],
             "legal_monetary_totals": {
-                "line_extension_amount": f"{line_extension_amount:.2f}",
-                "tax_exclusive_amount": f"{line_extension_amount:.2f}",
-                "tax_inclusive_amount": f"{tax_inclusive_amount:.2f}",
+                "line_extension_amount": line_extension_amount,
+                "tax_exclusive_amount": line_extension_amount,
+                "tax_inclusive_amount": tax_inclusive_amount,
                 "allowance_total_amount": "0.00",
                 "charge_total_amount": "0.00",
-                "payable_amount": f"{tax_inclusive_amount:.2f}",
+                "payable_amount": tax_inclusive_amount,
             },
-            "tax_totals": self._build_ds_tax_totals(lines),
-            "invoice_lines": self._build_ds_invoice_lines(lines, now.strftime("%Y-%m-%d")),
+            "tax_totals": compiled["tax_totals"],
+            "invoice_lines": compiled["lines"],
         }
     
     def _build_sd_adjustment_note_payload(self, document: Document) -> dict:
@@ -570,28 +907,10 @@ class ApiDianService:
         ref_doc = session.query(Document).get(document.reference_document_id) if document.reference_document_id else None
         session.close()
         
-        # Calcular totales - IGUAL QUE EN EL POS
-        line_extension_amount = 0
-        total_tax_amount = 0
-        
-        for line in lines:
-            tax_rate = float(line.get("tax_percent", 0))
-            quantity = float(line.get("quantity", 1))
-            unit_cost = float(line.get("unit_price", 0))
-            
-            # Precio unitario sin IVA
-            if tax_rate > 0:
-                unit_price_without_tax = unit_cost / (1 + (tax_rate / 100))
-            else:
-                unit_price_without_tax = unit_cost
-            
-            subtotal = quantity * unit_price_without_tax
-            tax_amount = subtotal * (tax_rate / 100)
-            
-            line_extension_amount += subtotal
-            total_tax_amount += tax_amount
-        
-        tax_inclusive_amount = line_extension_amount + total_tax_amount
+        # Calcular líneas y totales - IGUAL QUE EN EL POS
+        compiled = compile_support_lines(lines)
+        line_extension_amount = compiled["line_extension_amount"]
+        tax_inclusive_amount = compiled["tax_inclusive_amount"]
         
         # Número de referencia del DS original
         ds_number = ref_doc.full_number if ref_doc else ""
@@ -615,23 +934,23 @@ class ApiDianService:
             "sendmail": False,
             "sendmailtome": False,
             "seller": self._build_seller(parsed.get("customer", {})),
-            "tax_totals": self._build_ds_tax_totals(lines),
+            "tax_totals": compiled["tax_totals"],
             "allowance_charges": [{
                 "discount_id": 1,
                 "charge_indicator": False,
                 "allowance_charge_reason": "DESCUENTO GENERAL",
                 "amount": "0.00",
-                "base_amount": f"{line_extension_amount:.2f}",
+                "base_amount": line_extension_amount,
             }],
             "legal_monetary_totals": {
-                "line_extension_amount": f"{line_extension_amount:.2f}",
-                "tax_exclusive_amount": f"{line_extension_amount:.2f}",
-                "tax_inclusive_amount": f"{tax_inclusive_amount:.2f}",
+                "line_extension_amount": line_extension_amount,
+                "tax_exclusive_amount": line_extension_amount,
+                "tax_inclusive_amount": tax_inclusive_amount,
                 "allowance_total_amount": "0.00",
                 "charge_total_amount": "0.00",
-                "payable_amount": f"{tax_inclusive_amount:.2f}",
+                "payable_amount": tax_inclusive_amount,
             },
-            "credit_note_lines": self._build_ds_credit_note_lines(lines),
+            "credit_note_lines": compiled["lines"],
         }
     
     def _build_seller(self, seller: dict) -> dict:
@@ -775,265 +1094,6 @@ class ApiDianService:
             "taxable_amount": f"{subtotal:.2f}",
         }]
     
-    def _build_ds_tax_totals(self, lines: list) -> list:
-        """Construir tax_totals para documento soporte - formato exacto POS"""
-        tax_groups = {}
-        
-        for line in lines:
-            rate = float(line.get("tax_percent", 0))
-            quantity = float(line.get("quantity", 1))
-            unit_cost = float(line.get("unit_price", 0))
-            
-            # Precio unitario sin IVA (el precio incluye IVA)
-            if rate > 0:
-                unit_price_without_tax = unit_cost / (1 + (rate / 100))
-            else:
-                unit_price_without_tax = unit_cost
-            
-            # Subtotal = cantidad × precio sin IVA
-            subtotal = quantity * unit_price_without_tax
-            tax_amount = subtotal * (rate / 100)
-            
-            key = f"1_{rate}"  # IVA + tasa
-            if key not in tax_groups:
-                tax_groups[key] = {
-                    "tax_id": 1,
-                    "tax_amount": 0,
-                    "taxable_amount": 0,
-                    "percent": rate,
-                }
-            
-            tax_groups[key]["tax_amount"] += tax_amount
-            tax_groups[key]["taxable_amount"] += subtotal
-        
-        # Si no hay impuestos, agregar IVA 0%
-        if not tax_groups:
-            tax_groups["1_0"] = {
-                "tax_id": 1,
-                "tax_amount": 0,
-                "taxable_amount": 0,
-                "percent": 0,
-            }
-        
-        # Formatear según POS: percent como entero string "0" no "0.00"
-        result = []
-        for group in tax_groups.values():
-            result.append({
-                "tax_id": group["tax_id"],
-                "tax_amount": f"{group['tax_amount']:.2f}",
-                "percent": str(int(group["percent"])),  # "0" no "0.00"
-                "taxable_amount": f"{group['taxable_amount']:.2f}",
-            })
-        
-        return result
-    
-    def _build_ds_invoice_lines(self, lines: list, document_date: str) -> list:
-        """Construir líneas para documento soporte - formato exacto Postman"""
-        result = []
-        
-        for line in lines:
-            tax_rate = float(line.get("tax_percent", 0))
-            quantity = float(line.get("quantity", 1))
-            unit_cost = float(line.get("unit_price", 0))
-            
-            # Precio unitario sin IVA (el precio incluye IVA)
-            if tax_rate > 0:
-                unit_price_without_tax = unit_cost / (1 + (tax_rate / 100))
-            else:
-                unit_price_without_tax = unit_cost
-            
-            # line_extension_amount = cantidad × precio_unitario (sin IVA)
-            line_extension_amount = quantity * unit_price_without_tax
-            tax_amount = line_extension_amount * (tax_rate / 100)
-            
-            # Formato según Postman
-            quantity_formatted = f"{quantity:.2f}"
-            line_extension_formatted = f"{line_extension_amount:.2f}"
-            price_amount_formatted = f"{unit_price_without_tax:.2f}"
-            
-            # En las líneas, percent va con decimales "0.00" según Postman
-            result.append({
-                "unit_measure_id": 70,
-                "invoiced_quantity": quantity_formatted,
-                "line_extension_amount": line_extension_formatted,
-                "free_of_charge_indicator": False,
-                "allowance_charges": [{
-                    "charge_indicator": False,
-                    "allowance_charge_reason": "DESCUENTO GENERAL",
-                    "amount": "0.00",
-                    "base_amount": line_extension_formatted,
-                }],
-                "tax_totals": [{
-                    "tax_id": 1,
-                    "tax_amount": f"{tax_amount:.2f}",
-                    "percent": f"{tax_rate:.2f}",  # Con decimales en líneas
-                    "taxable_amount": line_extension_formatted,
-                }],
-                "description": line.get("description", line.get("name", "Producto")),
-                "notes": "",
-                "code": str(line.get("code", "PROD")),
-                "type_item_identification_id": 4,
-                "price_amount": price_amount_formatted,
-                "base_quantity": quantity_formatted,
-                "type_generation_transmition_id": 1,
-                "start_date": document_date,
-            })
-        
-        return result
-    
-    def _build_ds_credit_note_lines(self, lines: list) -> list:
-        """Construir líneas para nota de ajuste DS - formato exacto Postman"""
-        result = []
-        
-        for line in lines:
-            tax_rate = float(line.get("tax_percent", 0))
-            quantity = float(line.get("quantity", 1))
-            unit_cost = float(line.get("unit_price", 0))
-            
-            # Precio unitario sin IVA
-            if tax_rate > 0:
-                unit_price_without_tax = unit_cost / (1 + (tax_rate / 100))
-            else:
-                unit_price_without_tax = unit_cost
-            
-            line_extension_amount = quantity * unit_price_without_tax
-            tax_amount = line_extension_amount * (tax_rate / 100)
-            
-            quantity_formatted = f"{quantity:.2f}"
-            line_extension_formatted = f"{line_extension_amount:.2f}"
-            price_amount_formatted = f"{unit_price_without_tax:.2f}"
-            
-            result.append({
-                "unit_measure_id": 70,
-                "invoiced_quantity": quantity_formatted,
-                "line_extension_amount": line_extension_formatted,
-                "free_of_charge_indicator": False,
-                "allowance_charges": [{
-                    "charge_indicator": False,
-                    "allowance_charge_reason": "DESCUENTO GENERAL",
-                    "amount": "0.00",
-                    "base_amount": line_extension_formatted,
-                }],
-                "tax_totals": [{
-                    "tax_id": 1,
-                    "tax_amount": f"{tax_amount:.2f}",
-                    "percent": f"{tax_rate:.2f}",  # Con decimales en líneas
-                    "taxable_amount": line_extension_formatted,
-                }],
-                "description": line.get("description", line.get("name", "Producto")),
-                "notes": "",
-                "code": str(line.get("code", "PROD")),
-                "type_item_identification_id": 4,
-                "price_amount": price_amount_formatted,
-                "base_quantity": quantity_formatted,
-            })
-        
-        return result
-    
-    def _build_totals(self, parsed: dict) -> dict:
-        """Construir totales monetarios para la DIAN"""
-        subtotal = float(parsed.get("subtotal", 0))
-        total_tax = float(parsed.get("total_tax", 0))
-        total_discount = float(parsed.get("total_discount", 0))
-        total = float(parsed.get("total", 0))
-        
-        # line_extension_amount = suma de bases imponibles (subtotal sin impuestos)
-        # tax_exclusive_amount = subtotal - descuentos
-        # tax_inclusive_amount = subtotal - descuentos + impuestos
-        # payable_amount = total a pagar
-        
-        tax_exclusive = subtotal - total_discount
-        tax_inclusive = tax_exclusive + total_tax
-        
-        # Si el total parseado es diferente, usarlo (viene del XML)
-        if total > 0 and abs(total - tax_inclusive) > 0.01:
-            payable = total
-        else:
-            payable = tax_inclusive
-        
-        return {
-            "line_extension_amount": f"{subtotal:.2f}",
-            "tax_exclusive_amount": f"{tax_exclusive:.2f}",
-            "tax_inclusive_amount": f"{tax_inclusive:.2f}",
-            "allowance_total_amount": f"{total_discount:.2f}",
-            "charge_total_amount": "0.00",
-            "payable_amount": f"{payable:.2f}",
-        }
-    
-    def _build_taxes(self, parsed: dict) -> list:
-        """Construir tax_totals - agrupa por tax_id Y porcentaje"""
-        lines = parsed.get("lines", [])
-        subtotal = float(parsed.get("subtotal", 0))
-        
-        # Agrupar impuestos por (tax_id, percent)
-        # tax_id: 1=IVA, 4=INC
-        tax_groups = {}
-        for line in lines:
-            tax_id = int(line.get("tax_id", 1))
-            percent = float(line.get("tax_percent", 0))
-            key = f"{tax_id}_{percent:.2f}"
-            
-            if key not in tax_groups:
-                tax_groups[key] = {
-                    "tax_id": tax_id,
-                    "tax_amount": 0,
-                    "taxable_amount": 0,
-                    "percent": percent
-                }
-            tax_groups[key]["tax_amount"] += float(line.get("tax_amount", 0))
-            tax_groups[key]["taxable_amount"] += float(line.get("total", 0))
-        
-        # Si no hay impuestos, crear uno con IVA 0%
-        if not tax_groups:
-            return [{
-                "tax_id": 1,
-                "tax_amount": "0.00",
-                "percent": "0.00",
-                "taxable_amount": f"{subtotal:.2f}",
-            }]
-        
-        # Construir lista de tax_totals
-        result = []
-        for g in tax_groups.values():
-            result.append({
-                "tax_id": g["tax_id"],
-                "tax_amount": f"{g['tax_amount']:.2f}",
-                "percent": f"{g['percent']:.2f}",
-                "taxable_amount": f"{g['taxable_amount']:.2f}",
-            })
-        
-        return result
-    
-    def _build_lines(self, lines: list) -> list:
-        """Construir líneas de factura con tax_id correcto (IVA=1, INC=4)"""
-        result = []
-        for i, line in enumerate(lines):
-            quantity = float(line.get("quantity", 1))
-            total = float(line.get("total", 0))
-            tax_id = int(line.get("tax_id", 1))  # 1=IVA, 4=INC
-            tax_percent = float(line.get("tax_percent", 0))
-            tax_amount = float(line.get("tax_amount", 0))
-            unit_price = float(line.get("unit_price", total / quantity if quantity > 0 else total))
-            
-            result.append({
-                "unit_measure_id": 70,
-                "invoiced_quantity": f"{quantity:.2f}",
-                "line_extension_amount": f"{total:.2f}",
-                "free_of_charge_indicator": False,
-                "tax_totals": [{
-                    "tax_id": tax_id,
-                    "tax_amount": f"{tax_amount:.2f}",
-                    "percent": f"{tax_percent:.2f}",
-                    "taxable_amount": f"{total:.2f}",
-                }],
-                "description": line.get("description", line.get("name", "Producto")),
-                "code": str(line.get("code", str(i + 1))),
-                "type_item_identification_id": 4,
-                "price_amount": f"{unit_price:.2f}",
-                "base_quantity": f"{quantity:.2f}",
-            })
-        return result
-    
     def _build_ds_lines(self, lines: list) -> list:
         """Construir líneas para documento soporte con allowance_charges (OBLIGATORIO)"""
         result = []
@@ -1076,12 +1136,17 @@ class ApiDianService:
             })
         return result
     
-    def _process_response(self, document: Document, result: dict):
-        """Procesar respuesta de la API"""
+    @timed("process")
+    def _process_response(self, document: Document, result: dict, request_data: dict = None):
+        """Procesar respuesta de la API (guarda request y respuesta en un solo commit)"""
+        from services.response_store import store_response
+        
         session = get_session()
         doc = session.query(Document).get(document.id)
         
-        doc.api_response = result
+        if request_data is not None:
+            doc.api_request = request_data
+        store_response(session, doc, result)
         
         if result.get("success"):
             # Buscar respuesta de la DIAN
@@ -1110,6 +1175,10 @@ class ApiDianService:
             # Buscar CUFE/CUDS (cuds para documento soporte, cufe para facturas)
             cufe = result.get("cuds") or result.get("cufe") or result.get("uuid") or result.get("cude") or dian_result.get("XmlDocumentKey")
             
+            # Contrastar con el código calculado localmente
+            if cufe and doc.local_cufe and cufe != doc.local_cufe:
+                logger.warning("CUFE %s: ApiDian devolvió %s, calculado localmente %s", doc.full_number, cufe, doc.local_cufe)
+            
             # Detectar rechazos - buscar "Rechazo" en cualquier parte del mensaje
             rejections = [e for e in error_list if "Rechazo" in e or "rechazo" in e.lower()]
             notifications = [e for e in error_list if "Notificación" in e and "Rechazo" not in e]
@@ -1152,43 +1221,163 @@ class ApiDianService:
             doc.status = "error"
             doc.error_message = result.get("message", "Error desconocido")
         
-        session.commit()
+        with span("db"):
+            session.commit()
+        exporter.document_processed(doc.type, doc.status)
+        sent_cufe = doc.cufe if doc.status == "sent" else None
         session.close()
+        
+        # Poblar la caché local de artefactos para descarga, correo y reimpresión (sin bloquear el envío)
+        if sent_cufe:
+            self.queue_artifacts(sent_cufe, result)
     
     def download_pdf(self, document: Document) -> dict:
-        """Descargar PDF del documento"""
+        """Descargar PDF del documento (desde la caché local si está disponible)"""
         api_response = document.api_response or {}
         pdf_filename = api_response.get("urlinvoicepdf")
         
         if not pdf_filename:
             return {"success": False, "message": "No hay PDF disponible"}
         
-        url = f"{self.base_url}/download/{self.settings.company_nit}/{pdf_filename}"
-        return self._get(url)
+        return self._download_artifact(document.cufe, "pdf", pdf_filename)
     
     def download_attached(self, document: Document) -> dict:
-        """Descargar AttachedDocument"""
+        """Descargar AttachedDocument (desde la caché local si está disponible)"""
         api_response = document.api_response or {}
         xml_filename = api_response.get("urlinvoiceattached")
         
         if not xml_filename:
             return {"success": False, "message": "No hay XML disponible"}
         
-        url = f"{self.base_url}/download/{self.settings.company_nit}/{xml_filename}"
-        return self._get(url)
+        return self._download_artifact(document.cufe, "attached", xml_filename)
+    
+    def _download_artifact(self, cufe: str, kind: str, filename: str) -> dict:
+        """Servir artefacto desde la caché o descargarlo en streaming de ApiDian y guardarlo
+        
+        Devuelve la ruta local del archivo ("path"); el contenido no se carga en memoria.
+        """
+        from services.artifact_store import ArtifactStore
+        
+        store = ArtifactStore()
+        path = store.get_path(cufe, kind)
+        if path:
+            return {"success": True, "path": path, "filename": filename, "cached": True}
+        
+        # Hilo de caché, reimpresión y outbox pueden pedir el mismo artefacto a la vez
+        with store.download_lock(cufe, kind, filename):
+            path = store.get_path(cufe, kind)
+            if path:
+                return {"success": True, "path": path, "filename": filename, "cached": True}
+            
+            url = f"{self.base_url}/download/{self.settings.company_nit}/{filename}"
+            download_path = store.partial_path(cufe, kind, filename)[:-len(".part")]
+            result = self._download(url, download_path)
+            if not result.get("success"):
+                return result
+            
+            stored_path = store.put_file(cufe, kind, download_path, filename, result.get("sha256")) if cufe else None
+        if cufe and not stored_path:
+            return {"success": False, "message": f"El archivo {filename} descargado no es válido"}
+        
+        result["path"] = stored_path or download_path
+        result["filename"] = filename
+        return result
+    
+    @timed("artifacts")
+    def cache_artifacts(self, cufe: str, api_response: dict):
+        """Descargar una sola vez el PDF y el AttachedDocument tras un envío exitoso"""
+        api_response = api_response or {}
+        artifacts = [("pdf", api_response.get("urlinvoicepdf")), ("attached", api_response.get("urlinvoiceattached"))]
+        for kind, filename in artifacts:
+            if not filename:
+                continue
+            try:
+                self._download_artifact(cufe, kind, filename)
+            except Exception as e:
+                logger.warning("No se pudo cachear %s de %s: %s", kind, cufe, e)
 
+    def queue_artifacts(self, cufe: str, api_response: dict):
+        """Encolar cache_artifacts para el hilo de descargas
+
+        Mientras no termine, descarga, correo y reimpresión usan _download_artifact directamente.
+        """
+        cls = type(self)
+        cls._artifact_queue.put((self, cufe, api_response))
+        with cls._artifact_lock:
+            if cls._artifact_worker is None or not cls._artifact_worker.is_alive():
+                cls._artifact_worker = threading.Thread(target=cls._run_artifact_worker, name="artifact-cache",
+                                                        daemon=True)
+                cls._artifact_worker.start()
+    
+    @classmethod
+    def _run_artifact_worker(cls):
+        while True:
+            service, cufe, api_response = cls._artifact_queue.get()
+            try:
+                service.cache_artifacts(cufe, api_response)
+            except Exception as e:
+                logger.warning("Error cacheando artefactos de %s: %s", cufe, e)
+            finally:
+                cls._artifact_queue.task_done()
+    
+    @classmethod
+    def wait_for_artifacts(cls, timeout: float = None) -> bool:
+        """Esperar a que terminen las descargas encoladas (False si se agotó el tiempo)"""
+        import time
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pending = cls._artifact_queue
+        with pending.all_tasks_done:
+            while pending.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                pending.all_tasks_done.wait(remaining)
+        return True
+    
     def send_email(self, document: Document) -> dict:
-        """Enviar documento por correo electrónico con PDF y XML en ZIP"""
+        """Enviar documento por correo electrónico con PDF y XML en ZIP (conexión propia)
+        
+        Para envíos masivos use EmailOutboxService, que reutiliza la conexión SMTP.
+        """
+        built = self.build_email_message(document)
+        if not built.get("success"):
+            return built
+        
+        try:
+            server = self.open_smtp()
+            server.send_message(built["email"])
+            server.quit()
+            return {"success": True, "message": f"Correo enviado exitosamente a {built['recipient']}"}
+        except Exception as e:
+            return {"success": False, "message": f"Error enviando correo: {str(e)}"}
+    
+    def open_smtp(self):
+        """Abrir conexión SMTP autenticada según la configuración de correo"""
         import smtplib
-        import zipfile
-        import tempfile
-        import os
+        
+        port = int(self.settings.mail_port or 587)
+        encryption = self.settings.mail_encryption or 'tls'
+        
+        if encryption == 'ssl':
+            server = smtplib.SMTP_SSL(self.settings.mail_host, port, timeout=60)
+        else:
+            server = smtplib.SMTP(self.settings.mail_host, port, timeout=60)
+            if encryption == 'tls':
+                server.starttls()
+        
+        server.login(self.settings.mail_username, self.settings.mail_password)
+        return server
+    
+    def build_email_message(self, document: Document, recipient: str = None) -> dict:
+        """Construir el mensaje de correo con el ZIP (PDF + XML) del documento"""
         from email.mime.multipart import MIMEMultipart
         from email.mime.text import MIMEText
         from email.mime.base import MIMEBase
         from email import encoders
+        from services.zip_builder import build_zip
         
-        if not document.customer_email:
+        recipient = recipient or document.customer_email
+        if not recipient:
             return {"success": False, "message": "El cliente no tiene correo electrónico"}
         
         # Verificar configuración de correo
@@ -1196,48 +1385,41 @@ class ApiDianService:
             return {"success": False, "message": "Configuración de correo incompleta. Configure SMTP en Ajustes."}
         
         try:
-            # Descargar PDF
+            # Descargar PDF (ruta local en la caché de artefactos)
             pdf_result = self.download_pdf(document)
-            pdf_content = pdf_result.get("content") if pdf_result.get("success") else None
+            pdf_path = pdf_result.get("path") if pdf_result.get("success") else None
             api_response = document.api_response or {}
             pdf_filename = api_response.get("urlinvoicepdf", f"{document.full_number}.pdf")
             
             # Descargar AttachedDocument (XML)
             xml_result = self.download_attached(document)
-            xml_content = xml_result.get("content") if xml_result.get("success") else None
+            xml_path = xml_result.get("path") if xml_result.get("success") else None
             xml_filename = api_response.get("urlinvoiceattached", f"{document.full_number}.xml")
+            xml_content = None
             
             # Si no hay XML de ApiDian, usar el original
-            if not xml_content and document.xml_content:
+            if not xml_path and document.xml_content:
                 xml_content = document.xml_content.encode('utf-8') if isinstance(document.xml_content, str) else document.xml_content
                 xml_filename = document.xml_filename or f"{document.full_number}.xml"
             
-            if not pdf_content and not xml_content:
+            if not pdf_path and not xml_path and not xml_content:
                 return {"success": False, "message": "No hay archivos disponibles para enviar"}
             
-            # Crear ZIP temporal
+            # Crear ZIP en memoria (el PDF se guarda sin recomprimir)
             zip_filename = f"{document.prefix}{document.number}.zip"
-            temp_dir = tempfile.mkdtemp()
-            zip_path = os.path.join(temp_dir, zip_filename)
-            
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                if pdf_content:
-                    zipf.writestr(pdf_filename, pdf_content)
-                if xml_content:
-                    zipf.writestr(xml_filename, xml_content)
-            
-            # Leer contenido del ZIP
-            with open(zip_path, 'rb') as f:
-                zip_content = f.read()
-            
-            # Limpiar archivo temporal
-            os.remove(zip_path)
-            os.rmdir(temp_dir)
+            entries = []
+            if pdf_path:
+                entries.append((pdf_filename, pdf_path))
+            if xml_path:
+                entries.append((xml_filename, xml_path))
+            elif xml_content:
+                entries.append((xml_filename, xml_content))
+            zip_content = build_zip(entries)
             
             # Crear mensaje de correo
             msg = MIMEMultipart()
             msg['From'] = self.settings.mail_username
-            msg['To'] = document.customer_email
+            msg['To'] = recipient
             msg['Subject'] = f"Documento Electrónico {document.full_number} - {self.settings.company_name}"
             
             # Cuerpo del mensaje
@@ -1269,25 +1451,10 @@ NIT: {self.settings.company_nit}
             attachment.add_header('Content-Disposition', f'attachment; filename="{zip_filename}"')
             msg.attach(attachment)
             
-            # Enviar correo
-            port = int(self.settings.mail_port or 587)
-            encryption = self.settings.mail_encryption or 'tls'
-            
-            if encryption == 'ssl':
-                server = smtplib.SMTP_SSL(self.settings.mail_host, port)
-            else:
-                server = smtplib.SMTP(self.settings.mail_host, port)
-                if encryption == 'tls':
-                    server.starttls()
-            
-            server.login(self.settings.mail_username, self.settings.mail_password)
-            server.send_message(msg)
-            server.quit()
-            
-            return {"success": True, "message": f"Correo enviado exitosamente a {document.customer_email}"}
+            return {"success": True, "email": msg, "recipient": recipient}
             
         except Exception as e:
-            return {"success": False, "message": f"Error enviando correo: {str(e)}"}
+            return {"success": False, "message": f"Error preparando correo: {str(e)}"}
 
     def get_numbering_range(self) -> dict:
         """Consultar resoluciones desde la DIAN"""
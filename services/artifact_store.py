@@ -0,0 +1,249 @@
+"""Almacén local de artefactos (PDF y AttachedDocument) por CUFE"""
+import os
+import json
+import uuid
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional
+from config import ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_MB
+
+
+class ArtifactStore:
+    """Caché en disco direccionada por contenido
+
+    Cada artefacto se identifica por (CUFE, tipo) y su contenido se guarda en
+    objects/<sha256[:2]>/<sha256>. El índice (index.json) guarda el hash, tamaño,
+    fecha de modificación y último acceso de cada entrada. El hash se verifica al
+    guardar; al leer basta con tamaño y fecha (se recalcula solo si no coinciden).
+    Se desaloja por LRU cuando se supera el tamaño máximo.
+    """
+
+    # Firmas mínimas esperadas por tipo de artefacto
+    SIGNATURES = {
+        "pdf": (b"%PDF",),
+        "attached": (b"<", b"\xef\xbb\xbf<"),
+    }
+
+    # El último acceso solo se escribe en el índice si es más antiguo que esto
+    LAST_ACCESS_INTERVAL = timedelta(hours=1)
+
+    _lock = threading.Lock()
+    _download_locks = {}
+    _index_cache = {}  # ruta del índice -> (mtime_ns, índice); se invalida si otro proceso lo reescribe
+
+    def __init__(self, root: str = None, max_bytes: int = None):
+        self.root = str(root or ARTIFACT_CACHE_DIR)
+        self.max_bytes = max_bytes if max_bytes is not None else int(ARTIFACT_CACHE_MAX_MB * 1024 * 1024)
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.index_path = os.path.join(self.root, "index.json")
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def get(self, cufe: str, kind: str) -> Optional[bytes]:
+        """Obtener contenido del artefacto si existe y pasa la verificación"""
+        path = self.get_path(cufe, kind)
+        if not path:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def get_path(self, cufe: str, kind: str) -> Optional[str]:
+        """Obtener ruta del artefacto verificado (None si no existe o está corrupto)"""
+        if not cufe:
+            return None
+
+        key = self._key(cufe, kind)
+        with self._lock:
+            index = self._load_index()
+            entry = index.get(key)
+            if not entry:
+                return None
+
+            path = self._object_path(entry["sha256"])
+            verified = self._verify(path, entry)
+            if verified is None:
+                # Archivo corrupto o eliminado: descartar entrada
+                del index[key]
+                self._remove_object_if_unused(index, entry["sha256"])
+                self._save_index(index)
+                return None
+
+            now = datetime.now()
+            if verified or entry.get("last_access", "") < (now - self.LAST_ACCESS_INTERVAL).isoformat():
+                entry["last_access"] = now.isoformat()
+                self._save_index(index)
+            return path
+
+    def get_filename(self, cufe: str, kind: str) -> Optional[str]:
+        """Nombre de archivo original del artefacto"""
+        with self._lock:
+            entry = self._load_index().get(self._key(cufe, kind))
+        return entry.get("filename") if entry else None
+
+    @contextmanager
+    def download_lock(self, cufe: str, kind: str, filename: str = None):
+        """Un solo hilo descarga cada artefacto; los demás esperan y luego lo leen de la caché"""
+        key = self._key(cufe, kind) if cufe else f"archivo:{filename}:{kind}"
+        with self._lock:
+            lock = self._download_locks.setdefault(key, threading.Lock())
+        with lock:
+            yield
+
+    def put(self, cufe: str, kind: str, content: bytes, filename: str = None) -> Optional[str]:
+        """Guardar artefacto desde memoria y devolver su ruta (None si no es válido)"""
+        if not cufe or not content:
+            return None
+        tmp_path = self.partial_path(None, kind)  # Ruta única: no choca con una descarga en curso
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        return self.put_file(cufe, kind, tmp_path, filename, hashlib.sha256(content).hexdigest())
+
+    def put_file(self, cufe: str, kind: str, src_path: str, filename: str = None, sha256: str = None) -> Optional[str]:
+        """Mover un archivo descargado al almacén y devolver su ruta (None si no es válido)
+
+        El hash se calcula aquí sobre el archivo; si se indica `sha256` (el calculado
+        durante la descarga) y no coincide, el archivo se descarta.
+        """
+        if not cufe or not os.path.exists(src_path) or not self._file_looks_valid(kind, src_path):
+            self._discard(src_path)
+            return None
+
+        actual_sha256 = self._hash_file(src_path)
+        if sha256 and sha256 != actual_sha256:
+            self._discard(src_path)
+            return None
+        sha256 = actual_sha256
+        size = os.path.getsize(src_path)
+        path = self._object_path(sha256)
+
+        with self._lock:
+            if os.path.exists(path):
+                self._discard(src_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(src_path, path)
+
+            index = self._load_index()
+            previous = index.get(self._key(cufe, kind))
+            index[self._key(cufe, kind)] = {
+                "sha256": sha256,
+                "size": size,
+                "mtime": os.path.getmtime(path) if os.path.exists(path) else None,
+                "filename": filename,
+                "last_access": datetime.now().isoformat(),
+            }
+            if previous and previous["sha256"] != sha256:
+                self._remove_object_if_unused(index, previous["sha256"])
+
+            self._evict(index)
+            self._save_index(index)
+
+        return path if os.path.exists(path) else None
+
+    def partial_path(self, cufe: str, kind: str, filename: str = None) -> str:
+        """Ruta estable para descargas en curso de este proceso (permite reanudar con Range)
+
+        Sin CUFE la clave es el nombre del archivo; sin ninguno de los dos la ruta
+        es única y no se reanuda, para no mezclar descargas de documentos distintos.
+        Incluye el PID: solo se reanudan parciales propios (dentro del proceso, download_lock
+        garantiza un único escritor por clave).
+        """
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        if cufe:
+            key = "".join(ch for ch in str(cufe) if ch.isalnum())
+        elif filename:
+            key = "archivo_" + "".join(ch for ch in str(filename) if ch.isalnum() or ch in "-_.")
+        else:
+            key = "unico_" + uuid.uuid4().hex
+        return os.path.join(tmp_dir, f"{key}_{kind}.{os.getpid()}.part")
+
+    def _evict(self, index: dict):
+        """Desalojar entradas menos usadas hasta quedar bajo el tamaño máximo"""
+        sizes = {entry["sha256"]: entry["size"] for entry in index.values()}
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+
+        for key, entry in sorted(index.items(), key=lambda item: item[1].get("last_access", "")):
+            if total <= self.max_bytes:
+                break
+            del index[key]
+            if self._remove_object_if_unused(index, entry["sha256"]):
+                total -= entry["size"]
+
+    def _remove_object_if_unused(self, index: dict, sha256: str) -> bool:
+        """Eliminar objeto del disco si ninguna entrada lo referencia"""
+        if any(entry["sha256"] == sha256 for entry in index.values()):
+            return False
+        try:
+            os.remove(self._object_path(sha256))
+        except OSError:
+            pass
+        return True
+
+    def _verify(self, path: str, entry: dict) -> Optional[bool]:
+        """Verificar el objeto: None si no es válido, False si tamaño y fecha coinciden con el índice,
+        True si hubo que recalcular el hash (la entrada se actualizó y hay que guardar el índice)"""
+        if not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+            return None
+        mtime = os.path.getmtime(path)
+        if entry.get("mtime") == mtime:
+            return False
+        if self._hash_file(path) != entry["sha256"]:
+            return None
+        entry["mtime"] = mtime
+        return True
+
+    def _hash_file(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _file_looks_valid(self, kind: str, path: str) -> bool:
+        """Evitar cachear páginas de error HTML en lugar del artefacto"""
+        signatures = self.SIGNATURES.get(kind)
+        if not signatures:
+            return True
+        with open(path, "rb") as f:
+            head = f.read(16).lstrip()
+        return any(head.startswith(sig) for sig in signatures) and not head.lower().startswith(b"<!doctype html")
+
+    def _discard(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _key(self, cufe: str, kind: str) -> str:
+        return f"{cufe}:{kind}"
+
+    def _object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def _load_index(self) -> dict:
+        """Índice en memoria (llamar con _lock); se relee solo si el archivo cambió"""
+        try:
+            mtime_ns = os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return {}
+        cached = self._index_cache.get(self.index_path)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        self._index_cache[self.index_path] = (mtime_ns, index)
+        return index
+
+    def _save_index(self, index: dict):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+        self._index_cache[self.index_path] = (os.stat(self.index_path).st_mtime_ns, index)
@@ -0,0 +1,201 @@
+"""Grabación y reproducción (cassettes) de las peticiones HTTP a ApiDian
+
+Con APIDIAN_CASSETTE_MODE=record cada petición de ApiDianService se hace de
+verdad y el par petición/respuesta se agrega al cassette (APIDIAN_CASSETTE)
+sin secretos: sin encabezados, con los campos sensibles enmascarados y la
+URL relativa a la de la API. Con replay no se usa la red: las respuestas se
+sirven en orden por método y ruta (al agotarse se repiten desde la
+primera), lo que permite regresiones y benchmarks deterministas de todo el
+procesamiento de respuestas.
+
+Uso:
+    python -m services.cassette ruta.json     # resumen de las interacciones grabadas
+"""
+import io
+import os
+import sys
+import base64
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+import requests
+from requests.structures import CaseInsensitiveDict
+import json_codec
+from app_logging import redact, SECRET_PATTERNS
+from config import APIDIAN_CASSETTE, APIDIAN_CASSETTE_MODE
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "record", "replay")
+
+# Encabezados de respuesta que se conservan (los demás varían entre corridas)
+KEPT_HEADERS = ("Content-Type", "Content-Length", "Content-Disposition")
+
+
+def _scrub_text(text: str) -> str:
+    for pattern, replacement in SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _encode_body(content: bytes, content_type: str) -> dict:
+    """Cuerpo legible si es JSON/texto, base64 si es binario (PDF, ZIP)"""
+    if not content:
+        return {"body": None}
+    if "json" in content_type:
+        try:
+            return {"json": redact(json_codec.loads(content))}
+        except ValueError:
+            pass
+    if content_type.startswith("text/") or "xml" in content_type:
+        try:
+            return {"body": _scrub_text(content.decode("utf-8"))}
+        except UnicodeDecodeError:
+            pass
+    return {"body_base64": base64.b64encode(content).decode("ascii")}
+
+
+def _decode_body(stored: dict) -> bytes:
+    if "json" in stored:
+        return json_codec.dumps_bytes(stored["json"])
+    if stored.get("body_base64"):
+        return base64.b64decode(stored["body_base64"])
+    return (stored.get("body") or "").encode("utf-8")
+
+
+class Cassette:
+    """Interacciones grabadas en un archivo JSON"""
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.interactions: List[dict] = []
+        self._lock = threading.Lock()
+        self._positions: Dict[tuple, int] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                self.interactions = json_codec.loads(f.read()).get("interactions", [])
+
+    def append(self, interaction: dict):
+        with self._lock:
+            self.interactions.append(interaction)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            data = {"version": 1, "updated_at": datetime.now().isoformat(timespec="seconds"),
+                    "interactions": self.interactions}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json_codec.pretty(data))
+            os.replace(tmp_path, self.path)
+
+    def next_for(self, method: str, path: str) -> Optional[dict]:
+        """Siguiente interacción grabada para el método y la ruta (cíclica)"""
+        with self._lock:
+            matches = [i for i in self.interactions
+                       if i["request"]["method"] == method and i["request"]["path"] == path]
+            if not matches:
+                return None
+            key = (method, path)
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            return matches[position % len(matches)]
+
+
+class CassetteTransport:
+    """Reemplaza al módulo requests en ApiDianService (post, put, get)"""
+
+    def __init__(self, cassette: Cassette, mode: str, base_url: str):
+        self.cassette = cassette
+        self.mode = mode
+        self.base_url = base_url.rstrip("/")
+
+    def post(self, url, **kwargs):
+        return self._request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self._request("PUT", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self._request("GET", url, **kwargs)
+
+    def _path(self, url: str) -> str:
+        return url[len(self.base_url):] if self.base_url and url.startswith(self.base_url) else url
+
+    def _request(self, method: str, url: str, data: bytes = None, headers: dict = None, **kwargs):
+        path = self._path(url)
+        if self.mode == "replay":
+            interaction = self.cassette.next_for(method, path)
+            if interaction is None:
+                raise requests.ConnectionError(f"Sin grabación para {method} {path} en {self.cassette.path}")
+            return self._build_response(interaction["response"], url)
+
+        response = getattr(requests, method.lower())(url, data=data, headers=headers, **kwargs)
+        content = response.content  # Lee también las descargas en streaming; iter_content sigue funcionando
+        content_type = response.headers.get("Content-Type", "")
+        request_body = None
+        if data:
+            try:
+                request_body = redact(json_codec.loads(data))
+            except ValueError:
+                request_body = None
+        self.cassette.append({
+            "request": {"method": method, "path": path, "json": request_body},
+            "response": {
+                "status": response.status_code,
+                "headers": {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+                **_encode_body(content, content_type),
+            },
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        })
+        return response
+
+    @staticmethod
+    def _build_response(stored: dict, url: str) -> requests.Response:
+        response = requests.Response()
+        response.status_code = stored["status"]
+        response._content = _decode_body(stored)
+        response._content_consumed = True  # iter_content recorre _content en lugar de leer raw
+        response.raw = io.BytesIO(response._content)
+        response.headers = CaseInsensitiveDict(stored.get("headers") or {})
+        response.headers["Content-Length"] = str(len(response._content))
+        response.url = url
+        response.encoding = "utf-8"
+        return response
+
+
+_cassettes: Dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def transport(base_url: str, mode: str = None, path: str = None):
+    """Objeto HTTP para ApiDianService: requests o un CassetteTransport según la configuración"""
+    mode = (mode or APIDIAN_CASSETTE_MODE).lower()
+    if mode not in MODES:
+        logger.warning("APIDIAN_CASSETTE_MODE desconocido: %s (se ignora)", mode)
+        mode = "off"
+    if mode == "off":
+        return requests
+    path = str(path or APIDIAN_CASSETTE)
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None:
+            cassette = _cassettes[path] = Cassette(path)
+    if mode == "replay" and not cassette.interactions:
+        logger.warning("El cassette %s no tiene interacciones grabadas", path)
+    return CassetteTransport(cassette, mode, base_url)
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    cassette = Cassette(sys.argv[1])
+    counts = {}
+    for interaction in cassette.interactions:
+        key = (interaction["request"]["method"], interaction["request"]["path"], interaction["response"]["status"])
+        counts[key] = counts.get(key, 0) + 1
+    print(f"{len(cassette.interactions)} interacciones en {cassette.path}")
+    for (method, path, status), count in sorted(counts.items()):
+        print(f"  {count:>4}  {method:<4} {path}  -> {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Cálculo local de CUFE/CUDE/CUDS según el Anexo Técnico DIAN
+
+CUFE (factura):     SHA-384(NumFac + FecFac + HorFac + ValFac + 01 + ValImp1 + 04 + ValImp2
+                            + 03 + ValImp3 + ValTot + NitOFE + NumAdq + ClTec + TipoAmbiente)
+CUDE (NC/ND):       igual que el CUFE pero con el PIN del software en lugar de la clave técnica
+CUDS (doc. soporte): SHA-384(NumDS + FecDS + HorDS + ValDS + 01 + ValImp + ValTot
+                            + NumSNO + NITABS + PIN + TipoAmbiente)
+
+Autoverificación con los vectores de prueba:
+    python -m services.cufe
+"""
+import re
+import hashlib
+from typing import Optional
+
+# Hora de Colombia tal como va en el XML (IssueTime)
+TIME_ZONE = "-05:00"
+
+# Clave técnica usada por configure_resolution cuando la resolución no tiene una
+DEFAULT_TECHNICAL_KEY = "fc8eac422eba16e22ffd8c6f94b3f40a6e38162c"
+
+# Códigos de impuesto que entran en el CUFE/CUDE: IVA, INC, ICA
+TAX_CODES = ("01", "04", "03")
+
+
+def _money(value) -> str:
+    """Valor con dos decimales, punto decimal y sin separador de miles"""
+    return f"{float(value or 0):.2f}"
+
+
+def _time(value: str) -> str:
+    value = str(value or "")
+    return value if value.endswith(TIME_ZONE) else f"{value}{TIME_ZONE}"
+
+
+def _digits(value) -> str:
+    return re.sub(r"[^0-9]", "", str(value or ""))
+
+
+def _sha384(*fields) -> str:
+    return hashlib.sha384("".join(str(f) for f in fields).encode("utf-8")).hexdigest()
+
+
+def compute_cufe(number: str, date: str, time: str, line_extension, taxes: dict, payable,
+                 issuer_nit: str, acquirer_id: str, technical_key: str, environment) -> str:
+    """CUFE de factura electrónica (taxes: {"01": valor, "04": valor, "03": valor})"""
+    tax_fields = [f"{code}{_money(taxes.get(code))}" for code in TAX_CODES]
+    return _sha384(number, date, _time(time), _money(line_extension), *tax_fields, _money(payable),
+                   _digits(issuer_nit), acquirer_id, technical_key, environment)
+
+
+def compute_cude(number: str, date: str, time: str, line_extension, taxes: dict, payable,
+                 issuer_nit: str, acquirer_id: str, software_pin: str, environment) -> str:
+    """CUDE de notas crédito y débito"""
+    return compute_cufe(number, date, time, line_extension, taxes, payable,
+                        issuer_nit, acquirer_id, software_pin, environment)
+
+
+def compute_cuds(number: str, date: str, time: str, line_extension, iva, payable,
+                 seller_id: str, buyer_nit: str, software_pin: str, environment) -> str:
+    """CUDS de documento soporte y nota de ajuste"""
+    return _sha384(number, date, _time(time), _money(line_extension), "01", _money(iva), _money(payable),
+                   seller_id, _digits(buyer_nit), software_pin, environment)
+
+
+def cufe_for_payload(payload: dict, settings, technical_key: str = None) -> Optional[str]:
+    """Calcular el código único del payload sellado (None si faltan datos)"""
+    if not payload or not settings or not payload.get("date") or not payload.get("time"):
+        return None
+
+    type_document_id = payload.get("type_document_id")
+    number = f"{payload.get('prefix') or ''}{payload.get('number')}"
+    totals = payload.get("legal_monetary_totals") or payload.get("requested_monetary_totals") or {}
+    environment = str(settings.type_environment_id or 2)
+
+    taxes = {}
+    for tax in payload.get("tax_totals") or []:
+        code = f"{int(tax.get('tax_id', 1)):02d}"
+        taxes[code] = taxes.get(code, 0) + float(tax.get("tax_amount") or 0)
+
+    common = (number, payload["date"], payload["time"], totals.get("line_extension_amount"))
+
+    if type_document_id in (11, 13):
+        if not settings.ds_software_pin:
+            return None
+        seller_id = _digits((payload.get("seller") or {}).get("identification_number"))
+        return compute_cuds(*common, taxes.get("01", 0), totals.get("payable_amount"),
+                            seller_id, settings.company_nit, settings.ds_software_pin, environment)
+
+    acquirer_id = _digits((payload.get("customer") or {}).get("identification_number"))
+    if type_document_id in (4, 5):
+        if not settings.software_pin:
+            return None
+        return compute_cude(*common, taxes, totals.get("payable_amount"),
+                            settings.company_nit, acquirer_id, settings.software_pin, environment)
+
+    return compute_cufe(*common, taxes, totals.get("payable_amount"),
+                        settings.company_nit, acquirer_id, technical_key or DEFAULT_TECHNICAL_KEY, environment)
+
+
+# Vectores de prueba: (descripción, función, argumentos, resultado esperado)
+TEST_VECTORS = [
+    (
+        "CUFE ejemplo del Anexo Técnico",
+        compute_cufe,
+        ("323200000129", "2019-01-16", "10:53:10-05:00", "1500000.00", {"01": 285000}, 1785000,
+         "700085371", "800199436", "693ff6f2a553c3646a063436fd4dd9ded0311471", "1"),
+        "8bb918b19ba22a694f1da11c643b5e9de39adf60311cf179179e9b33381030bcd4c3c3f156c506ed5908f9276f5bd9b4",
+    ),
+    (
+        "CUFE con hora sin zona y NIT con DV (se normalizan)",
+        compute_cufe,
+        ("323200000129", "2019-01-16", "10:53:10", 1500000, {"01": "285000.00", "04": 0}, "1785000",
+         "700.085.371", "800199436", "693ff6f2a553c3646a063436fd4dd9ded0311471", "1"),
+        "8bb918b19ba22a694f1da11c643b5e9de39adf60311cf179179e9b33381030bcd4c3c3f156c506ed5908f9276f5bd9b4",
+    ),
+]
+
+# Cadenas concatenadas esperadas (verifican el orden de los campos)
+CONCATENATION_VECTORS = [
+    (
+        "CUDE",
+        ("NC1", "2024-05-02", "08:15:00", 100, {"01": 19, "04": 8}, 127, "900123456", "123", "12345", "2"),
+        "NC12024-05-0208:15:00-05:00100.000119.00048.00030.00127.0090012345612312345" "2",
+    ),
+    (
+        "CUDS",
+        ("DS7", "2024-05-02", "08:15:00", 100, 19, 119, "79111222", "900123456", "54321", "2"),
+        "DS72024-05-0208:15:00-05:00100.000119.00119.0079111222900123456" "54321" "2",
+    ),
+]
+
+
+def self_check() -> list:
+    """Ejecutar los vectores de prueba; devuelve la lista de fallos"""
+    failures = []
+    for name, func, args, expected in TEST_VECTORS:
+        got = func(*args)
+        if got != expected:
+            failures.append(f"{name}: {got} != {expected}")
+
+    functions = {"CUDE": compute_cude, "CUDS": compute_cuds}
+    for name, args, concatenated in CONCATENATION_VECTORS:
+        expected = hashlib.sha384(concatenated.encode("utf-8")).hexdigest()
+        got = functions[name](*args)
+        if got != expected:
+            failures.append(f"{name}: {got} != sha384({concatenated})")
+    return failures
+
+
+if __name__ == "__main__":
+    problems = self_check()
+    total = len(TEST_VECTORS) + len(CONCATENATION_VECTORS)
+    for problem in problems:
+        print(f"FALLO {problem}")
+    print(f"{total - len(problems)}/{total} vectores correctos")
+    raise SystemExit(1 if problems else 0)
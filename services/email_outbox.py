@@ -0,0 +1,387 @@
+"""Cola de correos (outbox) con conexión SMTP persistente"""
+import time
+import logging
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from database import get_session, Document, EmailOutbox
+from config import TERMINAL_ID
+
+logger = logging.getLogger(__name__)
+
+
+class EmailOutboxService:
+    """Encola correos de documentos y los envía en lote reutilizando la conexión SMTP
+
+    Un único hilo en segundo plano drena la cola: abre una conexión autenticada,
+    envía todos los mensajes pendientes respetando el límite por minuto de la
+    configuración y la mantiene abierta un tiempo por si llegan más. Los fallos
+    transitorios (desconexión, códigos 4xx, timeouts) se reintentan con espera
+    exponencial; los permanentes marcan el mensaje como error.
+    """
+
+    MAX_ATTEMPTS = 5
+    IDLE_SECONDS = 30  # Tiempo que se mantiene abierta la conexión sin mensajes
+    BATCH_SIZE = 50
+    CLAIM_LEASE_MINUTES = 10  # Reservas de otras terminales más antiguas se consideran abandonadas
+
+    _worker = None
+    _lock = threading.Lock()
+    _wakeup = threading.Event()
+
+    def __init__(self):
+        self._server = None
+
+    def enqueue(self, document_id: int, recipient: str = None) -> dict:
+        """Agregar un documento a la cola de correo"""
+        session = get_session()
+        document = session.query(Document).get(document_id)
+        if not document:
+            session.close()
+            return {"success": False, "message": "Documento no encontrado"}
+
+        recipient = (recipient or document.customer_email or "").strip()
+        if not recipient:
+            session.close()
+            return {"success": False, "message": "El cliente no tiene correo electrónico"}
+
+        # Evitar duplicados: reutilizar un mensaje aún no enviado del mismo documento
+        item = session.query(EmailOutbox).filter(
+            EmailOutbox.document_id == document_id,
+            EmailOutbox.status.in_(["pending", "sending"]),
+        ).first()
+        if item:
+            item.recipient = recipient
+        else:
+            session.add(EmailOutbox(document_id=document_id, recipient=recipient, status="pending"))
+        session.commit()
+        session.close()
+
+        self.start_worker()
+        return {"success": True, "message": f"Correo en cola para {recipient}"}
+
+    def enqueue_unsent(self) -> int:
+        """Encolar todos los documentos enviados a la DIAN cuyo correo no se ha enviado"""
+        session = get_session()
+        queued_ids = {row[0] for row in session.query(EmailOutbox.document_id).filter(
+            EmailOutbox.status.in_(["pending", "sending"])
+        )}
+        docs = session.query(Document.id, Document.customer_email).filter(
+            Document.status == "sent",
+            Document.email_sent != True,
+            Document.customer_email.isnot(None),
+            Document.customer_email != "",
+        ).all()
+        session.close()
+
+        count = 0
+        for doc_id, email in docs:
+            if doc_id in queued_ids:
+                continue
+            if self.enqueue(doc_id, email).get("success"):
+                count += 1
+        return count
+
+    def pending_count(self) -> int:
+        """Cantidad de correos pendientes en la cola"""
+        session = get_session()
+        count = session.query(EmailOutbox).filter(EmailOutbox.status.in_(["pending", "sending"])).count()
+        session.close()
+        return count
+
+    def status_summary(self) -> dict:
+        """Estado de la cola para la interfaz: en cola, con error y el último error"""
+        from sqlalchemy import func
+        session = get_session()
+        counts = dict(session.query(EmailOutbox.status, func.count(EmailOutbox.id)).filter(
+            EmailOutbox.status.in_(["pending", "sending"])
+        ).group_by(EmailOutbox.status).all())
+        # Errores de documentos cuyo correo aún no se ha enviado
+        failed = session.query(EmailOutbox).join(Document, EmailOutbox.document_id == Document.id).filter(
+            EmailOutbox.status == "error",
+            Document.email_sent != True,
+        ).order_by(EmailOutbox.id.desc())
+        error_count = failed.with_entities(func.count(func.distinct(EmailOutbox.document_id))).scalar() or 0
+        last = failed.first()
+        last_error = last.last_error if last else None
+        session.close()
+        return {
+            "queued": counts.get("pending", 0) + counts.get("sending", 0),
+            "errors": error_count,
+            "last_error": last_error,
+        }
+
+    def states_for(self, document_ids: list) -> dict:
+        """Último mensaje del outbox por documento: {id: {"status", "attempts", "last_error"}}"""
+        if not document_ids:
+            return {}
+        session = get_session()
+        rows = session.query(EmailOutbox.document_id, EmailOutbox.status, EmailOutbox.attempts,
+                             EmailOutbox.last_error).filter(
+            EmailOutbox.document_id.in_(document_ids)
+        ).order_by(EmailOutbox.id).all()
+        session.close()
+        return {doc_id: {"status": status, "attempts": attempts or 0, "last_error": last_error}
+                for doc_id, status, attempts, last_error in rows}
+
+    @staticmethod
+    def config_error(settings):
+        """Mensaje si la configuración de correo no permite enviar (None si está completa)"""
+        if not settings or not settings.mail_host or not settings.mail_username:
+            return "Configure el servidor y el usuario de correo en Configuración > Correo SMTP"
+        return None
+
+    @classmethod
+    def start_worker(cls):
+        """Iniciar el hilo de envío si no está corriendo (y despertarlo)
+
+        El aviso se da dentro del lock: el hilo decide si terminar también con el lock,
+        así que o ve el aviso o ya se desregistró y aquí se inicia uno nuevo.
+        """
+        with cls._lock:
+            if cls._worker is None or not cls._worker.is_alive():
+                cls._worker = threading.Thread(target=cls()._run, daemon=True)
+                cls._worker.start()
+            cls._wakeup.set()
+
+    @classmethod
+    def resume_pending(cls):
+        """Al iniciar la aplicación: recuperar mensajes interrumpidos y reanudar la cola
+
+        Solo se devuelven a la cola los mensajes reservados por esta terminal o
+        cuya reserva venció; los que otra terminal está enviando no se tocan.
+        """
+        from sqlalchemy import or_
+        session = get_session()
+        expired = datetime.now() - timedelta(minutes=cls.CLAIM_LEASE_MINUTES)
+        session.query(EmailOutbox).filter(
+            EmailOutbox.status == "sending",
+            or_(
+                EmailOutbox.claimed_by == TERMINAL_ID,
+                EmailOutbox.claimed_by.is_(None),
+                EmailOutbox.claimed_at.is_(None),
+                EmailOutbox.claimed_at < expired,
+            ),
+        ).update({"status": "pending", "claimed_by": None, "claimed_at": None}, synchronize_session=False)
+        session.commit()
+        has_pending = session.query(EmailOutbox).filter(EmailOutbox.status == "pending").first() is not None
+        session.close()
+        if has_pending:
+            cls.start_worker()
+
+    def _run(self):
+        """Bucle del hilo de envío"""
+        try:
+            while True:
+                self._wakeup.clear()
+                if self.drain() is None:
+                    return
+                delay = self._seconds_until_next()
+                if delay is None:
+                    # Cola vacía: mantener la conexión un tiempo por si llegan más mensajes
+                    if not self._wakeup.wait(self.IDLE_SECONDS) and self._retire():
+                        return
+                else:
+                    # Hay reintentos programados: cerrar la conexión y esperar al siguiente
+                    self._close_server()
+                    self._wakeup.wait(min(delay, 300))
+        except Exception as e:
+            logger.exception("Error en el hilo de envío de correos: %s", e)
+        finally:
+            self._retire(force=True)
+            self._close_server()
+
+    def _retire(self, force: bool = False) -> bool:
+        """Desregistrar este hilo para que start_worker inicie otro (False si llegó un aviso)"""
+        cls = type(self)
+        with cls._lock:
+            if self._wakeup.is_set() and not force:
+                return False
+            if cls._worker is threading.current_thread():
+                cls._worker = None
+            return True
+
+    def drain(self):
+        """Enviar todos los mensajes vencidos reutilizando la conexión SMTP
+
+        Devuelve la cantidad enviada, o None si la configuración de correo no permite enviar.
+        """
+        from services.api_dian import ApiDianService
+
+        service = ApiDianService()
+        settings = service.settings
+        config_error = self.config_error(settings)
+        if config_error:
+            # Sin configuración no se puede enviar: dejar el motivo visible en cada mensaje
+            failed = self._fail_pending(config_error)
+            logger.warning("Outbox de correos detenido (%d mensajes marcados con error): %s", failed, config_error)
+            return None
+
+        rate = self._rate_per_minute(settings)
+        min_interval = 60.0 / rate
+        sent = 0
+        last_send = 0.0
+
+        while True:
+            # Reservar solo lo que se alcanza a enviar en un minuto: el resto queda para otras terminales
+            batch = self._claim_batch(min(self.BATCH_SIZE, rate))
+            if not batch:
+                break
+
+            for position, item_id in enumerate(batch):
+                session = get_session()
+                item = session.query(EmailOutbox).get(item_id)
+                document = session.query(Document).get(item.document_id) if item else None
+                session.close()
+                if not item or not document:
+                    self._mark_error(item_id, "Documento no encontrado", permanent=True)
+                    continue
+
+                built = service.build_email_message(document, item.recipient)
+                if not built.get("success"):
+                    self._mark_error(item_id, built.get("message"), permanent=False)
+                    continue
+
+                # Respetar el límite de envío por minuto
+                wait = min_interval - (time.monotonic() - last_send)
+                if wait > 0:
+                    time.sleep(wait)
+
+                try:
+                    self._send(service, built["email"])
+                    last_send = time.monotonic()
+                    self._mark_sent(item_id, document.id)
+                    sent += 1
+                except smtplib.SMTPAuthenticationError as e:
+                    # Credenciales inválidas: posponer el resto del lote sin gastar intentos
+                    logger.error("Autenticación SMTP fallida: %s", e)
+                    self._close_server()
+                    self._release_batch(batch[position:], delay_minutes=5)
+                    return sent
+                except Exception as e:
+                    self._close_server()
+                    self._mark_error(item_id, str(e), permanent=not self._is_transient(e))
+
+        return sent
+
+    @staticmethod
+    def _rate_per_minute(settings) -> int:
+        """Límite de envío configurado; 20 por minuto si el valor guardado no es válido"""
+        value = getattr(settings, "mail_rate_per_minute", None)
+        try:
+            return max(1, int(value or 20))
+        except (TypeError, ValueError):
+            logger.warning("Límite de correos por minuto inválido (%r), se usa 20", value)
+            return 20
+
+    def _send(self, service, message):
+        """Enviar por la conexión abierta; reconectar una vez si el servidor la cerró"""
+        if self._server is None:
+            self._server = service.open_smtp()
+        try:
+            self._server.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            self._server = service.open_smtp()
+            self._server.send_message(message)
+
+    def _close_server(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+    def _claim_batch(self, limit: int = None) -> list:
+        """Reservar mensajes vencidos (pending -> sending) para este hilo"""
+        session = get_session()
+        now = datetime.now()
+        candidates = [row[0] for row in session.query(EmailOutbox.id).filter(
+            EmailOutbox.status == "pending",
+            EmailOutbox.next_attempt_at <= now,
+        ).order_by(EmailOutbox.id).limit(limit or self.BATCH_SIZE)]
+
+        claimed = []
+        for item_id in candidates:
+            # Actualización condicional: otra terminal puede haber tomado el mensaje
+            updated = session.query(EmailOutbox).filter(
+                EmailOutbox.id == item_id, EmailOutbox.status == "pending"
+            ).update({"status": "sending", "claimed_by": TERMINAL_ID, "claimed_at": now},
+                     synchronize_session=False)
+            if updated:
+                claimed.append(item_id)
+        session.commit()
+        session.close()
+        return claimed
+
+    def _release_batch(self, batch: list, delay_minutes: int = 0):
+        """Devolver mensajes reservados a la cola sin contar intento"""
+        session = get_session()
+        session.query(EmailOutbox).filter(
+            EmailOutbox.id.in_(batch), EmailOutbox.status == "sending"
+        ).update({
+            "status": "pending",
+            "next_attempt_at": datetime.now() + timedelta(minutes=delay_minutes),
+        }, synchronize_session=False)
+        session.commit()
+        session.close()
+
+    def _fail_pending(self, message: str) -> int:
+        """Marcar como error todos los mensajes pendientes (no se gastan intentos)"""
+        session = get_session()
+        failed = session.query(EmailOutbox).filter(EmailOutbox.status == "pending").update(
+            {"status": "error", "last_error": message}, synchronize_session=False
+        )
+        session.commit()
+        session.close()
+        return failed
+
+    def _mark_sent(self, item_id: int, document_id: int):
+        now = datetime.now()
+        session = get_session()
+        item = session.query(EmailOutbox).get(item_id)
+        item.status = "sent"
+        item.sent_at = now
+        item.attempts = (item.attempts or 0) + 1
+        item.last_error = None
+        document = session.query(Document).get(document_id)
+        if document:
+            document.email_sent = True
+            document.email_sent_at = now
+        session.commit()
+        session.close()
+
+    def _mark_error(self, item_id: int, message: str, permanent: bool):
+        session = get_session()
+        item = session.query(EmailOutbox).get(item_id)
+        if item:
+            item.attempts = (item.attempts or 0) + 1
+            item.last_error = message
+            if permanent or item.attempts >= self.MAX_ATTEMPTS:
+                item.status = "error"
+            else:
+                # Espera exponencial: 1, 2, 4, 8... minutos
+                item.status = "pending"
+                item.next_attempt_at = datetime.now() + timedelta(minutes=2 ** (item.attempts - 1))
+            session.commit()
+        session.close()
+
+    def _is_transient(self, error: Exception) -> bool:
+        """Determinar si un error de envío amerita reintento"""
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return all(400 <= code < 500 for code, _ in error.recipients.values())
+        if isinstance(error, smtplib.SMTPResponseException):
+            return 400 <= error.smtp_code < 500
+        return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError))
+
+    def _seconds_until_next(self):
+        """Segundos hasta el próximo reintento programado (None si la cola está vacía)"""
+        from sqlalchemy import func
+        session = get_session()
+        next_at = session.query(func.min(EmailOutbox.next_attempt_at)).filter(
+            EmailOutbox.status == "pending"
+        ).scalar()
+        session.close()
+        if next_at is None:
+            return None
+        return max(0.0, (next_at - datetime.now()).total_seconds())
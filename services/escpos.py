@@ -0,0 +1,253 @@
+"""Impresión directa de tickets en impresoras térmicas ESC/POS"""
+import socket
+from typing import List
+from database import Document
+
+ESC = b"\x1b"
+GS = b"\x1d"
+
+
+class EscPosBuilder:
+    """Acumula comandos ESC/POS en un buffer de bytes"""
+
+    # Página de códigos PC850 (Multilingual): tildes y eñes
+    CODEPAGE = 2
+    ENCODING = "cp850"
+
+    def __init__(self, columns: int = 48):
+        self.columns = columns
+        self.buffer = bytearray()
+        self.buffer += ESC + b"@"  # Inicializar impresora
+        self.buffer += ESC + b"t" + bytes([self.CODEPAGE])
+
+    def align(self, mode: str) -> "EscPosBuilder":
+        self.buffer += ESC + b"a" + bytes([{"left": 0, "center": 1, "right": 2}[mode]])
+        return self
+
+    def bold(self, on: bool = True) -> "EscPosBuilder":
+        self.buffer += ESC + b"E" + bytes([1 if on else 0])
+        return self
+
+    def size(self, width: int = 1, height: int = 1) -> "EscPosBuilder":
+        """Tamaño de carácter (1 = normal, 2 = doble)"""
+        self.buffer += GS + b"!" + bytes([((width - 1) << 4) | (height - 1)])
+        return self
+
+    def text(self, value: str = "") -> "EscPosBuilder":
+        self.buffer += value.encode(self.ENCODING, errors="replace") + b"\n"
+        return self
+
+    def line(self, char: str = "-") -> "EscPosBuilder":
+        return self.text(char * self.columns)
+
+    def columns_row(self, left: str, right: str) -> "EscPosBuilder":
+        """Texto a la izquierda y valor alineado a la derecha en la misma línea"""
+        space = max(1, self.columns - len(left) - len(right))
+        return self.text(f"{left}{' ' * space}{right}"[:self.columns])
+
+    def labeled(self, label: str, value: str) -> "EscPosBuilder":
+        """Etiqueta y valor en una línea, o el valor en la siguiente si no caben"""
+        if len(label) + 1 + len(value) <= self.columns:
+            return self.text(f"{label} {value}")
+        return self.text(label).wrapped(value)
+
+    def wrapped(self, value: str) -> "EscPosBuilder":
+        """Partir texto largo en líneas del ancho del papel"""
+        for i in range(0, len(value), self.columns):
+            self.text(value[i:i + self.columns])
+        return self
+
+    def feed(self, lines: int = 1) -> "EscPosBuilder":
+        self.buffer += ESC + b"d" + bytes([lines])
+        return self
+
+    def qr(self, data: str, module_size: int = 5) -> "EscPosBuilder":
+        """Código QR generado por la impresora (GS ( k, modelo 2)"""
+        payload = data.encode("ascii", errors="ignore")
+        self.buffer += GS + b"(k" + bytes([4, 0, 49, 65, 50, 0])              # Modelo 2
+        self.buffer += GS + b"(k" + bytes([3, 0, 49, 67, module_size])        # Tamaño de módulo
+        self.buffer += GS + b"(k" + bytes([3, 0, 49, 69, 49])                 # Corrección de errores M
+        length = len(payload) + 3
+        self.buffer += GS + b"(k" + bytes([length % 256, length // 256, 49, 80, 48]) + payload
+        self.buffer += GS + b"(k" + bytes([3, 0, 49, 81, 48])                 # Imprimir
+        self.buffer += b"\n"
+        return self
+
+    def cut(self) -> "EscPosBuilder":
+        self.feed(4)
+        self.buffer += GS + b"V" + bytes([66, 0])  # Corte parcial
+        return self
+
+    def getvalue(self) -> bytes:
+        return bytes(self.buffer)
+
+
+def send_to_device(target: str, data: bytes, timeout: float = 10) -> dict:
+    """Enviar bytes crudos a la impresora
+
+    El destino puede ser "host:puerto" (impresora de red, normalmente 9100),
+    un dispositivo (/dev/usb/lp0, COM3) o una impresora compartida (\\\\PC\\ticket).
+    """
+    target = (target or "").strip()
+    if not target:
+        return {"success": False, "message": "Configure la impresora de tickets en Ajustes"}
+
+    try:
+        host, _, port = target.rpartition(":")
+        if host and port.isdigit() and "\\" not in target and "/" not in target:
+            with socket.create_connection((host, int(port)), timeout=timeout) as sock:
+                sock.sendall(data)
+        else:
+            with open(target, "wb") as device:
+                device.write(data)
+        return {"success": True, "message": "Enviado a la impresora"}
+    except OSError as e:
+        return {"success": False, "message": f"No se pudo imprimir en {target}: {e}"}
+
+
+def render_tickets(documents: List[Document], ctx: dict, columns: int = 48) -> bytes:
+    """Construir los comandos ESC/POS de uno o varios tickets (corte entre cada uno)"""
+    builder = EscPosBuilder(columns)
+    for doc in documents:
+        _render_ticket(builder, doc, ctx)
+    return builder.getvalue()
+
+
+def _render_ticket(p: EscPosBuilder, doc: Document, ctx: dict):
+    from services.ticket_printer import TYPE_LABELS, discrepancy_reason, line_tax_label, summarize_taxes, dian_qr_url
+
+    settings = ctx["settings"]
+    municipality = ctx["municipality"]
+    department = ctx["department"]
+    resolution = ctx["resolutions"].get((doc.type_document_id, doc.prefix))
+    ref_doc = ctx["references"].get(doc.reference_document_id) if doc.type in ["credit_note", "debit_note"] else None
+
+    parsed_data = doc.parsed_data or {}
+    lines = parsed_data.get("lines", [])
+    customer = parsed_data.get("customer", {})
+    width = p.columns
+
+    # ========== ENCABEZADO EMISOR ==========
+    company_name = (settings.company_name or "EMPRESA").upper()
+    company_nit = f"{settings.company_nit or ''}-{settings.company_dv or ''}"
+    p.align("center").bold().size(1, 2).text(company_name[:width]).size().text(f"NIT: {company_nit}").bold(False)
+    p.text("RESPONSABLE DE IVA" if settings.type_regime_id == 1 else "NO RESPONSABLE DE IVA")
+    if settings.company_address:
+        p.text(settings.company_address[:width])
+    if municipality and department:
+        p.text(f"{municipality.name} - {department.name}"[:width])
+    if settings.company_phone:
+        p.text(f"Tel: {settings.company_phone}")
+    if settings.company_email:
+        p.text(settings.company_email[:width])
+    p.text()
+
+    # ========== TIPO DE DOCUMENTO ==========
+    p.bold().text(TYPE_LABELS.get(doc.type, "DOCUMENTO")).size(1, 2).text(f"No. {doc.full_number}").size().bold(False)
+    p.text(f"Fecha: {doc.issue_date.strftime('%Y-%m-%d %H:%M') if doc.issue_date else ''}")
+    p.line()
+
+    # ========== DATOS DEL CLIENTE ==========
+    p.align("left")
+    p.text(f"Cliente: {customer.get('name', doc.customer_name) or 'CONSUMIDOR FINAL'}"[:width])
+    p.text(f"NIT/CC: {customer.get('identification_number', doc.customer_nit) or ''}")
+    if customer.get("address"):
+        p.text(f"Dir: {customer['address']}"[:width])
+    if customer.get("phone"):
+        p.text(f"Tel: {customer['phone']}")
+
+    # ========== REFERENCIA FACTURA (solo NC/ND) ==========
+    if doc.type in ["credit_note", "debit_note"]:
+        motivo, discrepancy_desc = discrepancy_reason(doc.type, parsed_data)
+        p.line().bold().text("DOCUMENTO DE REFERENCIA").bold(False)
+        if ref_doc:
+            p.text(f"Factura: {ref_doc.full_number}")
+            if ref_doc.issue_date:
+                p.text(f"Fecha: {ref_doc.issue_date.strftime('%Y-%m-%d')}")
+            if ref_doc.cufe:
+                p.wrapped(f"CUFE: {ref_doc.cufe}")
+        p.text(f"Motivo: {motivo}"[:width])
+        if discrepancy_desc and discrepancy_desc != motivo:
+            p.text(f"Desc: {discrepancy_desc}"[:width])
+
+    # ========== PRODUCTOS ==========
+    # Columnas: cantidad, descripción, valor unitario, impuesto, total. En papel angosto
+    # (58mm, 32 caracteres) la descripción va en su propia línea y las cifras debajo.
+    narrow = width < 40
+    unit_width = (width - 10) // 2 if narrow else 10
+    total_width = width - 10 - unit_width if narrow else 11
+    desc_width = 0 if narrow else width - 5 - unit_width - 5 - total_width
+    p.line().bold()
+    if narrow:
+        p.text("Descripcion")
+    p.text(f"{'Cant':<5}{'Descripcion':<{desc_width}.{desc_width}}{'V.Unit':>{unit_width}}{'Imp':>5}{'Total':>{total_width}}")
+    p.bold(False)
+    for line in lines:
+        qty = float(line.get("quantity", 1))
+        tax_label = line_tax_label(int(line.get("tax_id", 1)), float(line.get("tax_percent", 0)))
+        desc = str(line.get("description", "Producto"))
+        if narrow:
+            p.text(desc[:width])
+            desc = ""
+        else:
+            desc = desc[:desc_width - 1]
+        p.text(f"{qty:<5.0f}{desc:<{desc_width}}{float(line.get('unit_price', 0)):>{unit_width},.0f}"
+               f"{tax_label:>5}{float(line.get('total', 0)):>{total_width},.0f}")
+    p.line()
+    p.text(f"Total Registros: {len(lines):04d}")
+    p.text(f"Total Cantidades: {sum(float(line.get('quantity', 0)) for line in lines):.0f}")
+
+    # ========== RESUMEN DE IMPUESTOS ==========
+    tax_summary = summarize_taxes(lines)
+    if tax_summary:
+        # Tipo (10), base, porcentaje (6) y valor; en papel angosto el tipo va en su propia línea
+        name_width = 0 if narrow else 10
+        base_width = (width - name_width - 6) // 2
+        value_width = width - name_width - 6 - base_width
+        p.line().bold()
+        if narrow:
+            p.text("Tipo")
+        p.text(f"{'Tipo':<{name_width}.{name_width}}{'Base':>{base_width}}{'%':>6}{'Valor':>{value_width}}").bold(False)
+        for data in tax_summary:
+            name = data["name"]
+            if narrow:
+                p.text(name[:width])
+                name = ""
+            p.text(f"{name:<{name_width}}{data['base']:>{base_width},.0f}{data['percent']:>5.0f}%{data['tax']:>{value_width},.0f}")
+
+    # ========== TOTALES ==========
+    p.line()
+    p.columns_row("Subtotal:", f"${float(doc.subtotal or 0):,.0f}")
+    p.columns_row("Impuestos:", f"${float(doc.total_tax or 0):,.0f}")
+    p.bold().size(1, 2).columns_row("TOTAL:", f"${float(doc.total or 0):,.0f}").size().bold(False)
+
+    # ========== FORMA DE PAGO ==========
+    payment_info = parsed_data.get("payment", {})
+    forma_pago = "Crédito" if payment_info.get("payment_form_id", 1) == 2 else "Contado"
+    p.text(f"Forma de Pago: {forma_pago} - {payment_info.get('payment_name', 'Contado')}"[:width])
+    p.line()
+
+    # ========== RESOLUCIÓN DIAN ==========
+    p.align("center").bold().text("RESOLUCION DIAN").bold(False)
+    if resolution:
+        p.text(f"Resolucion No. {resolution.resolution}")
+        if resolution.resolution_date:
+            p.text(f"Fecha: {resolution.resolution_date.strftime('%Y-%m-%d')}")
+        if resolution.date_from and resolution.date_to:
+            p.labeled("Vigencia:", f"{resolution.date_from.strftime('%Y-%m-%d')} a {resolution.date_to.strftime('%Y-%m-%d')}")
+        p.text(f"Prefijo: {resolution.prefix} del {resolution.from_number} al {resolution.to_number}"[:width])
+
+    # ========== CUFE/CUDE ==========
+    p.text().bold().text("CUFE" if doc.type == "invoice" else "CUDE").bold(False)
+    cufe = doc.cufe or doc.local_cufe
+    if cufe:
+        p.wrapped(cufe)
+        qr_url, dian_url = dian_qr_url(settings, cufe)
+        p.qr(qr_url)
+        p.labeled("Consulte en:", dian_url)
+
+    # ========== PIE DE PÁGINA ==========
+    p.text().text("Representacion grafica de").text("Factura Electronica")
+    p.bold().text("Gracias por su compra!").bold(False).text()
+    p.text(f"Emitido por: {company_name}"[:width]).text(f"NIT: {company_nit}").text("Modalidad: Software propio")
+    p.cut()
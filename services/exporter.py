@@ -0,0 +1,227 @@
+"""Exportador de métricas en formato de texto de Prometheus
+
+Contadores e histogramas en memoria del proceso (se alimentan desde
+ApiDianService, FolderWatcherService y metrics.record) más valores que se
+consultan a la base de datos en cada lectura: documentos por estado, cola
+de correos y uso del pool de conexiones. El servidor HTTP es opcional
+(METRICS_EXPORTER_PORT) y sirve GET /metrics.
+"""
+import time
+import logging
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from config import METRICS_EXPORTER_HOST, METRICS_EXPORTER_PORT
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "facturapro_"
+
+# Límites de los histogramas de latencia (segundos)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels_key(labels: dict) -> Tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: Tuple, extra: Tuple = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    """Histograma acumulado por combinación de etiquetas"""
+
+    __slots__ = ("buckets", "series")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.series: Dict[Tuple, list] = {}  # etiquetas -> [conteos por límite..., suma, total]
+
+    def observe(self, value: float, labels: dict):
+        data = self.series.setdefault(_labels_key(labels), [0] * (len(self.buckets) + 2))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+        data[-2] += value
+        data[-1] += 1
+
+
+class MetricsRegistry:
+    """Registro de contadores e histogramas del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self._help: Dict[str, str] = {}
+
+    def inc(self, name: str, help_text: str, labels: dict = None, value: float = 1):
+        with self._lock:
+            self._help.setdefault(name, help_text)
+            series = self._counters.setdefault(name, {})
+            key = _labels_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, help_text: str, value: float, labels: dict = None,
+                buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        with self._lock:
+            self._help.setdefault(name, help_text)
+            self._histograms.setdefault(name, Histogram(buckets)).observe(value, labels)
+
+    def render(self) -> str:
+        """Contadores e histogramas en formato de texto de Prometheus"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full = PREFIX + name
+                lines += [f"# HELP {full} {self._help[name]}", f"# TYPE {full} counter"]
+                lines += [f"{full}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(series.items())]
+            for name, histogram in sorted(self._histograms.items()):
+                full = PREFIX + name
+                lines += [f"# HELP {full} {self._help[name]}", f"# TYPE {full} histogram"]
+                for key, data in sorted(histogram.series.items()):
+                    for bound, count in zip(histogram.buckets, data):
+                        lines.append(f"{full}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {count}")
+                    lines.append(f"{full}_bucket{_format_labels(key, (('le', '+Inf'),))} {data[-1]}")
+                    lines.append(f"{full}_sum{_format_labels(key)} {_format_value(data[-2])}")
+                    lines.append(f"{full}_count{_format_labels(key)} {data[-1]}")
+        return "\n".join(lines)
+
+
+registry = MetricsRegistry()
+
+
+# ---------- Instrumentación ----------
+
+def document_ingested(doc_type: str):
+    registry.inc("documents_ingested_total", "Documentos importados desde XML", {"type": doc_type})
+
+
+def document_processed(doc_type: str, status: str):
+    """Resultado de un envío: sent, rejected, error o processing"""
+    registry.inc("documents_processed_total", "Respuestas de envío por tipo y estado", {"type": doc_type, "status": status})
+
+
+def apidian_request(endpoint: str, method: str, seconds: float, ok: bool):
+    registry.observe("apidian_request_seconds", "Latencia de las peticiones a ApiDian", seconds,
+                     {"endpoint": endpoint, "method": method})
+    if not ok:
+        registry.inc("apidian_request_errors_total", "Peticiones a ApiDian fallidas",
+                     {"endpoint": endpoint, "method": method})
+
+
+def endpoint_label(base_url: str, url: str) -> str:
+    """Primer segmento de la ruta (invoice, credit-note, customer...) para acotar las etiquetas"""
+    path = url[len(base_url):] if base_url and url.startswith(base_url) else url.split("://")[-1].partition("/")[2]
+    segment = path.strip("/").split("/")[0].split("?")[0]
+    return segment if segment and not segment.isdigit() else "root"
+
+
+def observed_request(method: str):
+    """Decorador para los métodos HTTP de ApiDianService(self, url, ...)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, url, *args, **kwargs):
+            start = time.perf_counter()
+            result = func(self, url, *args, **kwargs)
+            apidian_request(endpoint_label(self.base_url, url), method, time.perf_counter() - start,
+                            bool(result.get("success")))
+            return result
+        return wrapper
+    return decorator
+
+
+def operation_finished(operation: str, seconds: float):
+    registry.observe("operation_seconds", "Duración total de envíos e importaciones", seconds, {"operation": operation})
+
+
+# ---------- Valores consultados en cada lectura ----------
+
+def _gauges() -> str:
+    from sqlalchemy import func
+    from database import engine, get_session, Document, EmailOutbox
+
+    lines = []
+    session = get_session()
+    try:
+        lines += [f"# HELP {PREFIX}documents Documentos por tipo y estado", f"# TYPE {PREFIX}documents gauge"]
+        for doc_type, status, count in session.query(Document.type, Document.status, func.count(Document.id)).group_by(
+                Document.type, Document.status):
+            lines.append(f"{PREFIX}documents{_format_labels(_labels_key({'type': doc_type, 'status': status}))} {count}")
+
+        lines += [f"# HELP {PREFIX}email_outbox Correos en la cola por estado", f"# TYPE {PREFIX}email_outbox gauge"]
+        for status, count in session.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status):
+            lines.append(f"{PREFIX}email_outbox{_format_labels(_labels_key({'status': status}))} {count}")
+    finally:
+        session.close()
+
+    # Pool de conexiones (QueuePool con MySQL; otros pools no exponen todos los valores)
+    pool = engine.pool
+    for name, attr, help_text in [("db_pool_size", "size", "Tamaño del pool de conexiones"),
+                                  ("db_pool_checked_out", "checkedout", "Conexiones en uso"),
+                                  ("db_pool_overflow", "overflow", "Conexiones por encima del tamaño del pool")]:
+        method = getattr(pool, attr, None)
+        if method is not None:
+            lines += [f"# HELP {PREFIX}{name} {help_text}", f"# TYPE {PREFIX}{name} gauge", f"{PREFIX}{name} {method()}"]
+    return "\n".join(lines)
+
+
+def render() -> str:
+    """Página completa de /metrics"""
+    try:
+        gauges = _gauges()
+    except Exception as e:
+        logger.warning("No se pudieron consultar las métricas de la base de datos: %s", e)
+        gauges = f"# Error consultando la base de datos: {e}".replace("\n", " ")
+    return f"{registry.render()}\n{gauges}\n"
+
+
+# ---------- Servidor HTTP ----------
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+_server = None
+
+
+def start_exporter(host: str = None, port: int = None):
+    """Iniciar el servidor de métricas en segundo plano (si hay puerto configurado)"""
+    global _server
+    port = METRICS_EXPORTER_PORT if port is None else port
+    if not port or _server is not None:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host or METRICS_EXPORTER_HOST, port), _Handler)
+    except OSError as e:
+        logger.warning("No se pudo iniciar el exportador de métricas en el puerto %s: %s", port, e)
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-exporter", daemon=True).start()
+    logger.info("Métricas disponibles en http://%s:%s/metrics", *_server.server_address[:2])
+    return _server
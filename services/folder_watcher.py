@@ -1,10 +1,18 @@
 """Servicio de monitoreo de carpeta de XMLs"""
 import os
 import shutil
+import logging
+import threading
 from pathlib import Path
 from datetime import datetime
+from typing import Optional
 from database import get_session, Document, Settings
 from services.xml_parser import SiigoXmlParser
+from services.metrics import record, current, span
+from services import exporter
+from services.profiling import profiled
+
+logger = logging.getLogger(__name__)
 
 
 class FolderWatcherService:
@@ -19,9 +27,19 @@ class FolderWatcherService:
         self.processed_folder = settings.processed_folder if settings else ""
         self.parser = SiigoXmlParser()
     
+    @profiled("scan")
     def scan(self) -> dict:
-        """Escanear carpeta y procesar XMLs"""
+        """Escanear carpeta y procesar XMLs (cada archivo se mide como operación "import")"""
+        with record("scan") as recording:
+            results = self._scan()
+            if recording is not None:
+                recording.keep = results["processed"] > 0  # No guardar escaneos vacíos
+            return results
+    
+    def _scan(self) -> dict:
         results = {"processed": 0, "errors": 0, "skipped": 0}
+        acquirers = []
+        api = None
         
         if not self.watch_folder or not os.path.exists(self.watch_folder):
             return results
@@ -48,28 +66,61 @@ class FolderWatcherService:
             
             # Parsear XML
             try:
-                data = self.parser.parse_file(file_path)
-                if not data:
-                    results["errors"] += 1
-                    continue
-                
-                # Crear documento
-                self._create_document(data, filename)
-                results["processed"] += 1
-                
-                # Mover a procesados
-                if self.processed_folder:
-                    dest = os.path.join(self.processed_folder, filename)
-                    shutil.move(file_path, dest)
+                with record("import"):
+                    data = self.parser.parse_file(file_path)
+                    if not data:
+                        results["errors"] += 1
+                        continue
+                    
+                    # Crear documento con el payload ya construido
+                    if api is None:
+                        from services.api_dian import ApiDianService
+                        api = ApiDianService()
+                    self._create_document(data, filename, api)
+                    exporter.document_ingested(data.get("type", "invoice"))
+                    results["processed"] += 1
+                    
+                    customer_id = self._customer_identification(data.get("customer", {}))
+                    if customer_id:
+                        acquirers.append(customer_id)
+                    
+                    # Mover a procesados
+                    if self.processed_folder:
+                        dest = os.path.join(self.processed_folder, filename)
+                        with span("move"):
+                            shutil.move(file_path, dest)
                     
             except Exception as e:
-                print(f"Error procesando {filename}: {e}")
+                logger.exception("Error procesando %s: %s", filename, e)
                 results["errors"] += 1
         
+        # Precargar en segundo plano los terceros de los XMLs nuevos
+        if acquirers:
+            threading.Thread(target=self._prefetch_acquirers, args=(acquirers,), daemon=True).start()
+        
         return results
     
-    def _create_document(self, data: dict, filename: str):
-        """Crear documento en la base de datos"""
+    def _customer_identification(self, customer: dict) -> Optional[tuple]:
+        """Obtener (type_document_identification_id, número) del cliente del XML"""
+        number = str(customer.get("identification_number", "") or "").strip()
+        # Consumidor final no se consulta en la DIAN
+        if not number or number.strip("2") == "":
+            return None
+        # Siigo solo envía dígito de verificación para NIT
+        type_id = 6 if customer.get("dv") else 3
+        return (type_id, number)
+    
+    def _prefetch_acquirers(self, acquirers: list):
+        """Consultar en lote los terceros en la DIAN para llenar la caché"""
+        from services.api_dian import ApiDianService
+        try:
+            results = ApiDianService().prefetch_acquirers(acquirers)
+            logger.info("Precarga de terceros: %s", results)
+        except Exception as e:
+            logger.warning("Error en la precarga de terceros: %s", e)
+    
+    def _create_document(self, data: dict, filename: str, api=None):
+        """Crear documento en la base de datos (con su payload precalculado)"""
         session = get_session()
         
         # Extraer datos
@@ -110,6 +161,15 @@ class FolderWatcherService:
             parsed_data=data,
         )
         
+        if api is not None:
+            result = api.prepare_payload(document)
+            if not result.get("success"):
+                logger.info("Avisos al preparar %s (queda pendiente): %s", filename, result.get("message"))
+        
         session.add(document)
-        session.commit()
+        with span("db"):
+            session.commit()
+        recording = current()
+        if recording is not None:
+            recording.document_id = document.id
         session.close()
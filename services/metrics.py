@@ -0,0 +1,166 @@
+"""Métricas de latencia por etapa del envío e importación de documentos
+
+Una operación (p. ej. send_invoice) abre una grabación con record(); las
+funciones de cada etapa marcadas con @timed agregan su duración a la
+grabación activa del hilo (contextvar) y no hacen nada si no hay ninguna.
+Al cerrar la operación se guardan todas las etapas en document_metrics.
+"""
+import math
+import time
+import logging
+import functools
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Optional
+from config import METRICS_ENABLED, METRICS_RETENTION_DAYS
+from database import get_session, DocumentMetric
+from services import exporter
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("metrics_recording", default=None)
+
+
+class Recording:
+    """Etapas medidas de una operación"""
+
+    __slots__ = ("operation", "document_id", "spans", "keep")
+
+    def __init__(self, operation: str, document_id: int = None):
+        self.operation = operation
+        self.document_id = document_id
+        self.spans = []  # (etapa, milisegundos)
+        self.keep = True  # False = descartar al terminar
+
+    def add(self, stage: str, duration_ms: float):
+        self.spans.append((stage, duration_ms))
+
+
+def current() -> Optional[Recording]:
+    """Grabación activa en este hilo (None si no se está midiendo)"""
+    return _current.get()
+
+
+@contextmanager
+def span(stage: str):
+    """Medir un bloque como etapa de la operación activa"""
+    recording = _current.get()
+    if recording is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recording.add(stage, (time.perf_counter() - start) * 1000)
+
+
+def timed(stage: str):
+    """Decorador: medir la función como etapa de la operación activa"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def record(operation: str, document_id: int = None):
+    """Medir una operación completa (etapa "total") y guardar sus etapas al terminar"""
+    if not METRICS_ENABLED:
+        yield None
+        return
+    recording = Recording(operation, document_id)
+    token = _current.set(recording)
+    start = time.perf_counter()
+    try:
+        yield recording
+    finally:
+        elapsed = time.perf_counter() - start
+        recording.add("total", elapsed * 1000)
+        _current.reset(token)
+        if recording.keep:
+            exporter.operation_finished(operation, elapsed)
+            save(recording)
+
+
+def recorded(operation: str):
+    """Decorador para métodos send_*(self, document): medir el envío del documento"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, document, *args, **kwargs):
+            with record(operation, getattr(document, "id", None)):
+                return func(self, document, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def save(recording: Recording):
+    """Guardar las etapas (las métricas nunca deben interrumpir la operación)"""
+    if not recording.spans:
+        return
+    session = get_session()
+    try:
+        now = datetime.now()
+        session.add_all([
+            DocumentMetric(document_id=recording.document_id, operation=recording.operation,
+                           stage=stage, duration_ms=round(duration_ms, 3), created_at=now)
+            for stage, duration_ms in recording.spans
+        ])
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.warning("No se pudieron guardar las métricas de %s: %s", recording.operation, e)
+    finally:
+        session.close()
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil por rango más cercano sobre valores ya ordenados"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summary(days: int = 7, operation: str = None) -> List[dict]:
+    """p50/p95/p99 por operación y etapa en los últimos días"""
+    session = get_session()
+    query = session.query(DocumentMetric.operation, DocumentMetric.stage, DocumentMetric.duration_ms).filter(
+        DocumentMetric.created_at >= datetime.now() - timedelta(days=days))
+    if operation:
+        query = query.filter(DocumentMetric.operation == operation)
+    groups = {}
+    for op, stage, duration_ms in query:
+        groups.setdefault((op, stage), []).append(duration_ms or 0)
+    session.close()
+
+    rows = []
+    for (op, stage), values in sorted(groups.items()):
+        values.sort()
+        rows.append({
+            "operation": op,
+            "stage": stage,
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": values[-1],
+        })
+    return rows
+
+
+def purge_old(days: int = None) -> int:
+    """Eliminar métricas más antiguas que la retención configurada"""
+    session = get_session()
+    deleted = session.query(DocumentMetric).filter(
+        DocumentMetric.created_at < datetime.now() - timedelta(days=days or METRICS_RETENTION_DAYS)
+    ).delete(synchronize_session=False)
+    session.commit()
+    session.close()
+    return deleted
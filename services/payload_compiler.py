@@ -0,0 +1,182 @@
+"""Compilador de líneas, impuestos y totales para los payloads de ApiDian"""
+from typing import List
+
+
+def compile_lines(parsed: dict) -> dict:
+    """Factura, NC y ND: líneas y tax_totals en una sola pasada
+
+    Agrupa impuestos por (tax_id, porcentaje); tax_id: 1=IVA, 4=INC.
+    """
+    lines = parsed.get("lines", [])
+    result = []
+    tax_groups = {}
+
+    for i, line in enumerate(lines):
+        quantity = float(line.get("quantity", 1))
+        total = float(line.get("total", 0))
+        tax_id = int(line.get("tax_id", 1))
+        tax_percent = float(line.get("tax_percent", 0))
+        tax_amount = float(line.get("tax_amount", 0))
+        unit_price = float(line.get("unit_price", total / quantity if quantity > 0 else total))
+
+        quantity_str = f"{quantity:.2f}"
+        total_str = f"{total:.2f}"
+        percent_str = f"{tax_percent:.2f}"
+
+        result.append({
+            "unit_measure_id": 70,
+            "invoiced_quantity": quantity_str,
+            "line_extension_amount": total_str,
+            "free_of_charge_indicator": False,
+            "tax_totals": [{
+                "tax_id": tax_id,
+                "tax_amount": f"{tax_amount:.2f}",
+                "percent": percent_str,
+                "taxable_amount": total_str,
+            }],
+            "description": line.get("description", line.get("name", "Producto")),
+            "code": str(line.get("code", str(i + 1))),
+            "type_item_identification_id": 4,
+            "price_amount": f"{unit_price:.2f}",
+            "base_quantity": quantity_str,
+        })
+
+        group = tax_groups.get((tax_id, percent_str))
+        if group is None:
+            group = tax_groups[(tax_id, percent_str)] = [tax_id, percent_str, 0, 0]
+        group[2] += tax_amount
+        group[3] += total
+
+    if tax_groups:
+        tax_totals = [{
+            "tax_id": tax_id,
+            "tax_amount": f"{tax_sum:.2f}",
+            "percent": percent_str,
+            "taxable_amount": f"{taxable_sum:.2f}",
+        } for tax_id, percent_str, tax_sum, taxable_sum in tax_groups.values()]
+    else:
+        # Si no hay impuestos, crear uno con IVA 0%
+        tax_totals = [{
+            "tax_id": 1,
+            "tax_amount": "0.00",
+            "percent": "0.00",
+            "taxable_amount": f"{float(parsed.get('subtotal', 0)):.2f}",
+        }]
+
+    return {
+        "lines": result,
+        "tax_totals": tax_totals,
+        "legal_monetary_totals": compile_totals(parsed),
+    }
+
+
+def compile_totals(parsed: dict) -> dict:
+    """Totales monetarios tomados del encabezado del XML"""
+    subtotal = float(parsed.get("subtotal", 0))
+    total_tax = float(parsed.get("total_tax", 0))
+    total_discount = float(parsed.get("total_discount", 0))
+    total = float(parsed.get("total", 0))
+
+    # tax_exclusive_amount = subtotal - descuentos
+    # tax_inclusive_amount = subtotal - descuentos + impuestos
+    tax_exclusive = subtotal - total_discount
+    tax_inclusive = tax_exclusive + total_tax
+
+    # Si el total parseado es diferente, usarlo (viene del XML)
+    if total > 0 and abs(total - tax_inclusive) > 0.01:
+        payable = total
+    else:
+        payable = tax_inclusive
+
+    return {
+        "line_extension_amount": f"{subtotal:.2f}",
+        "tax_exclusive_amount": f"{tax_exclusive:.2f}",
+        "tax_inclusive_amount": f"{tax_inclusive:.2f}",
+        "allowance_total_amount": f"{total_discount:.2f}",
+        "charge_total_amount": "0.00",
+        "payable_amount": f"{payable:.2f}",
+    }
+
+
+def compile_support_lines(lines: List[dict], document_date: str = None) -> dict:
+    """Documento soporte y nota de ajuste: líneas, tax_totals y totales en una sola pasada
+
+    El unit_price del XML incluye IVA (como en una compra real), por lo que la
+    base de cada línea se calcula quitando el impuesto. Con document_date se
+    generan líneas de documento soporte (con periodo); sin ella, de nota de ajuste.
+    """
+    result = []
+    tax_groups = {}
+    line_extension_amount = 0
+    total_tax_amount = 0
+
+    for line in lines:
+        tax_rate = float(line.get("tax_percent", 0))
+        quantity = float(line.get("quantity", 1))
+        unit_cost = float(line.get("unit_price", 0))
+
+        # Precio unitario sin IVA
+        if tax_rate > 0:
+            unit_price_without_tax = unit_cost / (1 + (tax_rate / 100))
+        else:
+            unit_price_without_tax = unit_cost
+
+        # Subtotal = cantidad × precio sin IVA
+        subtotal = quantity * unit_price_without_tax
+        tax_amount = subtotal * (tax_rate / 100)
+        line_extension_amount += subtotal
+        total_tax_amount += tax_amount
+
+        group = tax_groups.get(tax_rate)
+        if group is None:
+            group = tax_groups[tax_rate] = [tax_rate, 0, 0]
+        group[1] += tax_amount
+        group[2] += subtotal
+
+        quantity_str = f"{quantity:.2f}"
+        subtotal_str = f"{subtotal:.2f}"
+        item = {
+            "unit_measure_id": 70,
+            "invoiced_quantity": quantity_str,
+            "line_extension_amount": subtotal_str,
+            "free_of_charge_indicator": False,
+            "allowance_charges": [{
+                "charge_indicator": False,
+                "allowance_charge_reason": "DESCUENTO GENERAL",
+                "amount": "0.00",
+                "base_amount": subtotal_str,
+            }],
+            "tax_totals": [{
+                "tax_id": 1,
+                "tax_amount": f"{tax_amount:.2f}",
+                "percent": f"{tax_rate:.2f}",  # Con decimales en líneas
+                "taxable_amount": subtotal_str,
+            }],
+            "description": line.get("description", line.get("name", "Producto")),
+            "notes": "",
+            "code": str(line.get("code", "PROD")),
+            "type_item_identification_id": 4,
+            "price_amount": f"{unit_price_without_tax:.2f}",
+            "base_quantity": quantity_str,
+        }
+        if document_date:
+            item["type_generation_transmition_id"] = 1
+            item["start_date"] = document_date
+        result.append(item)
+
+    # Si no hay impuestos, agregar IVA 0%; percent como entero "0" no "0.00" (formato POS)
+    groups = tax_groups.values() if tax_groups else [[0, 0, 0]]
+    tax_totals = [{
+        "tax_id": 1,
+        "tax_amount": f"{tax_sum:.2f}",
+        "percent": str(int(rate)),
+        "taxable_amount": f"{taxable_sum:.2f}",
+    } for rate, tax_sum, taxable_sum in groups]
+
+    tax_inclusive_amount = line_extension_amount + total_tax_amount
+    return {
+        "lines": result,
+        "tax_totals": tax_totals,
+        "line_extension_amount": f"{line_extension_amount:.2f}",
+        "tax_inclusive_amount": f"{tax_inclusive_amount:.2f}",
+    }
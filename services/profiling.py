@@ -0,0 +1,160 @@
+"""Perfilado opcional (cProfile / tracemalloc) de inicio, escaneo, envíos y carga de documentos
+
+Se activa con PROFILE=cpu|memory|all o desde Ajustes > Diagnóstico. Cada
+ejecución perfilada escribe <nombre>-<fecha>.prof (CPU) y/o .snapshot
+(memoria) en PROFILE_DIR; la pantalla de diagnóstico muestra las funciones
+más costosas y las líneas que más memoria asignaron.
+"""
+import os
+import time
+import pstats
+import logging
+import cProfile
+import functools
+import threading
+import tracemalloc
+from datetime import datetime
+from typing import List
+from config import PROFILE, PROFILE_DIR
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "cpu", "memory", "all")
+
+_mode = PROFILE if PROFILE in MODES else "off"
+_local = threading.local()
+_memory_lock = threading.Lock()
+_memory_users = 0
+
+
+def get_mode() -> str:
+    return _mode
+
+
+def set_mode(mode: str):
+    """Cambiar el modo en ejecución (no se guarda; al reiniciar vuelve a PROFILE)"""
+    global _mode
+    _mode = mode if mode in MODES else "off"
+    logger.info("Perfilado: %s", _mode)
+
+
+def profiled(name: str):
+    """Decorador: perfilar la función si el modo está activo
+
+    Solo se perfila la llamada más externa de cada hilo (cProfile no admite
+    perfiles anidados); las llamadas internas quedan dentro de ese perfil.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _mode == "off" or getattr(_local, "active", False):
+                return func(*args, **kwargs)
+            _local.active = True
+            try:
+                return _run_profiled(name, func, args, kwargs)
+            finally:
+                _local.active = False
+        return wrapper
+    return decorator
+
+
+def _run_profiled(name: str, func, args, kwargs):
+    cpu = _mode in ("cpu", "all")
+    memory = _mode in ("memory", "all")
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    base = os.path.join(str(PROFILE_DIR), f"{name}-{stamp}")
+
+    profiler = cProfile.Profile() if cpu else None
+    if memory:
+        _start_memory()
+    start = time.perf_counter()
+    try:
+        if profiler is None:
+            return func(*args, **kwargs)
+        try:
+            profiler.enable()
+        except ValueError:
+            # Otra herramienta de perfilado activa (p. ej. un depurador): seguir sin CPU
+            profiler = None
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+    finally:
+        elapsed = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot() if memory else None
+        peak_kb = tracemalloc.get_traced_memory()[1] / 1024 if memory else 0
+        if memory:
+            _stop_memory()
+        try:
+            os.makedirs(str(PROFILE_DIR), exist_ok=True)
+            if profiler is not None:
+                profiler.dump_stats(base + ".prof")
+            if snapshot is not None:
+                snapshot.dump(base + ".snapshot")
+            logger.info("Perfil de %s guardado en %s (%.2f s, pico de memoria %.0f KB)", name, base, elapsed, peak_kb)
+        except OSError as e:
+            logger.warning("No se pudo guardar el perfil de %s: %s", name, e)
+
+
+def _start_memory():
+    global _memory_users
+    with _memory_lock:
+        if _memory_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        _memory_users += 1
+
+
+def _stop_memory():
+    global _memory_users
+    with _memory_lock:
+        _memory_users -= 1
+        if _memory_users == 0:
+            tracemalloc.stop()
+
+
+# ---------- Resúmenes ----------
+
+def list_profiles(limit: int = 30) -> List[dict]:
+    """Perfiles guardados, del más reciente al más antiguo"""
+    if not os.path.isdir(str(PROFILE_DIR)):
+        return []
+    files = []
+    for filename in os.listdir(str(PROFILE_DIR)):
+        if filename.endswith((".prof", ".snapshot")):
+            path = os.path.join(str(PROFILE_DIR), filename)
+            files.append({"name": filename, "path": path, "kind": "cpu" if filename.endswith(".prof") else "memory",
+                          "size": os.path.getsize(path), "modified": os.path.getmtime(path)})
+    files.sort(key=lambda f: f["modified"], reverse=True)
+    return files[:limit]
+
+
+def cpu_summary(path: str, top: int = 20) -> List[dict]:
+    """Funciones con mayor tiempo acumulado"""
+    stats = pstats.Stats(path)
+    rows = []
+    for (filename, line, function), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{line}({function})",
+            "calls": ncalls,
+            "tottime": tottime,
+            "cumtime": cumtime,
+        })
+    rows.sort(key=lambda r: r["cumtime"], reverse=True)
+    return rows[:top]
+
+
+def memory_summary(path: str, top: int = 20) -> List[dict]:
+    """Líneas con mayor memoria asignada (aún viva al tomar la instantánea)"""
+    snapshot = tracemalloc.Snapshot.load(path).filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    return [{
+        "location": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+        "size_kb": stat.size / 1024,
+        "count": stat.count,
+    } for stat in snapshot.statistics("lineno")[:top]]
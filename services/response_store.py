@@ -0,0 +1,111 @@
+"""Almacenamiento de respuestas de ApiDian: resumen en la fila, respuesta completa comprimida aparte"""
+import zlib
+import logging
+import threading
+from typing import Optional
+from sqlalchemy import Text, cast
+from sqlalchemy.exc import SQLAlchemyError
+import json_codec
+from database import get_session, Document, DocumentResponse
+
+logger = logging.getLogger(__name__)
+
+# Campos de primer nivel que usa la aplicación
+KEPT_FIELDS = ("success", "message", "errors", "cufe", "cude", "cuds", "uuid",
+               "urlinvoicepdf", "urlinvoiceattached", "urlinvoicexml", "validation")
+
+# Campos del resultado de la DIAN (SendBillSync / SendTestSetAsync); sin XmlBase64Bytes
+KEPT_DIAN_FIELDS = ("IsValid", "StatusCode", "StatusDescription", "ErrorMessage",
+                    "XmlDocumentKey", "XmlFileName", "ZipKey")
+
+# Marca de respuesta ya resumida (indica si hay respuesta completa guardada)
+MARKER = "full_response_stored"
+
+
+def slim_response(result: dict) -> dict:
+    """Resumen de la respuesta con la misma estructura (ResponseDian → Envelope → Body)"""
+    slim = {key: result[key] for key in KEPT_FIELDS if key in result}
+
+    body = ((result.get("ResponseDian") or {}).get("Envelope") or {}).get("Body") or {}
+    slim_body = {}
+    if isinstance(body, dict):
+        for response_name, response in body.items():
+            if not isinstance(response, dict):
+                continue
+            for result_name, dian_result in response.items():
+                if isinstance(dian_result, dict):
+                    kept = {key: dian_result[key] for key in KEPT_DIAN_FIELDS if key in dian_result}
+                    slim_body.setdefault(response_name, {})[result_name] = kept
+    if slim_body:
+        slim["ResponseDian"] = {"Envelope": {"Body": slim_body}}
+
+    slim[MARKER] = any(key not in KEPT_FIELDS for key in result)
+    return slim
+
+
+def store_response(session, document: Document, result: dict):
+    """Guardar el resumen en el documento y la respuesta completa en document_responses
+
+    No hace commit: se guarda en la misma transacción que el estado del documento.
+    """
+    slim = slim_response(result)
+    document.api_response = slim
+    if slim[MARKER]:
+        data = json_codec.dumps_bytes(result)
+        session.merge(DocumentResponse(document_id=document.id, content=zlib.compress(data, 6), size=len(data)))
+    else:
+        # Descartar la respuesta completa de un envío anterior
+        session.query(DocumentResponse).filter(DocumentResponse.document_id == document.id).delete()
+
+
+def load_full_response(document: Document) -> Optional[dict]:
+    """Respuesta completa del documento (se descomprime solo cuando se pide)"""
+    api_response = document.api_response or {}
+    if not api_response.get(MARKER):
+        return api_response or None  # Respuesta antigua sin resumir o sin datos adicionales
+
+    session = get_session()
+    stored = session.query(DocumentResponse).get(document.id)
+    session.close()
+    if not stored or not stored.content:
+        return api_response
+    return json_codec.loads(zlib.decompress(stored.content))
+
+
+def compact_stored_responses(batch_size: int = 100) -> int:
+    """Resumir las respuestas guardadas antes de existir este almacenamiento"""
+    compacted = 0
+    last_id = 0
+    while True:
+        session = get_session()
+        try:
+            docs = session.query(Document).filter(
+                Document.id > last_id,
+                Document.api_response.isnot(None),
+                ~cast(Document.api_response, Text).like(f"%{MARKER}%"),
+            ).order_by(Document.id).limit(batch_size).all()
+            if not docs:
+                return compacted
+            for doc in docs:
+                if isinstance(doc.api_response, dict):
+                    store_response(session, doc, doc.api_response)
+                    compacted += 1
+            last_id = docs[-1].id
+            session.commit()
+        except SQLAlchemyError as e:
+            # Otra terminal compactando al mismo tiempo: se deja para el próximo inicio
+            session.rollback()
+            logger.warning("No se pudieron compactar las respuestas guardadas: %s", e)
+            return compacted
+        finally:
+            session.close()
+
+
+def start_compaction():
+    """Compactar respuestas antiguas en segundo plano al iniciar la aplicación"""
+    def run():
+        compacted = compact_stored_responses()
+        if compacted:
+            logger.info("%d respuestas de ApiDian resumidas", compacted)
+
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,189 @@
+"""Registro de consultas SQL lentas y conteo de consultas por acción de usuario
+
+Los eventos before/after_cursor_execute del engine miden cada consulta.
+La acción se toma de la acción activa (decorador @sql_action en las vistas)
+o, si no hay, del método de views/ o services/ más cercano en la pila. Al
+terminar cada acción se registra cuántas consultas hizo, para detectar N+1.
+Las consultas lentas se guardan en memoria con los parámetros enmascarados
+y se pueden exportar a CSV.
+"""
+import os
+import csv
+import sys
+import time
+import logging
+import functools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import event
+from config import DATA_DIR, SQL_MONITOR, SQL_SLOW_MS, SQL_QUERIES_PER_ACTION
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIRS = tuple(os.path.join(PACKAGE_DIR, name) + os.sep for name in ("views", "services"))
+
+_current = contextvars.ContextVar("sql_action", default=None)
+_lock = threading.Lock()
+_slow_queries = deque(maxlen=500)
+_action_stats = {}  # acción -> {"invocations", "queries", "max_queries", "sql_ms"}
+_installed = False
+
+
+class _Action:
+    __slots__ = ("name", "queries", "sql_ms")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queries = 0
+        self.sql_ms = 0.0
+
+
+@contextmanager
+def action(name: str):
+    """Agrupar las consultas de una acción de usuario (las anidadas cuentan en la externa)"""
+    if _current.get() is not None:
+        yield
+        return
+    current = _Action(name)
+    token = _current.set(current)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+        _finish_action(current)
+
+
+def sql_action(func=None, *, name: str = None):
+    """Decorador de acciones de vistas/servicios (nombre por defecto: Clase.método)"""
+    def decorator(f):
+        label = name or f.__qualname__
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with action(label):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator(func) if func is not None else decorator
+
+
+def _finish_action(current: _Action):
+    with _lock:
+        stats = _action_stats.setdefault(current.name, {"invocations": 0, "queries": 0, "max_queries": 0, "sql_ms": 0.0})
+        stats["invocations"] += 1
+        stats["queries"] += current.queries
+        stats["max_queries"] = max(stats["max_queries"], current.queries)
+        stats["sql_ms"] += current.sql_ms
+    if current.queries > SQL_QUERIES_PER_ACTION:
+        logger.warning("%s ejecutó %d consultas (%.0f ms en SQL): posible N+1",
+                       current.name, current.queries, current.sql_ms)
+
+
+def _caller() -> str:
+    """Método de views/ o services/ más cercano a la consulta"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(SOURCE_DIRS) and filename != __file__:
+            code = frame.f_code
+            return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(filename)}:{frame.f_lineno})"
+        frame = frame.f_back
+    return "(sin acción)"
+
+
+def redact_params(params) -> str:
+    """Parámetros sin datos: números y nulos se conservan, textos y binarios solo su tipo y largo"""
+    def mask(value):
+        if value is None or isinstance(value, (bool, int, float)):
+            return repr(value)
+        if isinstance(value, (str, bytes)):
+            return f"<{type(value).__name__}:{len(value)}>"
+        return f"<{type(value).__name__}>"
+
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}={mask(value)}" for key, value in params.items()) + "}"
+    if isinstance(params, (list, tuple)):
+        if params and isinstance(params[0], (list, tuple, dict)):
+            return f"[{len(params)} filas] " + redact_params(params[0])  # executemany
+        return "(" + ", ".join(mask(value) for value in params) + ")"
+    return ""
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("sql_monitor_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("sql_monitor_start")
+    if not starts:
+        return
+    elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+
+    current = _current.get()
+    if current is not None:
+        current.queries += 1
+        current.sql_ms += elapsed_ms
+
+    if elapsed_ms >= SQL_SLOW_MS:
+        entry = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "duration_ms": round(elapsed_ms, 1),
+            "action": current.name if current is not None else "",
+            "caller": _caller(),
+            "statement": " ".join(statement.split())[:2000],
+            "params": redact_params(parameters),
+            "rows": getattr(cursor, "rowcount", -1),
+        }
+        with _lock:
+            _slow_queries.append(entry)
+        logger.warning("Consulta lenta (%.0f ms) en %s: %s", elapsed_ms, entry["action"] or entry["caller"],
+                       entry["statement"][:200])
+
+
+def install(engine=None):
+    """Registrar los eventos en el engine (idempotente; no hace nada si SQL_MONITOR=0)"""
+    global _installed
+    if _installed or not SQL_MONITOR:
+        return
+    if engine is None:
+        from database import engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    _installed = True
+
+
+def slow_queries() -> List[dict]:
+    """Consultas lentas registradas, de la más reciente a la más antigua"""
+    with _lock:
+        return list(reversed(_slow_queries))
+
+
+def action_stats() -> List[dict]:
+    """Consultas por acción, ordenadas por el máximo de consultas en una sola ejecución"""
+    with _lock:
+        rows = [{"action": name, **stats, "avg_queries": stats["queries"] / stats["invocations"]}
+                for name, stats in _action_stats.items()]
+    rows.sort(key=lambda r: r["max_queries"], reverse=True)
+    return rows
+
+
+def export_csv(directory: str = None) -> Optional[str]:
+    """Exportar consultas lentas y conteo por acción a CSV; devuelve la carpeta"""
+    directory = directory or os.path.join(str(DATA_DIR), "sql")
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    with open(os.path.join(directory, f"slow_queries-{stamp}.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["time", "duration_ms", "action", "caller", "statement", "params", "rows"])
+        writer.writeheader()
+        writer.writerows(slow_queries())
+
+    with open(os.path.join(directory, f"sql_actions-{stamp}.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["action", "invocations", "queries", "avg_queries", "max_queries", "sql_ms"])
+        writer.writeheader()
+        writer.writerows(action_stats())
+    return directory
@@ -0,0 +1,134 @@
+"""Diagramación de tickets en dos fases: medir y luego dibujar"""
+from functools import lru_cache
+from typing import List, Tuple
+
+MM = 72 / 25.4  # Puntos por milímetro
+
+
+@lru_cache(maxsize=8192)
+def text_width(text: str, font: str, size: float) -> float:
+    """Ancho del texto en puntos (métricas de fuente cacheadas)"""
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    return stringWidth(text, font, size)
+
+
+def wrap_text(text: str, font: str, size: float, max_width: float) -> List[str]:
+    """Partir texto en líneas que quepan en el ancho indicado"""
+    text = str(text or "")
+    if text_width(text, font, size) <= max_width:
+        return [text]
+
+    lines = []
+    current = ""
+    for word in text.split():
+        candidate = f"{current} {word}" if current else word
+        if text_width(candidate, font, size) <= max_width:
+            current = candidate
+            continue
+        if current:
+            lines.append(current)
+        # Palabras más largas que el ancho (p. ej. CUFE): cortar por caracteres
+        while text_width(word, font, size) > max_width:
+            cut = max(1, int(len(word) * max_width / text_width(word, font, size)))
+            while cut > 1 and text_width(word[:cut], font, size) > max_width:
+                cut -= 1
+            lines.append(word[:cut])
+            word = word[cut:]
+        current = word
+    if current:
+        lines.append(current)
+    return lines or [""]
+
+
+class TicketLayout:
+    """Lista de operaciones de dibujo con posición y altura ya calculadas
+
+    Fase de medición: cada método agrega operaciones con el texto ya partido
+    y las coordenadas X resueltas, acumulando la altura exacta del ticket.
+    Fase de dibujo: draw() recorre las operaciones sobre un canvas de reportlab
+    sin volver a medir nada. Los bloques estáticos (p. ej. el encabezado de la
+    empresa) se pueden construir una vez y reutilizar con extend().
+    """
+
+    def __init__(self, width_mm: float = 80, margin_mm: float = 2):
+        self.width = width_mm * MM
+        self.margin = margin_mm * MM
+        self.ops: List[Tuple] = []
+        self.height = 0.0
+
+    @property
+    def content_width(self) -> float:
+        return self.width - 2 * self.margin
+
+    # ---------- Medición ----------
+
+    def centered(self, text: str, font: str, size: float, line_height: float = 3.2):
+        """Texto centrado; se parte en varias líneas si no cabe"""
+        for line in wrap_text(text, font, size, self.content_width):
+            x = (self.width - text_width(line, font, size)) / 2
+            self._add(("text", ((x, line),), font, size), line_height * MM)
+
+    def left(self, text: str, font: str, size: float, line_height: float = 3.2, indent_mm: float = 0):
+        """Texto alineado a la izquierda; se parte en varias líneas si no cabe"""
+        x = self.margin + indent_mm * MM
+        for line in wrap_text(text, font, size, self.width - self.margin - x):
+            self._add(("text", ((x, line),), font, size), line_height * MM)
+
+    def row(self, cells: List[Tuple[float, str, str]], font: str, size: float, line_height: float = 3.2):
+        """Fila de columnas: (posición en mm desde el margen o None = borde derecho, texto, alineación)"""
+        placed = []
+        for x_mm, text, align in cells:
+            x = self.width - self.margin if x_mm is None else self.margin + x_mm * MM
+            if align == "right":
+                x -= text_width(text, font, size)
+            placed.append((x, text))
+        self._add(("text", tuple(placed), font, size), line_height * MM)
+
+    def space(self, h_mm: float = 1.5):
+        self._add(("space",), h_mm * MM)
+
+    def image(self, image, size_mm: float, gap_mm: float = 2):
+        """Imagen cuadrada centrada (ImageReader de reportlab)"""
+        size = size_mm * MM
+        self._add(("image", image, (self.width - size) / 2, size), size + gap_mm * MM)
+
+    def extend(self, block: "TicketLayout"):
+        """Agregar un bloque ya medido (p. ej. encabezado cacheado)"""
+        self.ops.extend(block.ops)
+        self.height += block.height
+
+    def _add(self, op: Tuple, height: float):
+        self.ops.append((height, op))
+        self.height += height
+
+    # ---------- Dibujo ----------
+
+    def pages(self, max_height_mm: float = 5000) -> List[Tuple[List[Tuple], float]]:
+        """Dividir las operaciones en páginas (los visores PDF limitan la altura de página)"""
+        top = 4 * self.margin
+        max_height = max_height_mm * MM
+        pages = []
+        current, height = [], top
+        for item in self.ops:
+            if current and height + item[0] > max_height:
+                pages.append((current, height))
+                current, height = [], top
+            current.append(item)
+            height += item[0]
+        pages.append((current, height))
+        return pages
+
+    def draw(self, c, ops: List[Tuple], page_height: float):
+        """Dibujar operaciones en la página actual del canvas"""
+        y = page_height - 2 * self.margin
+        for height, op in ops:
+            kind = op[0]
+            if kind == "text":
+                _, cells, font, size = op
+                c.setFont(font, size)
+                for x, text in cells:
+                    c.drawString(x, y, text)
+            elif kind == "image":
+                _, image, x, size = op
+                c.drawImage(image, x, y - size, width=size, height=size)
+            y -= height
@@ -0,0 +1,385 @@
+"""Generación e impresión de tickets 80mm"""
+import os
+import sys
+from datetime import datetime
+from io import BytesIO
+from typing import List
+from database import get_session, Document, Resolution, Settings, Municipality, Department
+from services.ticket_layout import TicketLayout, wrap_text, MM
+
+# Courier: monoespaciada, más compacta
+FONT = "Courier"
+FONT_BOLD = "Courier-Bold"
+
+
+TYPE_LABELS = {
+    "invoice": "FACTURA ELECTRONICA DE VENTA",
+    "credit_note": "NOTA CREDITO ELECTRONICA",
+    "debit_note": "NOTA DEBITO ELECTRONICA",
+}
+
+# Motivos de discrepancia NC/ND
+NC_REASONS = {
+    "1": "Devolucion parcial",
+    "2": "Anulacion de factura",
+    "3": "Rebaja o descuento",
+    "4": "Ajuste de precio",
+    "5": "Otros",
+}
+ND_REASONS = {
+    "1": "Intereses",
+    "2": "Gastos por cobrar",
+    "3": "Cambio del valor",
+    "4": "Otros",
+}
+
+
+def discrepancy_reason(doc_type: str, parsed_data: dict) -> tuple:
+    """Motivo y descripción de la discrepancia de una NC/ND"""
+    discrepancy_code = parsed_data.get("discrepancy_code", "")
+    discrepancy_desc = parsed_data.get("discrepancy_description", "")
+    reasons = NC_REASONS if doc_type == "credit_note" else ND_REASONS
+    return reasons.get(str(discrepancy_code), discrepancy_desc or "N/A"), discrepancy_desc
+
+
+def line_tax_label(tax_id: int, tax_pct: float) -> str:
+    """Etiqueta corta del impuesto de una línea"""
+    if tax_pct == 0:
+        return "Exc"
+    if tax_id == 4:
+        return f"IC{tax_pct:.0f}"
+    return f"{tax_pct:.0f}%"
+
+
+def summarize_taxes(lines: list) -> list:
+    """Agrupar impuestos por (tax_id, porcentaje); tax_id: 1=IVA, 4=INC (Impuesto al Consumo)"""
+    summary = {}
+    for line in lines:
+        tax_id = int(line.get("tax_id", 1))
+        tax_pct = float(line.get("tax_percent", 0))
+        base = float(line.get("total", 0))
+        tax_amt = float(line.get("tax_amount", 0))
+        if tax_amt == 0 and tax_pct > 0:
+            tax_amt = base * (tax_pct / 100)
+
+        key = f"{tax_id}_{tax_pct}"
+        if key not in summary:
+            if tax_pct == 0:
+                name = "Excluido"
+            elif tax_id == 4:
+                name = "INC"
+            else:
+                name = "IVA"
+            summary[key] = {"tax_id": tax_id, "percent": tax_pct, "name": name, "base": 0, "tax": 0}
+        summary[key]["base"] += base
+        summary[key]["tax"] += tax_amt
+    return [summary[key] for key in sorted(summary.keys())]
+
+
+def dian_qr_url(settings, cufe: str) -> tuple:
+    """URL de consulta del documento según ambiente (habilitación o producción)"""
+    if settings and settings.type_environment_id == 1:
+        host = "catalogo-vpfe.dian.gov.co"
+    else:
+        host = "catalogo-vpfe-hab.dian.gov.co"
+    return f"https://{host}/document/searchqr?documentkey={cufe}", host
+
+
+class TicketPrinter:
+    """Renderiza uno o varios documentos como tickets 80mm en un solo PDF
+
+    El contexto compartido (empresa, municipio, resoluciones y documentos de
+    referencia) se carga una sola vez por lote; cada ticket ocupa una página
+    del PDF para enviarlo como un único trabajo de impresión.
+    """
+
+    TICKET_WIDTH_MM = 80
+    MARGIN_MM = 2
+
+    # Encabezados medidos por empresa (se invalidan solos al cambiar los datos)
+    _header_cache = {}
+
+    def print_documents(self, documents: List[Document], pdf_path: str = None) -> dict:
+        """Imprimir los tickets según la salida configurada (PDF o ESC/POS directo)"""
+        if not documents:
+            return {"success": False, "message": "No hay documentos para imprimir"}
+
+        ctx = self._load_context(documents)
+        settings = ctx["settings"]
+        if settings and settings.ticket_printer_mode == "escpos":
+            return self.print_escpos(documents, ctx)
+
+        result = self.render_pdf(documents, pdf_path, ctx)
+        if not result.get("success"):
+            return result
+        return self.send_to_printer(result["path"])
+
+    def print_escpos(self, documents: List[Document], ctx: dict = None) -> dict:
+        """Enviar los tickets como comandos ESC/POS, sin PDF intermedio"""
+        from services.escpos import render_tickets, send_to_device
+
+        ctx = ctx or self._load_context(documents)
+        settings = ctx["settings"]
+        data = render_tickets(documents, ctx, settings.ticket_printer_columns or 48)
+        result = send_to_device(settings.ticket_printer_target, data)
+        if result.get("success"):
+            result["count"] = len(documents)
+        return result
+
+    def render_pdf(self, documents: List[Document], pdf_path: str = None, ctx: dict = None) -> dict:
+        """Generar un PDF con una página por documento (altura exacta de cada ticket)"""
+        try:
+            import qrcode  # noqa: F401
+            from reportlab.pdfgen import canvas
+        except ImportError:
+            return {"success": False, "message": "Instale: pip install qrcode reportlab"}
+
+        if not documents:
+            return {"success": False, "message": "No hay documentos para imprimir"}
+
+        if not pdf_path:
+            downloads_path = os.path.expanduser("~/Downloads")
+            if len(documents) == 1:
+                filename = f"ticket_{documents[0].full_number}.pdf"
+            else:
+                filename = f"tickets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+            pdf_path = os.path.join(downloads_path, filename)
+
+        ctx = ctx or self._load_context(documents)
+        c = canvas.Canvas(pdf_path)
+
+        # Fase 1 (medir) en _layout_ticket, fase 2 (dibujar) en layout.draw
+        for doc in documents:
+            layout = self._layout_ticket(doc, ctx)
+            for ops, height in layout.pages():
+                c.setPageSize((layout.width, height))
+                layout.draw(c, ops, height)
+                c.showPage()
+
+        try:
+            c.save()
+        except PermissionError:
+            return {"success": False, "message": "Cierre el PDF anterior antes de imprimir otro"}
+
+        return {"success": True, "path": pdf_path, "count": len(documents)}
+
+    def send_to_printer(self, pdf_path: str) -> dict:
+        """Enviar el PDF a la impresora predeterminada (o abrirlo si no es posible)"""
+        try:
+            if sys.platform == 'win32':
+                import ctypes
+                result = ctypes.windll.shell32.ShellExecuteW(
+                    None, "print", pdf_path, None, None, 1
+                )
+                if result > 32:
+                    return {"success": True, "path": pdf_path, "message": "Enviado a impresión"}
+            os.startfile(pdf_path)
+            return {"success": True, "path": pdf_path, "message": "Ticket abierto - Use Ctrl+P para imprimir"}
+        except Exception:
+            return {"success": True, "path": pdf_path, "message": f"Ticket guardado: {pdf_path}"}
+
+    def _load_context(self, documents: List[Document]) -> dict:
+        """Cargar en una sola sesión los datos comunes a todos los tickets"""
+        session = get_session()
+        settings = session.query(Settings).first()
+
+        # Municipio y departamento del emisor
+        municipality = session.query(Municipality).get(settings.municipality_id) if settings and settings.municipality_id else None
+        department = session.query(Department).get(settings.department_id) if settings and settings.department_id else None
+
+        resolutions = {}
+        for resolution in session.query(Resolution).all():
+            resolutions.setdefault((resolution.type_document_id, resolution.prefix), resolution)
+
+        # Documentos de referencia de NC/ND
+        reference_ids = {doc.reference_document_id for doc in documents
+                         if doc.type in ["credit_note", "debit_note"] and doc.reference_document_id}
+        references = {}
+        if reference_ids:
+            references = {ref.id: ref for ref in session.query(Document).filter(Document.id.in_(reference_ids))}
+
+        session.close()
+        return {
+            "settings": settings,
+            "municipality": municipality,
+            "department": department,
+            "resolutions": resolutions,
+            "references": references,
+        }
+
+    def _header_block(self, ctx: dict) -> TicketLayout:
+        """Encabezado del emisor, medido una vez por empresa y reutilizado en cada ticket"""
+        settings = ctx["settings"]
+        municipality = ctx["municipality"]
+        department = ctx["department"]
+        key = (
+            settings.company_name, settings.company_nit, settings.company_dv, settings.type_regime_id,
+            settings.company_address, settings.company_phone, settings.company_email,
+            municipality.name if municipality else None, department.name if department else None,
+        )
+        block = self._header_cache.get(key)
+        if block is not None:
+            return block
+
+        block = TicketLayout(self.TICKET_WIDTH_MM, self.MARGIN_MM)
+        block.centered((settings.company_name or "EMPRESA").upper(), FONT_BOLD, 10)
+        block.centered(f"NIT: {settings.company_nit or ''}-{settings.company_dv or ''}", FONT_BOLD, 9)
+        block.centered("RESPONSABLE DE IVA" if settings.type_regime_id == 1 else "NO RESPONSABLE DE IVA", FONT, 7)
+        if settings.company_address:
+            block.centered(settings.company_address, FONT, 7)
+        # Municipio y Departamento del emisor
+        if municipality and department:
+            block.centered(f"{municipality.name} - {department.name}", FONT, 7)
+        if settings.company_phone:
+            block.centered(f"Tel: {settings.company_phone}", FONT, 7)
+        if settings.company_email:
+            block.centered(settings.company_email, FONT, 6)
+        block.space(2)
+
+        self._header_cache[key] = block
+        return block
+
+    def _layout_ticket(self, doc: Document, ctx: dict) -> TicketLayout:
+        """Medir el ticket completo con todos los datos reglamentarios DIAN"""
+        import qrcode
+        from reportlab.lib.utils import ImageReader
+
+        settings = ctx["settings"]
+        resolution = ctx["resolutions"].get((doc.type_document_id, doc.prefix))
+        ref_doc = ctx["references"].get(doc.reference_document_id) if doc.type in ["credit_note", "debit_note"] else None
+
+        parsed_data = doc.parsed_data or {}
+        lines = parsed_data.get("lines", [])
+        customer = parsed_data.get("customer", {})
+
+        t = TicketLayout(self.TICKET_WIDTH_MM, self.MARGIN_MM)
+
+        # ========== ENCABEZADO EMISOR ==========
+        t.extend(self._header_block(ctx))
+
+        # ========== TIPO DE DOCUMENTO ==========
+        t.centered(TYPE_LABELS.get(doc.type, "DOCUMENTO"), FONT_BOLD, 9)
+        t.centered(f"No. {doc.full_number}", FONT_BOLD, 10)
+        fecha_str = doc.issue_date.strftime('%Y-%m-%d %H:%M') if doc.issue_date else ''
+        t.centered(f"Fecha: {fecha_str}", FONT, 8)
+        t.space(2)
+
+        # ========== DATOS DEL CLIENTE ==========
+        t.centered("ADQUIRIENTE", FONT_BOLD, 8)
+        t.space(1)
+        customer_name = customer.get('name', doc.customer_name) or "CONSUMIDOR FINAL"
+        customer_nit = customer.get('identification_number', doc.customer_nit) or ""
+        t.left(f"Cliente: {customer_name}", FONT, 7)
+        t.left(f"NIT/CC: {customer_nit}", FONT, 7)
+        if customer.get('address'):
+            t.left(f"Dir: {customer['address']}", FONT, 6)
+        if customer.get('phone'):
+            t.left(f"Tel: {customer['phone']}", FONT, 6)
+        t.space(2)
+
+        # ========== REFERENCIA FACTURA (solo NC/ND) ==========
+        if doc.type in ["credit_note", "debit_note"]:
+            motivo, discrepancy_desc = discrepancy_reason(doc.type, parsed_data)
+            t.centered("DOCUMENTO DE REFERENCIA", FONT_BOLD, 7)
+            t.space(0.5)
+            if ref_doc:
+                t.left(f"Factura: {ref_doc.full_number}", FONT, 7)
+                if ref_doc.issue_date:
+                    t.left(f"Fecha: {ref_doc.issue_date.strftime('%Y-%m-%d')}", FONT, 7)
+                if ref_doc.cufe:
+                    t.left(f"CUFE: {ref_doc.cufe}", FONT, 5, line_height=2.4)
+            t.left(f"Motivo: {motivo}", FONT, 7)
+            if discrepancy_desc and discrepancy_desc != motivo:
+                t.left(f"Desc: {discrepancy_desc}", FONT, 6)
+            t.space(2)
+
+        # ========== PRODUCTOS ==========
+        t.row([(0, "Cant", "left"), (8, "Descripcion", "left"), (42, "V.Unit", "left"),
+               (55, "Imp", "left"), (None, "Total", "right")], FONT_BOLD, 7)
+        t.space(0.5)
+        desc_width = 33 * MM
+        for line in lines:
+            qty = float(line.get("quantity", 1))
+            tax_label = line_tax_label(int(line.get("tax_id", 1)), float(line.get("tax_percent", 0)))
+            desc_lines = wrap_text(line.get("description", "Producto"), FONT, 7, desc_width)
+            t.row([(0, f"{qty:.0f}", "left"), (8, desc_lines[0], "left"),
+                   (42, f"{float(line.get('unit_price', 0)):,.0f}", "left"), (55, tax_label, "left"),
+                   (None, f"{float(line.get('total', 0)):,.0f}", "right")], FONT, 7, line_height=2.8)
+            # Descripciones largas continúan en las líneas siguientes
+            for extra in desc_lines[1:]:
+                t.row([(8, extra, "left")], FONT, 7, line_height=2.8)
+        t.space(2)
+
+        # ========== TOTAL REGISTROS Y CANTIDADES ==========
+        total_cantidades = sum(float(line.get("quantity", 0)) for line in lines)
+        t.left(f"Total Registros: {len(lines):04d}", FONT, 7)
+        t.left(f"Total Cantidades: {total_cantidades:.0f}", FONT, 7)
+        t.space(2)
+
+        # ========== RESUMEN DE IMPUESTOS ==========
+        tax_summary = summarize_taxes(lines)
+        if tax_summary:
+            t.centered("RESUMEN IMPUESTOS", FONT_BOLD, 7)
+            t.space(0.5)
+            t.row([(0, "Tipo", "left"), (12, "Base", "left"), (35, "%", "left"), (None, "Valor", "right")], FONT_BOLD, 6)
+            for data in tax_summary:
+                t.row([(0, data["name"], "left"), (12, f"{data['base']:,.0f}", "left"),
+                       (35, f"{data['percent']:.0f}%", "left"), (None, f"{data['tax']:,.0f}", "right")], FONT, 6, line_height=2.8)
+            t.space(2)
+
+        # ========== TOTALES ==========
+        t.row([(0, "Subtotal:", "left"), (None, f"${float(doc.subtotal or 0):,.0f}", "right")], FONT, 8)
+        t.row([(0, "Impuestos:", "left"), (None, f"${float(doc.total_tax or 0):,.0f}", "right")], FONT, 8)
+        t.space(1)
+        t.row([(0, "TOTAL:", "left"), (None, f"${float(doc.total or 0):,.0f}", "right")], FONT_BOLD, 10, line_height=3.84)
+
+        # ========== FORMA DE PAGO ==========
+        payment_info = parsed_data.get("payment", {})
+        payment_name = payment_info.get("payment_name", "Contado")
+        forma_pago = "Crédito" if payment_info.get("payment_form_id", 1) == 2 else "Contado"
+        t.left(f"Forma de Pago: {forma_pago} - {payment_name}", FONT, 7)
+        t.space(2)
+
+        # ========== RESOLUCIÓN DIAN ==========
+        t.centered("RESOLUCION DIAN", FONT_BOLD, 7)
+        if resolution:
+            t.centered(f"Resolucion No. {resolution.resolution}", FONT, 6)
+            if resolution.resolution_date:
+                t.centered(f"Fecha: {resolution.resolution_date.strftime('%Y-%m-%d')}", FONT, 6)
+            if resolution.date_from and resolution.date_to:
+                t.centered(f"Vigencia: {resolution.date_from.strftime('%Y-%m-%d')} a {resolution.date_to.strftime('%Y-%m-%d')}", FONT, 5)
+            t.centered(f"Prefijo: {resolution.prefix} del {resolution.from_number} al {resolution.to_number}", FONT, 6)
+        t.space(2)
+
+        # ========== CUFE/CUDE ==========
+        # Mientras la DIAN procesa se usa el código calculado localmente (es determinístico)
+        t.centered("CUFE" if doc.type == "invoice" else "CUDE", FONT_BOLD, 7)
+        cufe = doc.cufe or doc.local_cufe
+        if cufe:
+            t.centered(cufe, FONT, 5)
+            t.space(2)
+
+            qr_url, dian_url = dian_qr_url(settings, cufe)
+            qr = qrcode.QRCode(version=1, box_size=10, border=1)
+            qr.add_data(qr_url)
+            qr.make(fit=True)
+            qr_buffer = BytesIO()
+            qr.make_image(fill_color="black", back_color="white").save(qr_buffer, format='PNG')
+            qr_buffer.seek(0)
+            t.image(ImageReader(qr_buffer), 26)
+            t.centered(f"Consulte en: {dian_url}", FONT, 5)
+        t.space(2)
+
+        # ========== PIE DE PÁGINA ==========
+        t.centered("Representacion grafica de", FONT, 6)
+        t.centered("Factura Electronica", FONT, 6)
+        t.space(1)
+        t.centered("Gracias por su compra!", FONT_BOLD, 8)
+        t.space(3)
+
+        # ========== EMITIDO POR (DATOS DEL EMISOR) ==========
+        company_name = (settings.company_name or "EMPRESA").upper()
+        t.centered(f"Emitido por: {company_name}", FONT, 6)
+        t.centered(f"NIT: {settings.company_nit or ''}-{settings.company_dv or ''}", FONT, 6)
+        t.centered("Modalidad: Software propio", FONT, 6)
+        return t
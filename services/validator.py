@@ -0,0 +1,151 @@
+"""Validación local de reglas DIAN antes de enviar a ApiDian"""
+import re
+from datetime import datetime
+from database import get_session, Resolution, Municipality
+
+# Consumidor final: no tiene dígito de verificación
+FINAL_CONSUMER = "222222222222"
+
+# Diferencia máxima aceptada por redondeo entre totales
+TOLERANCE = 1.0
+
+
+class PayloadValidator:
+    """Revisa el payload ya construido con las reglas que más rechazos causan
+
+    Los errores bloquean el envío (el documento sería rechazado y consumiría
+    un viaje a la DIAN); las advertencias solo se informan.
+    """
+
+    _municipality_ids = None  # Catálogo cacheado (no cambia en ejecución)
+
+    def __init__(self, service):
+        self.service = service
+
+    def validate(self, document, payload: dict) -> dict:
+        """Devolver {"valid", "errors", "warnings"} para el payload del documento"""
+        self.errors = []
+        self.warnings = []
+
+        lines = (payload.get("invoice_lines") or payload.get("credit_note_lines")
+                 or payload.get("debit_note_lines") or [])
+        totals = payload.get("legal_monetary_totals") or payload.get("requested_monetary_totals") or {}
+
+        self._check_lines(lines)
+        self._check_totals(lines, totals, payload.get("tax_totals") or [])
+        if "seller" in payload:
+            self._check_party(payload["seller"], "proveedor", require_address=True)
+        if "customer" in payload:
+            self._check_party(payload["customer"], "cliente")
+        self._check_resolution(payload)
+
+        return {"valid": not self.errors, "errors": self.errors, "warnings": self.warnings}
+
+    def _check_lines(self, lines: list):
+        if not lines:
+            self.errors.append("El documento no tiene líneas")
+            return
+        for i, line in enumerate(lines, start=1):
+            if _amount(line.get("invoiced_quantity")) <= 0:
+                self.errors.append(f"Línea {i}: la cantidad debe ser mayor que cero")
+            if not str(line.get("description") or "").strip():
+                self.errors.append(f"Línea {i}: falta la descripción")
+
+    def _check_totals(self, lines: list, totals: dict, tax_totals: list):
+        """Consistencia entre líneas, impuestos y totales monetarios"""
+        if not totals:
+            self.errors.append("Faltan los totales monetarios")
+            return
+
+        lines_sum = sum(_amount(line.get("line_extension_amount")) for line in lines)
+        line_extension = _amount(totals.get("line_extension_amount"))
+        if abs(lines_sum - line_extension) > TOLERANCE:
+            self.errors.append(
+                f"La suma de las líneas ({lines_sum:,.2f}) no coincide con el subtotal ({line_extension:,.2f})")
+
+        tax_sum = sum(_amount(tax.get("tax_amount")) for tax in tax_totals)
+        declared_tax = _amount(totals.get("tax_inclusive_amount")) - _amount(totals.get("tax_exclusive_amount"))
+        if abs(tax_sum - declared_tax) > TOLERANCE:
+            self.errors.append(
+                f"Los impuestos ({tax_sum:,.2f}) no coinciden con los totales ({declared_tax:,.2f})")
+
+        for tax in tax_totals:
+            expected = _amount(tax.get("taxable_amount")) * _amount(tax.get("percent")) / 100
+            if abs(expected - _amount(tax.get("tax_amount"))) > TOLERANCE:
+                self.warnings.append(
+                    f"Impuesto {tax.get('tax_id')} al {tax.get('percent')}%: valor {_amount(tax.get('tax_amount')):,.2f}, "
+                    f"esperado {expected:,.2f}")
+
+        payable = _amount(totals.get("payable_amount"))
+        if payable <= 0 and lines_sum > 0:
+            self.errors.append("El total a pagar debe ser mayor que cero")
+
+    def _check_party(self, party: dict, label: str, require_address: bool = False):
+        """Campos obligatorios, DV y municipio del adquiriente/proveedor"""
+        number = re.sub(r"[^0-9]", "", str(party.get("identification_number") or ""))
+        if not number or int(number) == 0:
+            self.errors.append(f"Falta el número de identificación del {label}")
+        elif number != FINAL_CONSUMER and party.get("dv") not in (None, ""):
+            expected_dv = self.service._calculate_dv(number)
+            if str(party.get("dv")) != expected_dv:
+                self.errors.append(
+                    f"DV inválido para el NIT {number} del {label}: {party.get('dv')} (debe ser {expected_dv})")
+
+        if not str(party.get("name") or "").strip():
+            self.errors.append(f"Falta el nombre del {label}")
+        if require_address and not str(party.get("address") or "").strip():
+            self.errors.append(f"Falta la dirección del {label}")
+
+        email = str(party.get("email") or "").strip()
+        if email and not re.match(r"^[^@\s]+@[^@\s]+\.[^@\s]+$", email):
+            self.warnings.append(f"Correo del {label} con formato inválido: {email}")
+
+        municipality_id = party.get("municipality_id")
+        municipalities = self._get_municipality_ids()
+        if municipalities and municipality_id and int(municipality_id) not in municipalities:
+            self.errors.append(f"Municipio {municipality_id} del {label} no existe en el catálogo")
+
+    def _check_resolution(self, payload: dict):
+        """Número dentro del rango y resolución vigente"""
+        type_document_id = payload.get("type_document_id")
+        prefix = payload.get("prefix")
+        number = payload.get("number")
+
+        session = get_session()
+        resolution = session.query(Resolution).filter(
+            Resolution.type_document_id == type_document_id,
+            Resolution.prefix == prefix,
+        ).order_by(Resolution.is_active.desc()).first()
+        session.close()
+
+        if not resolution:
+            self.warnings.append(f"No hay resolución local para el prefijo {prefix}")
+            return
+
+        if resolution.from_number is not None and resolution.to_number is not None and number is not None:
+            if not resolution.from_number <= int(number) <= resolution.to_number:
+                self.errors.append(
+                    f"El número {prefix}{number} está fuera del rango autorizado "
+                    f"({resolution.from_number} - {resolution.to_number})")
+
+        today = datetime.now().date()
+        if resolution.date_to and resolution.date_to.date() < today:
+            self.errors.append(f"La resolución {resolution.resolution} venció el {resolution.date_to.strftime('%Y-%m-%d')}")
+        if resolution.date_from and resolution.date_from.date() > today:
+            self.errors.append(
+                f"La resolución {resolution.resolution} rige desde el {resolution.date_from.strftime('%Y-%m-%d')}")
+
+    @classmethod
+    def _get_municipality_ids(cls) -> set:
+        if cls._municipality_ids is None:
+            session = get_session()
+            cls._municipality_ids = {row[0] for row in session.query(Municipality.id)}
+            session.close()
+        return cls._municipality_ids
+
+
+def _amount(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
@@ -1,6 +1,10 @@
 """Parser de XMLs de Siigo"""
+import logging
 import xml.etree.ElementTree as ET
 from typing import Optional
+from services.metrics import timed
+
+logger = logging.getLogger(__name__)
 
 
 class SiigoXmlParser:
@@ -36,9 +40,10 @@ class SiigoXmlParser:
             
             return self.parse(xml_content, file_path)
         except Exception as e:
-            print(f"Error parsing XML file: {e}")
+            logger.error("Error leyendo el XML %s: %s", file_path, e)
             return None
     
+    @timed("parse")
     def parse(self, xml_content: str, filename: str = "") -> Optional[dict]:
         """Parsear contenido XML de Siigo"""
         try:
@@ -70,9 +75,7 @@ class SiigoXmlParser:
             return self._build_document_data(xml_content, filename)
             
         except Exception as e:
-            print(f"Error parsing XML: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error parseando el XML %s: %s", filename, e)
             return None
     
     def _parse_company_data(self, root):
@@ -0,0 +1,36 @@
+"""Empaquetado de archivos ZIP en memoria"""
+import io
+import os
+import zipfile
+from typing import Iterable, Tuple, Union
+
+# Formatos ya comprimidos: se guardan sin recomprimir (ZIP_STORED)
+STORED_EXTENSIONS = {".pdf", ".zip", ".png", ".jpg", ".jpeg", ".gif", ".gz"}
+
+
+def compression_for(filename: str) -> int:
+    """Método de compresión según la extensión del archivo"""
+    ext = os.path.splitext(filename or "")[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def build_zip(entries: Iterable[Tuple[str, Union[str, bytes]]]) -> bytes:
+    """Construir un ZIP en memoria y devolver sus bytes
+
+    Cada entrada es (nombre en el ZIP, contenido), donde el contenido son bytes
+    o la ruta (str) de un archivo en disco, p. ej. de la caché de artefactos.
+    """
+    buffer = io.BytesIO()
+    write_zip(buffer, entries)
+    return buffer.getvalue()
+
+
+def write_zip(target, entries: Iterable[Tuple[str, Union[str, bytes]]]):
+    """Escribir entradas en un ZIP sobre un archivo o buffer ya abierto (exportaciones masivas)"""
+    with zipfile.ZipFile(target, "w") as zipf:
+        for arcname, content in entries:
+            compress_type = compression_for(arcname)
+            if isinstance(content, str):
+                zipf.write(content, arcname, compress_type=compress_type)
+            else:
+                zipf.writestr(arcname, content, compress_type=compress_type)
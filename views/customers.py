@@ -5,6 +5,7 @@ from database import (
     TypeDocumentIdentification, TypeOrganization, TypeRegime,
     TypeLiability, Department, Municipality
 )
+from services.sql_monitor import sql_action
 from views.theme import COLORS, button, text_field, dropdown, section_title, divider, snackbar
 
 
@@ -29,6 +30,7 @@ class CustomersView:
         self.catalogs["municipalities"] = session.query(Municipality).all()
         session.close()
 
+    @sql_action
     def _load_customers(self):
         session = get_session()
         query = session.query(Customer)
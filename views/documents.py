@@ -1,8 +1,11 @@
 """Vista de documentos"""
 import flet as ft
 from datetime import datetime, date, timedelta
-from database import get_session, Document, Resolution
-from services import ApiDianService, FolderWatcherService
+from database import get_session, Document, DocumentResponse, Resolution
+from services import ApiDianService, FolderWatcherService, EmailOutboxService
+from services.ticket_printer import TicketPrinter
+from services.profiling import profiled
+from services.sql_monitor import sql_action
 from views.theme import COLORS, button, status_badge, type_badge, snackbar, dropdown, text_field
 
 
@@ -18,6 +21,12 @@ class DocumentsView:
         self.date_filter = "all"  # all, today, week, month, year, custom
         self.date_from = None
         self.date_to = None
+        self.selected_ids = set()  # Documentos seleccionados para impresión en lote
+        self.page_sent_ids = []
+        self.email_states = {}  # Estado del outbox de correo por documento de la página
+        self.outbox_status = ft.Text("", size=12)
+        self.outbox_indicator = ft.Container(content=self.outbox_status, visible=False,
+                                             padding=ft.padding.symmetric(horizontal=8))
         self.documents_list = ft.ListView(expand=True, spacing=1)
         self.pagination_info = ft.Text("", size=12, color=COLORS["text_secondary"])
         self.search_field = ft.TextField(
@@ -75,8 +84,11 @@ class DocumentsView:
             self.search_field,
             self.date_dropdown,
             ft.Container(expand=True),
+            self.outbox_indicator,
             ft.IconButton(icon=ft.Icons.FOLDER_OPEN, icon_color=COLORS["primary"], tooltip="Escanear carpeta", icon_size=22, on_click=self._scan_folder),
             ft.IconButton(icon=ft.Icons.SEND, icon_color=COLORS["success"], tooltip="Enviar Pendientes", icon_size=22, on_click=self._send_pending),
+            ft.IconButton(icon=ft.Icons.PRINT, icon_color="#ec4899", tooltip="Imprimir tickets seleccionados", icon_size=22, on_click=self._print_selected),
+            ft.IconButton(icon=ft.Icons.MARK_EMAIL_UNREAD, icon_color="#8b5cf6", tooltip="Enviar correos pendientes", icon_size=22, on_click=self._send_pending_emails),
             ft.IconButton(icon=ft.Icons.REFRESH, icon_color=COLORS["info"], tooltip="Actualizar", icon_size=22, on_click=self._refresh),
             ft.Container(width=10),
         ], spacing=4, vertical_alignment=ft.CrossAxisAlignment.CENTER)
@@ -117,6 +129,32 @@ class DocumentsView:
         )
         return self.pagination_container
 
+    def _update_outbox_indicator(self, summary: dict):
+        """Correos en cola y con error (el último error queda en el tooltip)"""
+        parts = []
+        if summary["queued"]:
+            parts.append(f"{summary['queued']} en cola")
+        if summary["errors"]:
+            parts.append(f"{summary['errors']} con error")
+        self.outbox_indicator.visible = bool(parts)
+        self.outbox_status.value = "Correo: " + ", ".join(parts) if parts else ""
+        self.outbox_status.color = COLORS["danger"] if summary["errors"] else COLORS["text_secondary"]
+        self.outbox_indicator.tooltip = f"Último error: {summary['last_error']}" if summary["last_error"] else None
+
+    def _email_state(self, doc: Document) -> tuple:
+        """Color y tooltip del botón de correo según el documento y su mensaje en el outbox"""
+        if doc.email_sent:
+            return "#10b981", "Email enviado ✓"
+        state = self.email_states.get(doc.id)
+        if state and state["status"] in ("pending", "sending"):
+            tooltip = "Correo en cola"
+            if state["last_error"]:
+                tooltip += f" (reintento {state['attempts'] + 1}): {state['last_error']}"
+            return COLORS["warning"], tooltip
+        if state and state["status"] == "error":
+            return COLORS["danger"], f"Error de correo: {state['last_error'] or 'desconocido'} (clic para reintentar)"
+        return "#8b5cf6", "Enviar Email"
+
     def _go_to_page(self, page: int):
         """Ir a una página específica"""
         if 1 <= page <= self.total_pages and page != self.current_page:
@@ -242,6 +280,8 @@ class DocumentsView:
         dlg.open = True
         self.page.update()
 
+    @sql_action
+    @profiled("load_documents")
     def _load_documents(self):
         session = get_session()
         query = session.query(Document)
@@ -293,9 +333,17 @@ class DocumentsView:
         end = min(offset + self.per_page, self.total_docs)
         self.pagination_info.value = f"{start}-{end} de {self.total_docs}"
         
+        self.page_sent_ids = [doc.id for doc in docs if doc.status == "sent"]
+        outbox = EmailOutboxService()
+        self.email_states = outbox.states_for([doc.id for doc in docs if doc.status == "sent" and not doc.email_sent])
+        self._update_outbox_indicator(outbox.status_summary())
+        all_selected = bool(self.page_sent_ids) and all(doc_id in self.selected_ids for doc_id in self.page_sent_ids)
+        
         self.documents_list.controls.clear()
         header = ft.Container(
             content=ft.Row([
+                ft.Container(content=ft.Checkbox(value=all_selected, on_change=self._on_select_page,
+                    disabled=not self.page_sent_ids, tooltip="Seleccionar enviados"), width=30),
                 ft.Text("Número", width=130, weight=ft.FontWeight.W_600, color=COLORS["text_secondary"], size=12),
                 ft.Text("Tipo", width=90, weight=ft.FontWeight.W_600, color=COLORS["text_secondary"], size=12),
                 ft.Text("Cliente", width=280, weight=ft.FontWeight.W_600, color=COLORS["text_secondary"], size=12),
@@ -323,13 +371,16 @@ class DocumentsView:
                 on_click=lambda e, d=doc: self._send_document(d)))
             actions.append(ft.IconButton(icon=ft.Icons.DELETE, icon_color=COLORS["danger"], tooltip="Eliminar", icon_size=20,
                 on_click=lambda e, d=doc: self._delete_document(d)))
+            if doc.error_message:
+                # Avisos de la validación al importar: no bloquean, se revalida al enviar
+                actions.append(ft.IconButton(icon=ft.Icons.WARNING_AMBER, icon_color=COLORS["warning"],
+                    tooltip=doc.error_message[:200], icon_size=20, on_click=lambda e, d=doc: self._show_error_dialog(d)))
         if doc.status == "sent":
             # PDF: verde si ya se descargó, rojo si no
             pdf_color = "#10b981" if doc.pdf_downloaded else "#ef4444"
             pdf_tooltip = "PDF descargado ✓" if doc.pdf_downloaded else "Descargar PDF"
             # Email: verde si ya se envió, violeta si no
-            email_color = "#10b981" if doc.email_sent else "#8b5cf6"
-            email_tooltip = "Email enviado ✓" if doc.email_sent else "Enviar Email"
+            email_color, email_tooltip = self._email_state(doc)
             
             actions.extend([
                 ft.IconButton(icon=ft.Icons.PICTURE_AS_PDF, icon_color=pdf_color, tooltip=pdf_tooltip, icon_size=20,
@@ -346,6 +397,10 @@ class DocumentsView:
                     ft.IconButton(icon=ft.Icons.ADD_CIRCLE, icon_color="#06b6d4", tooltip="Crear Nota Débito", icon_size=20,
                         on_click=lambda e, d=doc: self._show_nd_dialog(d)),
                 ])
+        if doc.status == "processing" and doc.local_cufe:
+            # Ticket anticipado con el CUFE calculado localmente
+            actions.append(ft.IconButton(icon=ft.Icons.PRINT, icon_color="#ec4899", tooltip="Imprimir Ticket 80mm", icon_size=20,
+                on_click=lambda e, d=doc: self._print_ticket(d)))
         if doc.status == "error":
             actions.extend([
                 ft.IconButton(icon=ft.Icons.REFRESH, icon_color=COLORS["warning"], tooltip="Reintentar envío", icon_size=20,
@@ -360,8 +415,14 @@ class DocumentsView:
                 ft.IconButton(icon=ft.Icons.ERROR_OUTLINE, icon_color=COLORS["danger"], tooltip="Ver rechazo DIAN", icon_size=20,
                     on_click=lambda e, d=doc: self._show_error_dialog(d)),
             ])
+        # Solo los documentos enviados se pueden imprimir en lote
+        if doc.status == "sent":
+            select = ft.Checkbox(value=doc.id in self.selected_ids, on_change=lambda e, i=doc.id: self._on_select(e, i))
+        else:
+            select = None
         return ft.Container(
             content=ft.Row([
+                ft.Container(content=select, width=30),
                 ft.Text(doc.full_number or "", width=130, 
                        color="#ef4444" if getattr(doc, 'is_nullified', False) else COLORS["text_primary"], 
                        size=13,
@@ -401,6 +462,7 @@ class DocumentsView:
             session = get_session()
             d = session.query(Document).get(doc.id)
             if d and d.status == "pending":
+                session.query(DocumentResponse).filter(DocumentResponse.document_id == d.id).delete()
                 session.delete(d)
                 session.commit()
                 snackbar(self.page, f"Documento {doc.full_number} eliminado", "success")
@@ -449,7 +511,7 @@ class DocumentsView:
 
     def _show_error_dialog(self, doc: Document):
         """Mostrar diálogo con detalles del error o rechazo DIAN"""
-        import json
+        import json_codec
         
         error_msg = doc.error_message or "Sin mensaje de error"
         api_response = doc.api_response or {}
@@ -461,15 +523,17 @@ class DocumentsView:
             if "message" in api_response:
                 error_details += f"Mensaje: {api_response['message']}\n"
             if "errors" in api_response:
-                error_details += f"Errores: {json.dumps(api_response['errors'], indent=2, ensure_ascii=False)}\n"
+                error_details += f"Errores: {json_codec.pretty(api_response['errors'])}\n"
             if "ResponseDian" in api_response:
                 dian_response = api_response.get("ResponseDian", {})
                 if isinstance(dian_response, dict):
-                    error_details += f"\nRespuesta DIAN:\n{json.dumps(dian_response, indent=2, ensure_ascii=False)}"
+                    error_details += f"\nRespuesta DIAN:\n{json_codec.pretty(dian_response)}"
         
         # Título según el tipo de error
         title_text = f"Rechazado por DIAN - {doc.full_number}" if is_rejected else f"Error en {doc.full_number}"
         title_icon = ft.Icons.BLOCK if is_rejected else ft.Icons.ERROR
+        if doc.status == "pending":
+            title_text, title_icon = f"Avisos de validación - {doc.full_number}", ft.Icons.WARNING_AMBER
         
         dlg = ft.AlertDialog(
             title=ft.Row([
@@ -582,14 +646,28 @@ class DocumentsView:
         for doc in pending:
             self._send_document(doc)
 
+    def _send_pending_emails(self, e):
+        """Encolar el correo de todos los documentos enviados que aún no lo tienen"""
+        config_error = EmailOutboxService.config_error(ApiDianService().settings)
+        if config_error:
+            snackbar(self.page, config_error, "danger")
+            return
+        count = EmailOutboxService().enqueue_unsent()
+        if count:
+            snackbar(self.page, f"{count} correos en cola de envío", "success")
+        else:
+            snackbar(self.page, "No hay correos pendientes por enviar", "warning")
+        self._load_documents()
+
     def _download_pdf(self, doc: Document):
         service = ApiDianService()
         result = service.download_pdf(doc)
         if result.get("success"):
             import os
+            import shutil
             filepath = os.path.join(os.path.expanduser("~/Downloads"), f"{doc.full_number}.pdf")
-            with open(filepath, "wb") as f:
-                f.write(result["content"])
+            # Copiar desde la caché local de artefactos
+            shutil.copyfile(result["path"], filepath)
             # Marcar como descargado
             session = get_session()
             d = session.query(Document).get(doc.id)
@@ -639,28 +717,13 @@ class DocumentsView:
                 session.commit()
             session.close()
             
-            # Recargar documento con email actualizado
-            session = get_session()
-            updated_doc = session.query(Document).get(doc_id)
-            session.close()
-            
-            # Enviar email
-            service = ApiDianService()
-            result = service.send_email(updated_doc)
+            # Encolar el correo: se envía en segundo plano reutilizando la conexión SMTP
+            result = EmailOutboxService().enqueue(doc_id, new_email)
             
             if result.get("success"):
-                # Marcar como enviado
-                session = get_session()
-                d = session.query(Document).get(doc_id)
-                d.email_sent = True
-                d.email_sent_at = datetime.now()
-                session.commit()
-                session.close()
-                
                 dlg.open = False
                 self.page.update()
-                snackbar(self.page, result.get("message", "Correo enviado"), "success")
-                self._load_documents()
+                snackbar(self.page, result.get("message", "Correo en cola"), "success")
             else:
                 snackbar(self.page, f"Error: {result.get('message')}", "danger")
         
@@ -1046,7 +1109,7 @@ class DocumentsView:
 
     def _show_details_dialog(self, doc: Document):
         """Mostrar diálogo con detalles del documento"""
-        import json
+        import json_codec
         
         parsed_data = doc.parsed_data or {}
         lines = parsed_data.get("lines", [])
@@ -1094,6 +1157,27 @@ class DocumentsView:
             column_spacing=15,
         )
         
+        response_field = ft.TextField(
+            value=json_codec.pretty(api_response) if api_response else "Sin respuesta",
+            multiline=True, read_only=True, min_lines=8, max_lines=12,
+            text_size=10, bgcolor=COLORS["bg_secondary"],
+            border_color=COLORS["border"], color=COLORS["text_primary"],
+        )
+        
+        def load_full_response(e):
+            # La respuesta completa (sobre SOAP y adjuntos) se carga solo a pedido
+            from services.response_store import load_full_response as load_full
+            full_response = load_full(doc)
+            response_field.value = json_codec.pretty(full_response) if full_response else "Sin respuesta"
+            e.control.visible = False
+            self.page.update()
+        
+        full_response_btn = ft.TextButton(
+            "Ver respuesta completa", icon=ft.Icons.UNFOLD_MORE,
+            visible=bool(api_response.get("full_response_stored")),
+            on_click=load_full_response,
+        )
+        
         # Tabs para información
         tabs = ft.Tabs(
             selected_index=0,
@@ -1124,13 +1208,11 @@ class DocumentsView:
                         content=ft.Column([
                             ft.Text(f"CUFE: {doc.cufe or 'N/A'}", color=COLORS["text_primary"], selectable=True, size=11),
                             ft.Divider(color=COLORS["border"]),
-                            ft.Text("Respuesta API:", weight=ft.FontWeight.W_600, color=COLORS["text_secondary"], size=12),
-                            ft.TextField(
-                                value=json.dumps(api_response, indent=2, ensure_ascii=False) if api_response else "Sin respuesta",
-                                multiline=True, read_only=True, min_lines=8, max_lines=12,
-                                text_size=10, bgcolor=COLORS["bg_secondary"],
-                                border_color=COLORS["border"], color=COLORS["text_primary"],
-                            ),
+                            ft.Row([
+                                ft.Text("Respuesta API:", weight=ft.FontWeight.W_600, color=COLORS["text_secondary"], size=12),
+                                full_response_btn,
+                            ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+                            response_field,
                         ], spacing=8, scroll=ft.ScrollMode.AUTO),
                         padding=10, height=250,
                     ),
@@ -1175,403 +1257,46 @@ class DocumentsView:
 
     def _print_ticket(self, doc: Document):
         """Generar e imprimir ticket 80mm en PDF con todos los datos reglamentarios DIAN"""
-        import os
-        from io import BytesIO
-        
-        try:
-            import qrcode
-            from reportlab.lib.units import mm as mm_unit
-            from reportlab.pdfgen import canvas
-            from reportlab.lib.utils import ImageReader
-            from reportlab.pdfbase import pdfmetrics
-            from reportlab.pdfbase.ttfonts import TTFont
-        except ImportError:
-            snackbar(self.page, "Instale: pip install qrcode reportlab", "danger")
+        self._print_tickets([doc])
+
+    def _print_tickets(self, docs: list):
+        """Imprimir varios tickets en un solo PDF (un trabajo de impresión)"""
+        result = TicketPrinter().print_documents(docs)
+        if result.get("success"):
+            snackbar(self.page, result.get("message", "Tickets generados"), "success")
+        else:
+            snackbar(self.page, result.get("message", "Error al generar tickets"), "danger")
+
+    def _print_selected(self, e):
+        """Imprimir los tickets de los documentos seleccionados"""
+        if not self.selected_ids:
+            snackbar(self.page, "Seleccione los documentos a imprimir", "warning")
             return
-        
-        # Obtener configuración de empresa y resolución
-        from database import Settings, Municipality, Department
         session = get_session()
-        settings = session.query(Settings).first()
-        resolution = session.query(Resolution).filter(
-            Resolution.type_document_id == doc.type_document_id,
-            Resolution.prefix == doc.prefix
-        ).first()
-        
-        # Obtener municipio y departamento del emisor
-        municipality = session.query(Municipality).get(settings.municipality_id) if settings and settings.municipality_id else None
-        department = session.query(Department).get(settings.department_id) if settings and settings.department_id else None
-        
-        # Obtener documento de referencia si es NC/ND
-        ref_doc = None
-        if doc.type in ["credit_note", "debit_note"] and doc.reference_document_id:
-            ref_doc = session.query(Document).get(doc.reference_document_id)
-        
+        docs = session.query(Document).filter(
+            Document.id.in_(self.selected_ids), Document.status == "sent"
+        ).order_by(Document.id).all()
         session.close()
-        
-        parsed_data = doc.parsed_data or {}
-        lines = parsed_data.get("lines", [])
-        customer = parsed_data.get("customer", {})
-        
-        # Tamaño del ticket: 80mm de ancho
-        TICKET_WIDTH = 80 * mm_unit
-        LINE_HEIGHT = 3.2 * mm_unit
-        SMALL_LINE = 2.8 * mm_unit
-        MARGIN = 2 * mm_unit
-        
-        # Calcular altura estimada del ticket
-        num_lines = len(lines)
-        estimated_height = (220 + (num_lines * 12)) * mm_unit
-        
-        # Crear PDF
-        downloads_path = os.path.expanduser("~/Downloads")
-        pdf_path = os.path.join(downloads_path, f"ticket_{doc.full_number}.pdf")
-        
-        c = canvas.Canvas(pdf_path, pagesize=(TICKET_WIDTH, estimated_height))
-        
-        # Usar fuente Courier (monoespaciada, más compacta)
-        FONT = "Courier"
-        FONT_BOLD = "Courier-Bold"
-        
-        y = estimated_height - MARGIN * 2
-        
-        def draw_centered(text, font_name=FONT, font_size=8):
-            nonlocal y
-            c.setFont(font_name, font_size)
-            text_width = c.stringWidth(text, font_name, font_size)
-            c.drawString((TICKET_WIDTH - text_width) / 2, y, text)
-            y -= LINE_HEIGHT
-        
-        def draw_left(text, font_name=FONT, font_size=7):
-            nonlocal y
-            c.setFont(font_name, font_size)
-            c.drawString(MARGIN, y, text)
-            y -= LINE_HEIGHT
-        
-        def space(h=1.5):
-            nonlocal y
-            y -= h * mm_unit
-        
-        # ========== ENCABEZADO EMISOR ==========
-        company_name = (settings.company_name or "EMPRESA").upper()
-        company_nit = settings.company_nit or ""
-        company_dv = settings.company_dv or ""
-        company_address = settings.company_address or ""
-        company_phone = settings.company_phone or ""
-        company_email = settings.company_email or ""
-        
-        draw_centered(company_name, FONT_BOLD, 10)
-        draw_centered(f"NIT: {company_nit}-{company_dv}", FONT_BOLD, 9)
-        regime_text = "RESPONSABLE DE IVA" if settings and settings.type_regime_id == 1 else "NO RESPONSABLE DE IVA"
-        draw_centered(regime_text, FONT, 7)
-        if company_address:
-            draw_centered(company_address[:45], FONT, 7)
-        # Municipio y Departamento del emisor
-        if municipality and department:
-            draw_centered(f"{municipality.name} - {department.name}", FONT, 7)
-        if company_phone:
-            draw_centered(f"Tel: {company_phone}", FONT, 7)
-        if company_email:
-            draw_centered(company_email[:42], FONT, 6)
-        
-        space(2)
-        
-        # ========== TIPO DE DOCUMENTO ==========
-        type_labels = {
-            "invoice": "FACTURA ELECTRONICA DE VENTA",
-            "credit_note": "NOTA CREDITO ELECTRONICA", 
-            "debit_note": "NOTA DEBITO ELECTRONICA"
-        }
-        draw_centered(type_labels.get(doc.type, "DOCUMENTO"), FONT_BOLD, 9)
-        draw_centered(f"No. {doc.full_number}", FONT_BOLD, 10)
-        fecha_str = doc.issue_date.strftime('%Y-%m-%d %H:%M') if doc.issue_date else ''
-        draw_centered(f"Fecha: {fecha_str}", FONT, 8)
-        
-        space(2)
-        
-        # ========== DATOS DEL CLIENTE ==========
-        draw_centered("ADQUIRIENTE", FONT_BOLD, 8)
-        space(1)
-        customer_name = customer.get('name', doc.customer_name) or "CONSUMIDOR FINAL"
-        customer_nit = customer.get('identification_number', doc.customer_nit) or ""
-        customer_address = customer.get('address', '') or ""
-        customer_phone_c = customer.get('phone', '') or ""
-        
-        draw_left(f"Cliente: {customer_name[:38]}", FONT, 7)
-        draw_left(f"NIT/CC: {customer_nit}", FONT, 7)
-        if customer_address:
-            draw_left(f"Dir: {customer_address[:40]}", FONT, 6)
-        if customer_phone_c:
-            draw_left(f"Tel: {customer_phone_c}", FONT, 6)
-        
-        space(2)
-        
-        # ========== REFERENCIA FACTURA (solo NC/ND) ==========
-        if doc.type in ["credit_note", "debit_note"]:
-            discrepancy_code = parsed_data.get("discrepancy_code", "")
-            discrepancy_desc = parsed_data.get("discrepancy_description", "")
-            
-            # Motivos NC
-            nc_motivos = {
-                "1": "Devolucion parcial",
-                "2": "Anulacion de factura",
-                "3": "Rebaja o descuento",
-                "4": "Ajuste de precio",
-                "5": "Otros"
-            }
-            # Motivos ND
-            nd_motivos = {
-                "1": "Intereses",
-                "2": "Gastos por cobrar",
-                "3": "Cambio del valor",
-                "4": "Otros"
-            }
-            
-            if doc.type == "credit_note":
-                motivo = nc_motivos.get(str(discrepancy_code), discrepancy_desc or "N/A")
-            else:
-                motivo = nd_motivos.get(str(discrepancy_code), discrepancy_desc or "N/A")
-            
-            draw_centered("DOCUMENTO DE REFERENCIA", FONT_BOLD, 7)
-            space(0.5)
-            if ref_doc:
-                draw_left(f"Factura: {ref_doc.full_number}", FONT, 7)
-                if ref_doc.issue_date:
-                    draw_left(f"Fecha: {ref_doc.issue_date.strftime('%Y-%m-%d')}", FONT, 7)
-                if ref_doc.cufe:
-                    draw_left(f"CUFE: {ref_doc.cufe[:40]}...", FONT, 5)
-            draw_left(f"Motivo: {motivo[:40]}", FONT, 7)
-            if discrepancy_desc and discrepancy_desc != motivo:
-                draw_left(f"Desc: {discrepancy_desc[:42]}", FONT, 6)
-            
-            space(2)
-        
-        # ========== PRODUCTOS - ENCABEZADO ==========
-        c.setFont(FONT_BOLD, 7)
-        c.drawString(MARGIN, y, "Cant")
-        c.drawString(MARGIN + 8*mm_unit, y, "Descripcion")
-        c.drawString(MARGIN + 42*mm_unit, y, "V.Unit")
-        c.drawString(MARGIN + 55*mm_unit, y, "Imp")
-        c.drawRightString(TICKET_WIDTH - MARGIN, y, "Total")
-        y -= LINE_HEIGHT
-        space(0.5)
-        
-        # ========== PRODUCTOS - DETALLE ==========
-        for line in lines:
-            desc = line.get("description", "Producto")[:22]
-            qty = float(line.get("quantity", 1))
-            unit_price = float(line.get("unit_price", 0))
-            total_line = float(line.get("total", 0))
-            tax_id = int(line.get("tax_id", 1))
-            tax_pct = float(line.get("tax_percent", 0))
-            
-            # Determinar etiqueta de impuesto
-            if tax_pct == 0:
-                tax_label = "Exc"
-            elif tax_id == 4:
-                tax_label = f"IC{tax_pct:.0f}"
-            else:
-                tax_label = f"{tax_pct:.0f}%"
-            
-            c.setFont(FONT, 7)
-            c.drawString(MARGIN, y, f"{qty:.0f}")
-            c.drawString(MARGIN + 8*mm_unit, y, desc)
-            c.drawString(MARGIN + 42*mm_unit, y, f"{unit_price:,.0f}")
-            c.drawString(MARGIN + 55*mm_unit, y, tax_label)
-            c.drawRightString(TICKET_WIDTH - MARGIN, y, f"{total_line:,.0f}")
-            y -= SMALL_LINE
-        
-        space(2)
-        
-        # ========== TOTAL REGISTROS Y CANTIDADES ==========
-        total_registros = len(lines)
-        total_cantidades = sum(float(line.get("quantity", 0)) for line in lines)
-        
-        c.setFont(FONT, 7)
-        c.drawString(MARGIN, y, f"Total Registros: {total_registros:04d}")
-        y -= LINE_HEIGHT
-        c.drawString(MARGIN, y, f"Total Cantidades: {total_cantidades:.0f}")
-        y -= LINE_HEIGHT
-        
-        space(2)
-        
-        # ========== RESUMEN DE IMPUESTOS ==========
-        # Agrupar por (tax_id, porcentaje)
-        # tax_id: 1=IVA, 4=INC (Impuesto al Consumo)
-        tax_summary = {}
-        for line in lines:
-            tax_id = int(line.get("tax_id", 1))
-            tax_pct = float(line.get("tax_percent", 0))
-            base = float(line.get("total", 0))
-            tax_amt = float(line.get("tax_amount", 0))
-            if tax_amt == 0 and tax_pct > 0:
-                tax_amt = base * (tax_pct / 100)
-            
-            key = f"{tax_id}_{tax_pct}"
-            if key not in tax_summary:
-                tax_summary[key] = {"tax_id": tax_id, "percent": tax_pct, "base": 0, "tax": 0}
-            tax_summary[key]["base"] += base
-            tax_summary[key]["tax"] += tax_amt
-        
-        if tax_summary:
-            draw_centered("RESUMEN IMPUESTOS", FONT_BOLD, 7)
-            space(0.5)
-            # Encabezado
-            c.setFont(FONT_BOLD, 6)
-            c.drawString(MARGIN, y, "Tipo")
-            c.drawString(MARGIN + 12*mm_unit, y, "Base")
-            c.drawString(MARGIN + 35*mm_unit, y, "%")
-            c.drawRightString(TICKET_WIDTH - MARGIN, y, "Valor")
-            y -= LINE_HEIGHT
-            
-            # Detalle por cada tipo de impuesto
-            for key in sorted(tax_summary.keys()):
-                data = tax_summary[key]
-                tax_id = data["tax_id"]
-                tax_pct = data["percent"]
-                
-                # Determinar nombre del impuesto
-                if tax_pct == 0:
-                    tax_name = "Excluido"
-                elif tax_id == 4:
-                    tax_name = "INC"
-                else:
-                    tax_name = "IVA"
-                
-                c.setFont(FONT, 6)
-                c.drawString(MARGIN, y, tax_name)
-                c.drawString(MARGIN + 12*mm_unit, y, f"{data['base']:,.0f}")
-                c.drawString(MARGIN + 35*mm_unit, y, f"{tax_pct:.0f}%")
-                c.drawRightString(TICKET_WIDTH - MARGIN, y, f"{data['tax']:,.0f}")
-                y -= SMALL_LINE
-            
-            space(2)
-        
-        # ========== TOTALES ==========
-        subtotal = float(doc.subtotal or 0)
-        total_tax = float(doc.total_tax or 0)
-        total = float(doc.total or 0)
-        
-        c.setFont(FONT, 8)
-        c.drawString(MARGIN, y, "Subtotal:")
-        c.drawRightString(TICKET_WIDTH - MARGIN, y, f"${subtotal:,.0f}")
-        y -= LINE_HEIGHT
-        
-        c.drawString(MARGIN, y, "Impuestos:")
-        c.drawRightString(TICKET_WIDTH - MARGIN, y, f"${total_tax:,.0f}")
-        y -= LINE_HEIGHT
-        
-        space(1)
-        c.setFont(FONT_BOLD, 10)
-        c.drawString(MARGIN, y, "TOTAL:")
-        c.drawRightString(TICKET_WIDTH - MARGIN, y, f"${total:,.0f}")
-        y -= LINE_HEIGHT * 1.2
-        
-        # ========== FORMA DE PAGO ==========
-        payment_info = parsed_data.get("payment", {})
-        payment_name = payment_info.get("payment_name", "Contado")
-        payment_form_id = payment_info.get("payment_form_id", 1)
-        forma_pago = "Crédito" if payment_form_id == 2 else "Contado"
-        
-        c.setFont(FONT, 7)
-        c.drawString(MARGIN, y, f"Forma de Pago: {forma_pago} - {payment_name}")
-        y -= LINE_HEIGHT
-        
-        space(2)
-        
-        # ========== RESOLUCIÓN DIAN ==========
-        draw_centered("RESOLUCION DIAN", FONT_BOLD, 7)
-        
-        if resolution:
-            draw_centered(f"Resolucion No. {resolution.resolution}", FONT, 6)
-            if resolution.resolution_date:
-                draw_centered(f"Fecha: {resolution.resolution_date.strftime('%Y-%m-%d')}", FONT, 6)
-            if resolution.date_from and resolution.date_to:
-                vigencia = f"Vigencia: {resolution.date_from.strftime('%Y-%m-%d')} a {resolution.date_to.strftime('%Y-%m-%d')}"
-                draw_centered(vigencia, FONT, 5)
-            draw_centered(f"Prefijo: {resolution.prefix} del {resolution.from_number} al {resolution.to_number}", FONT, 6)
-        
-        space(2)
-        
-        # ========== CUFE/CUDE ==========
-        cufe_label = "CUFE" if doc.type == "invoice" else "CUDE"
-        draw_centered(cufe_label, FONT_BOLD, 7)
-        
-        if doc.cufe:
-            cufe = doc.cufe
-            chunk_size = 48
-            for i in range(0, len(cufe), chunk_size):
-                chunk = cufe[i:i+chunk_size]
-                draw_centered(chunk, FONT, 5)
-            
-            space(2)
-            
-            # URL según ambiente (habilitación o producción)
-            is_production = settings and settings.type_environment_id == 1
-            if is_production:
-                qr_url = f"https://catalogo-vpfe.dian.gov.co/document/searchqr?documentkey={doc.cufe}"
-                dian_url = "catalogo-vpfe.dian.gov.co"
-            else:
-                qr_url = f"https://catalogo-vpfe-hab.dian.gov.co/document/searchqr?documentkey={doc.cufe}"
-                dian_url = "catalogo-vpfe-hab.dian.gov.co"
-            
-            # QR Code
-            qr = qrcode.QRCode(version=1, box_size=10, border=1)
-            qr.add_data(qr_url)
-            qr.make(fit=True)
-            qr_img = qr.make_image(fill_color="black", back_color="white")
-            
-            qr_buffer = BytesIO()
-            qr_img.save(qr_buffer, format='PNG')
-            qr_buffer.seek(0)
-            
-            qr_size = 26 * mm_unit
-            qr_x = (TICKET_WIDTH - qr_size) / 2
-            c.drawImage(ImageReader(qr_buffer), qr_x, y - qr_size, width=qr_size, height=qr_size)
-            y -= qr_size + 2 * mm_unit
-            
-            draw_centered(f"Consulte en: {dian_url}", FONT, 5)
-        
-        space(2)
-        
-        # ========== PIE DE PÁGINA ==========
-        draw_centered("Representacion grafica de", FONT, 6)
-        draw_centered("Factura Electronica", FONT, 6)
-        space(1)
-        draw_centered("Gracias por su compra!", FONT_BOLD, 8)
-        
-        space(3)
-        
-        # ========== EMITIDO POR (DATOS DEL EMISOR) ==========
-        draw_centered(f"Emitido por: {company_name}", FONT, 6)
-        draw_centered(f"NIT: {company_nit}-{company_dv}", FONT, 6)
-        draw_centered("Modalidad: Software propio", FONT, 6)
-        
-        # Guardar PDF
-        try:
-            c.save()
-        except PermissionError:
-            snackbar(self.page, "Cierre el PDF anterior antes de imprimir otro", "warning")
+        if not docs:
+            snackbar(self.page, "Solo se pueden imprimir documentos enviados", "warning")
             return
-        
-        # Enviar directamente a impresión
-        try:
-            import sys
-            if sys.platform == 'win32':
-                import ctypes
-                result = ctypes.windll.shell32.ShellExecuteW(
-                    None, "print", pdf_path, None, None, 1
-                )
-                if result > 32:
-                    snackbar(self.page, "Enviado a impresión", "success")
-                else:
-                    os.startfile(pdf_path)
-                    snackbar(self.page, "Ticket abierto - Use Ctrl+P para imprimir", "success")
-            else:
-                os.startfile(pdf_path)
-                snackbar(self.page, "Ticket abierto - Use Ctrl+P para imprimir", "success")
-        except Exception as e:
-            snackbar(self.page, f"Ticket guardado: {pdf_path}", "success")
+        self._print_tickets(docs)
+        self.selected_ids.clear()
+        self._load_documents()
+
+    def _on_select(self, e, doc_id: int):
+        if e.control.value:
+            self.selected_ids.add(doc_id)
+        else:
+            self.selected_ids.discard(doc_id)
+
+    def _on_select_page(self, e):
+        """Seleccionar/deseleccionar todos los documentos enviados de la página"""
+        if e.control.value:
+            self.selected_ids.update(self.page_sent_ids)
+        else:
+            self.selected_ids.difference_update(self.page_sent_ids)
+        self._load_documents()
 
     def _close(self, dlg):
         dlg.open = False
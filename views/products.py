@@ -1,6 +1,7 @@
 """Vista de Productos/Servicios"""
 import flet as ft
 from database import get_session, Product
+from services.sql_monitor import sql_action
 from views.theme import COLORS, button, text_field, dropdown, section_title, divider, snackbar
 
 
@@ -12,6 +13,7 @@ class ProductsView:
         self.current_page = 1
         self.per_page = 15
 
+    @sql_action
     def _load_products(self):
         session = get_session()
         query = session.query(Product).filter(Product.is_active == True)
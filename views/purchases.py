@@ -7,6 +7,7 @@ from database import (
     Department, Municipality
 )
 from services import ApiDianService
+from services.sql_monitor import sql_action
 from views.theme import COLORS, button, text_field, dropdown, section_title, divider, snackbar
 
 
@@ -32,6 +33,7 @@ class PurchasesView:
         self.catalogs["municipalities"] = session.query(Municipality).all()
         session.close()
 
+    @sql_action
     def _load_documents(self):
         session = get_session()
         query = session.query(Document).filter(Document.type.in_(["support_document", "sd_adjustment_note"]))
@@ -250,6 +252,7 @@ class PurchasesView:
         self.pagination.controls = self._build_pagination().controls
         self.page.update()
 
+    @sql_action
     def _show_new_document_form(self, e):
         """Mostrar formulario para nuevo documento soporte"""
         session = get_session()
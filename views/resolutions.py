@@ -3,6 +3,7 @@ import flet as ft
 from datetime import datetime
 from database import get_session, Resolution
 from services import ApiDianService
+from services.sql_monitor import sql_action
 from views.theme import COLORS, button, text_field, dropdown, badge, snackbar
 
 
@@ -28,6 +29,7 @@ class ResolutionsView:
             expand=True, padding=24, bgcolor=COLORS["bg_primary"],
         )
 
+    @sql_action
     def _load(self, e=None):
         session = get_session()
         resolutions = session.query(Resolution).order_by(Resolution.type_document_id).all()
@@ -2,6 +2,7 @@
 import flet as ft
 import os
 import base64
+import logging
 from database import (
     get_session, Settings,
     TypeDocumentIdentification, TypeOrganization, TypeRegime,
@@ -10,6 +11,8 @@ from database import (
 from services import ApiDianService
 from views.theme import COLORS, button, text_field, dropdown, section_title, divider, snackbar
 
+logger = logging.getLogger(__name__)
+
 
 class SettingsView:
     def __init__(self, page: ft.Page):
@@ -52,7 +55,9 @@ class SettingsView:
                 ft.Tab(text="Certificado", icon=ft.Icons.VERIFIED_USER, content=self._build_certificate_tab()),
                 ft.Tab(text="Correo SMTP", icon=ft.Icons.EMAIL, content=self._build_mail_tab()),
                 ft.Tab(text="Carpetas", icon=ft.Icons.FOLDER, content=self._build_folders_tab()),
+                ft.Tab(text="Impresora", icon=ft.Icons.PRINT, content=self._build_printer_tab()),
                 ft.Tab(text="Base de Datos", icon=ft.Icons.STORAGE, content=self._build_database_tab()),
+                ft.Tab(text="Diagnóstico", icon=ft.Icons.SPEED, content=self._build_diagnostics_tab()),
             ],
             expand=True,
             indicator_color=COLORS["primary"],
@@ -369,16 +374,179 @@ class SettingsView:
         self.fields["mail_password"] = text_field("Contraseña", self.settings.mail_password or "", password=True)
         self.fields["mail_encryption"] = dropdown("Encriptación", self.settings.mail_encryption or "tls",
             [ft.dropdown.Option("tls", "TLS"), ft.dropdown.Option("ssl", "SSL"), ft.dropdown.Option("", "Ninguna")], width=150)
+        self.fields["mail_rate_per_minute"] = text_field("Correos por minuto", str(self.settings.mail_rate_per_minute or 20), width=150)
         return ft.Container(
             content=ft.Column([
                 section_title("Configuración de Correo SMTP", "Para enviar documentos por email"), divider(),
                 ft.Row([self.fields["mail_host"], self.fields["mail_port"]], spacing=12, wrap=True),
                 self.fields["mail_username"],
                 ft.Row([self.fields["mail_password"], self.fields["mail_encryption"]], spacing=12, wrap=True),
+                self.fields["mail_rate_per_minute"],
+            ], spacing=16),
+            padding=24,
+        )
+
+    def _build_printer_tab(self) -> ft.Container:
+        self.fields["ticket_printer_mode"] = dropdown("Salida de tickets", self.settings.ticket_printer_mode or "pdf",
+            [ft.dropdown.Option("pdf", "PDF (visor / impresora de Windows)"), ft.dropdown.Option("escpos", "ESC/POS directo")], width=300)
+        self.fields["ticket_printer_target"] = text_field("Impresora ESC/POS", self.settings.ticket_printer_target or "", width=300)
+        self.fields["ticket_printer_columns"] = text_field("Caracteres por línea", str(self.settings.ticket_printer_columns or 48), width=150)
+        return ft.Container(
+            content=ft.Column([
+                section_title("Impresora de Tickets", "Impresión directa en impresoras térmicas"), divider(),
+                self.fields["ticket_printer_mode"],
+                ft.Row([self.fields["ticket_printer_target"], self.fields["ticket_printer_columns"]], spacing=12, wrap=True),
+                ft.Text("Ejemplos: 192.168.1.50:9100 (red), COM3 o /dev/usb/lp0 (USB), \\\\PC\\ticket (compartida)",
+                        color=COLORS["text_secondary"], size=12),
             ], spacing=16),
             padding=24,
         )
 
+    def _build_diagnostics_tab(self) -> ft.Container:
+        """Latencia por etapa (p50/p95/p99) de envíos e importaciones"""
+        self.metrics_days = dropdown("Periodo", "7", [
+            ft.dropdown.Option("1", "Último día"), ft.dropdown.Option("7", "Últimos 7 días"),
+            ft.dropdown.Option("30", "Últimos 30 días")], width=200,
+            on_change=lambda e: self._load_metrics(update=True))
+        self.metrics_table = ft.DataTable(
+            columns=[ft.DataColumn(ft.Text(label, size=12, weight=ft.FontWeight.W_600), numeric=numeric)
+                     for label, numeric in [("Operación", False), ("Etapa", False), ("Cantidad", True),
+                                            ("p50 ms", True), ("p95 ms", True), ("p99 ms", True), ("Máx ms", True)]],
+            rows=[],
+            border=ft.border.all(1, COLORS["border"]),
+            border_radius=8,
+            heading_row_color=COLORS["bg_secondary"],
+            data_row_min_height=32,
+            column_spacing=24,
+        )
+        self._load_metrics()
+        self._build_profiling_controls()
+        self._build_sql_controls()
+        return ft.Container(
+            content=ft.Column([
+                section_title("Diagnóstico", "Tiempos por etapa del envío a la DIAN y de la importación de XMLs"), divider(),
+                ft.Row([self.metrics_days, button("Actualizar", lambda e: self._load_metrics(update=True),
+                                                  color="info", icon=ft.Icons.REFRESH)], spacing=12),
+                self.metrics_table,
+                ft.Text("http incluye la validación de la DIAN; total es la operación completa.",
+                        color=COLORS["text_secondary"], size=12),
+                ft.Container(height=8),
+                section_title("Perfilado", "cProfile / tracemalloc de inicio, escaneo, envíos y carga de documentos"), divider(),
+                ft.Row([self.profile_mode, self.profile_file], spacing=12, wrap=True),
+                self.profile_table,
+                ft.Container(height=8),
+                section_title("Consultas SQL", "Consultas lentas y cantidad de consultas por acción (posibles N+1)"), divider(),
+                ft.Row([button("Exportar CSV", self._export_sql, color="info", icon=ft.Icons.DOWNLOAD)], spacing=12),
+                self.sql_actions_table,
+                self.slow_queries_table,
+            ], spacing=16, scroll=ft.ScrollMode.AUTO),
+            padding=24,
+        )
+
+    def _build_profiling_controls(self):
+        from services.profiling import get_mode
+        self.profile_mode = dropdown("Modo de perfilado", get_mode(), [
+            ft.dropdown.Option("off", "Desactivado"), ft.dropdown.Option("cpu", "CPU (cProfile)"),
+            ft.dropdown.Option("memory", "Memoria (tracemalloc)"), ft.dropdown.Option("all", "CPU y memoria")],
+            width=250, on_change=self._on_profile_mode_change)
+        self.profile_file = dropdown("Perfil guardado", None, [], width=420, on_change=lambda e: self._show_profile(update=True))
+        self.profile_table = ft.DataTable(columns=[ft.DataColumn(ft.Text("Sin perfiles", size=12))], rows=[],
+                                          border=ft.border.all(1, COLORS["border"]), border_radius=8,
+                                          heading_row_color=COLORS["bg_secondary"], data_row_min_height=28,
+                                          column_spacing=20)
+        self._load_profiles()
+
+    def _on_profile_mode_change(self, e):
+        from services.profiling import set_mode
+        set_mode(self.profile_mode.value)
+        snackbar(self.page, "Perfilado activo hasta reiniciar la aplicación" if self.profile_mode.value != "off"
+                 else "Perfilado desactivado", "info")
+
+    def _load_profiles(self):
+        from services.profiling import list_profiles
+        profiles = list_profiles()
+        self.profile_file.options = [ft.dropdown.Option(p["path"], p["name"]) for p in profiles]
+        if profiles and self.profile_file.value not in [p["path"] for p in profiles]:
+            self.profile_file.value = profiles[0]["path"]
+        self._show_profile()
+
+    def _show_profile(self, update: bool = False):
+        """Top de funciones (.prof) o de asignaciones de memoria (.snapshot)"""
+        from services.profiling import cpu_summary, memory_summary
+        path = self.profile_file.value
+        if not path:
+            return
+        try:
+            if path.endswith(".prof"):
+                headers = [("Función", False), ("Llamadas", True), ("Propio s", True), ("Acumulado s", True)]
+                rows = [[r["function"], str(r["calls"]), f"{r['tottime']:.4f}", f"{r['cumtime']:.4f}"] for r in cpu_summary(path)]
+            else:
+                headers = [("Línea", False), ("KB", True), ("Bloques", True)]
+                rows = [[r["location"], f"{r['size_kb']:,.1f}", str(r["count"])] for r in memory_summary(path)]
+        except Exception as ex:
+            snackbar(self.page, f"No se pudo leer el perfil: {ex}", "danger")
+            return
+        self.profile_table.columns = [ft.DataColumn(ft.Text(label, size=12, weight=ft.FontWeight.W_600), numeric=numeric)
+                                      for label, numeric in headers]
+        self.profile_table.rows = [ft.DataRow(cells=[ft.DataCell(ft.Text(value, size=11, selectable=True)) for value in row])
+                                   for row in rows]
+        if update:
+            self.page.update()
+
+    def _build_sql_controls(self):
+        def table(headers):
+            return ft.DataTable(
+                columns=[ft.DataColumn(ft.Text(label, size=12, weight=ft.FontWeight.W_600), numeric=numeric)
+                         for label, numeric in headers],
+                rows=[], border=ft.border.all(1, COLORS["border"]), border_radius=8,
+                heading_row_color=COLORS["bg_secondary"], data_row_min_height=28, column_spacing=20)
+
+        self.sql_actions_table = table([("Acción", False), ("Veces", True), ("Consultas prom.", True),
+                                        ("Consultas máx.", True), ("SQL ms", True)])
+        self.slow_queries_table = table([("Hora", False), ("ms", True), ("Acción", False), ("Consulta", False)])
+        self._load_sql_stats()
+
+    def _load_sql_stats(self):
+        from services.sql_monitor import action_stats, slow_queries
+        self.sql_actions_table.rows = [
+            ft.DataRow(cells=[ft.DataCell(ft.Text(value, size=11)) for value in [
+                row["action"], str(row["invocations"]), f"{row['avg_queries']:.1f}", str(row["max_queries"]),
+                f"{row['sql_ms']:,.0f}"]])
+            for row in action_stats()[:30]
+        ]
+        self.slow_queries_table.rows = [
+            ft.DataRow(cells=[ft.DataCell(ft.Text(value, size=11, selectable=True)) for value in [
+                row["time"][11:], f"{row['duration_ms']:,.0f}", row["action"] or row["caller"], row["statement"][:120]]])
+            for row in slow_queries()[:50]
+        ]
+
+    def _export_sql(self, e):
+        from services.sql_monitor import export_csv
+        try:
+            directory = export_csv()
+        except OSError as ex:
+            snackbar(self.page, f"No se pudo exportar: {ex}", "danger")
+            return
+        snackbar(self.page, f"Consultas exportadas a {directory}", "success")
+
+    def _load_metrics(self, update: bool = False):
+        from services.metrics import summary
+        if update:
+            self._load_profiles()
+            self._load_sql_stats()
+        rows = summary(days=int(self.metrics_days.value or 7))
+        self.metrics_table.rows = [
+            ft.DataRow(cells=[
+                ft.DataCell(ft.Text(row["operation"], size=12)),
+                ft.DataCell(ft.Text(row["stage"], size=12)),
+                ft.DataCell(ft.Text(str(row["count"]), size=12)),
+                *[ft.DataCell(ft.Text(f"{row[key]:,.1f}", size=12)) for key in ("p50", "p95", "p99", "max")],
+            ])
+            for row in rows
+        ]
+        if update:
+            self.page.update()
+
     def _build_folders_tab(self) -> ft.Container:
         self.fields["watch_folder"] = text_field("Carpeta de XMLs", self.settings.watch_folder or r"D:\SIIWI01\DOCELECTRONICOS")
         self.fields["processed_folder"] = text_field("Carpeta Procesados", self.settings.processed_folder or r"D:\SIIWI01\DOCELECTRONICOS\procesados")
@@ -941,8 +1109,7 @@ class SettingsView:
         # Convertir a base64
         try:
             cert_base64 = base64.b64encode(self.certificate_content).decode("utf-8")
-            # Debug: mostrar tamaño del base64
-            print(f"Certificate base64 length: {len(cert_base64)}")
+            logger.debug("Certificado en base64: %d caracteres", len(cert_base64))
         except Exception as ex:
             snackbar(self.page, f"Error codificando certificado: {str(ex)}", "danger")
             return
@@ -960,6 +1127,14 @@ class SettingsView:
             snackbar(self.page, f"Error: {error_msg}", "danger")
 
     def _save(self, e):
+        mail_rate = (self.fields["mail_rate_per_minute"].value or "20").strip()
+        if not mail_rate.isdigit() or int(mail_rate) < 1:
+            snackbar(self.page, "Correos por minuto debe ser un número entero mayor que cero", "danger")
+            return
+        ticket_columns = (self.fields["ticket_printer_columns"].value or "48").strip()
+        if not ticket_columns.isdigit():
+            snackbar(self.page, "Caracteres por línea debe ser un número entero (58mm: 32, 80mm: 48)", "danger")
+            return
         session = get_session()
         s = session.query(Settings).first()
         s.type_document_identification_id = int(self.fields["type_document_identification_id"].value or 3)
@@ -991,6 +1166,11 @@ class SettingsView:
         s.mail_username = self.fields["mail_username"].value
         s.mail_password = self.fields["mail_password"].value
         s.mail_encryption = self.fields["mail_encryption"].value
+        s.mail_rate_per_minute = int(mail_rate)
+        s.ticket_printer_mode = self.fields["ticket_printer_mode"].value or "pdf"
+        s.ticket_printer_target = self.fields["ticket_printer_target"].value
+        s.ticket_printer_columns = min(64, max(24, int(ticket_columns)))  # Rango de las impresoras térmicas
+        self.fields["ticket_printer_columns"].value = str(s.ticket_printer_columns)
         s.watch_folder = self.fields["watch_folder"].value
         s.processed_folder = self.fields["processed_folder"].value
         session.commit()